@@ -0,0 +1,284 @@
+# MIT License
+# 
+# Copyright (c) 2023 MiscellaneousStuff
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""Benchmarks the conversion and build pipeline on synthetic replays.
+
+Generates synthetic games, then measures the throughput, peak memory and
+bytes written of each pipeline stage: converting JSON to replay DBs,
+building datasets from DBs and from JSON, and loading and collating the
+built games (when torch is installed). Results can be saved as a baseline
+and later runs compared against it, failing when a stage regressed by more
+than the tolerance.
+
+Also checks that the build paths agree: building from JSON and building
+several players at once must produce the same dataset as building one
+player from its replay DB."""
+
+import os
+import sys
+import json
+import sqlite3
+import tempfile
+import contextlib
+
+from absl import app
+from absl import flags
+
+from tlol.datasets.synthetic import write_replay
+from tlol.datasets.convertor import convert_dataset, TABLES
+from tlol.datasets.builder import go, go_json, go_players, ALL_PLAYERS
+from tlol.lib.profiling import profile
+
+FLAGS = flags.FLAGS
+flags.DEFINE_string("work_dir", None, "(Optional) Directory for the generated files, a temporary directory by default")
+flags.DEFINE_integer("games", 2, "Number of synthetic games")
+flags.DEFINE_float("duration", 300.0, "Length of each synthetic game in seconds")
+flags.DEFINE_float("interval", 0.25, "Seconds between observations")
+flags.DEFINE_integer("minions", 30, "Minions per observation")
+flags.DEFINE_integer("turrets", 22, "Turrets per observation")
+flags.DEFINE_integer("jungle", 12, "Jungle camps per observation")
+flags.DEFINE_integer("others", 2, "Other objects per observation")
+flags.DEFINE_float("missiles_per_sec", 2.0, "Average missiles spawned per second")
+flags.DEFINE_string("player", "jinx", "Player to tailor observations towards")
+flags.DEFINE_list("stages", ["convert", "build", "build_json", "dataset"], "Stages to benchmark")
+flags.DEFINE_string("baseline", None, "(Optional) Baseline results to compare against")
+flags.DEFINE_string("save_baseline", None, "(Optional) Save the results as a baseline to this path")
+flags.DEFINE_float("tolerance", 0.2, "Relative slowdown or growth before a metric counts as a regression")
+flags.DEFINE_bool("quiet", True, "Hide the pipeline's own progress output")
+flags.DEFINE_bool("check_parity", True, "Check that go_json and go_players build the same datasets as go")
+
+# Metrics where higher is better, the rest are better when lower
+HIGHER_IS_BETTER = ["rows_per_sec", "frames_per_sec"]
+
+def dir_bytes(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        total += sum(os.path.getsize(os.path.join(root, f)) for f in files)
+    return total
+
+def count_rows(db_path):
+    con = sqlite3.connect(db_path)
+    rows = sum(con.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+               for table in TABLES)
+    con.close()
+    return rows
+
+@contextlib.contextmanager
+def measure(results, stage, out_dir):
+    """Records the wall time, peak RSS and bytes written to `out_dir` of the
+    block. The block fills in the `rows` and `frames` it processed."""
+    os.makedirs(out_dir, exist_ok=True)
+    counts = {"rows": 0, "frames": 0}
+    with quieted(), profile() as timer:
+        yield counts
+    prof = timer.as_dict()
+    seconds = prof["total_seconds"]
+    results[stage] = {
+        "seconds": seconds,
+        "rows_per_sec": counts["rows"] / seconds,
+        "frames_per_sec": counts["frames"] / seconds,
+        "peak_rss_mb": prof["peak_rss_mb"],
+        "bytes_written": dir_bytes(out_dir)
+    }
+
+def run_benchmark(work_dir):
+    json_dir = os.path.join(work_dir, "json")
+    os.makedirs(json_dir, exist_ok=True)
+    json_paths = []
+    frames = 0
+    for game_id in range(FLAGS.games):
+        path, game_frames = write_replay(
+            json_dir, 1000 + game_id,
+            duration=FLAGS.duration,
+            interval=FLAGS.interval,
+            minions=FLAGS.minions,
+            turrets=FLAGS.turrets,
+            jungle=FLAGS.jungle,
+            others=FLAGS.others,
+            missiles_per_sec=FLAGS.missiles_per_sec,
+            seed=game_id)
+        json_paths.append(path)
+        frames += game_frames
+    print(f"Generated {len(json_paths)} games, {frames} observations")
+
+    results = {}
+    db_dir = os.path.join(work_dir, "db")
+    if "convert" in FLAGS.stages or "build" in FLAGS.stages:
+        with measure(results, "convert", db_dir) as counts:
+            for path in json_paths:
+                convert_dataset(path, db_dir)
+            counts["frames"] = frames
+            counts["rows"] = sum(count_rows(os.path.join(db_dir, f))
+                                 for f in os.listdir(db_dir))
+
+    built_dir = None
+    for stage, build, src_dir, ext in [
+            ("build", go, db_dir, ".db"),
+            ("build_json", go_json, json_dir, ".json")]:
+        if stage not in FLAGS.stages:
+            continue
+        out_dir = os.path.join(work_dir, stage)
+        with measure(results, stage, out_dir) as counts:
+            for fi in sorted(os.listdir(src_dir)):
+                if fi.endswith(ext):
+                    build(os.path.join(src_dir, fi), FLAGS.player, 5.0, out_dir)
+        built_dir = out_dir
+        counts_built(results[stage], out_dir)
+
+    if "dataset" in FLAGS.stages and built_dir:
+        try:
+            from tlol.datasets.replay_dataset import TLoLReplayDataset
+        except ImportError as exc:
+            print("Skipping dataset stage:", exc)
+        else:
+            with measure(results, "dataset", os.path.join(work_dir, "dataset")) as counts:
+                dataset = TLoLReplayDataset(built_dir)
+                batch = [dataset[i] for i in range(len(dataset))]
+                TLoLReplayDataset.collate_fixed_length(batch)
+                counts["frames"] = sum(ex["raw"].shape[0] for ex in batch)
+                counts["rows"] = counts["frames"]
+
+    mismatches = []
+    if FLAGS.check_parity:
+        mismatches = check_parity(work_dir, json_dir, db_dir)
+
+    return results, mismatches
+
+@contextlib.contextmanager
+def quieted():
+    with contextlib.ExitStack() as stack:
+        if FLAGS.quiet:
+            quiet = stack.enter_context(open(os.devnull, "w"))
+            stack.enter_context(contextlib.redirect_stdout(quiet))
+        yield
+
+def check_parity(work_dir, json_dir, db_dir):
+    """Builds every replay with `go`, `go_json` and `go_players` (all
+    players) and returns the mismatches of the latter two against `go`, as
+    a list of (build, pickle, reason)."""
+    import pandas as pd
+
+    parity_dir = os.path.join(work_dir, "parity")
+    out_dirs = {name: os.path.join(parity_dir, name)
+                for name in ["go", "go_json", "go_players"]}
+    for out_dir in out_dirs.values():
+        os.makedirs(out_dir, exist_ok=True)
+
+    with quieted():
+        os.makedirs(db_dir, exist_ok=True)
+        if not os.listdir(db_dir):
+            for fi in sorted(os.listdir(json_dir)):
+                convert_dataset(os.path.join(json_dir, fi), db_dir)
+        for fi in sorted(os.listdir(db_dir)):
+            db_path = os.path.join(db_dir, fi)
+            json_path = os.path.join(json_dir, os.path.splitext(fi)[0] + ".json")
+            go(db_path, FLAGS.player, 5.0, out_dirs["go"])
+            go_json(json_path, FLAGS.player, 5.0, out_dirs["go_json"])
+            go_players(db_path, ALL_PLAYERS, 5.0, out_dirs["go_players"])
+
+    mismatches = []
+    expected = sorted(fi for fi in os.listdir(out_dirs["go"]) if fi.endswith(".pkl"))
+    if not expected:
+        mismatches.append(("go", "*.pkl", "no datasets built"))
+    for fi in expected:
+        base_df = pd.read_pickle(os.path.join(out_dirs["go"], fi))
+        for name in ["go_json", "go_players"]:
+            path = os.path.join(out_dirs[name], fi)
+            if not os.path.exists(path):
+                mismatches.append((name, fi, "missing"))
+                continue
+            df = pd.read_pickle(path)
+            if df.shape != base_df.shape or list(df.columns) != list(base_df.columns):
+                mismatches.append(
+                    (name, fi, f"shape {df.shape} != {base_df.shape}"))
+            elif not df.equals(base_df):
+                cells = int((df.ne(base_df) & ~(df.isna() & base_df.isna())).sum().sum())
+                mismatches.append((name, fi, f"{cells} cells differ"))
+    return mismatches
+
+def counts_built(result, out_dir):
+    """Fills in the frames per second of a build stage from its manifests."""
+    from tlol.datasets.manifest import collect_manifests
+    built_frames = sum(m["frames"] for m in collect_manifests(out_dir, max_workers=1))
+    result["frames_per_sec"] = built_frames / result["seconds"]
+    result["rows_per_sec"] = result["frames_per_sec"]
+
+def compare(results, baseline, tolerance):
+    """Returns the regressed metrics of `results` relative to `baseline`."""
+    regressions = []
+    for stage, metrics in results.items():
+        for metric, value in metrics.items():
+            base = baseline.get(stage, {}).get(metric)
+            if not base or metric == "seconds":
+                continue
+            change = (value - base) / base
+            if metric in HIGHER_IS_BETTER:
+                regressed = change < -tolerance
+            else:
+                regressed = change > tolerance
+            if regressed:
+                regressions.append((stage, metric, base, value, change))
+    return regressions
+
+def print_results(results):
+    print(f"{'stage':<12} {'seconds':>8} {'rows/s':>10} {'frames/s':>9} "
+          f"{'peak MB':>8} {'written MB':>10}")
+    for stage, m in results.items():
+        print(f"{stage:<12} {m['seconds']:>8.2f} {m['rows_per_sec']:>10.0f} "
+              f"{m['frames_per_sec']:>9.1f} {m['peak_rss_mb']:>8.0f} "
+              f"{m['bytes_written'] / 1e6:>10.2f}")
+
+def main(unused_argv):
+    if FLAGS.work_dir:
+        results, mismatches = run_benchmark(FLAGS.work_dir)
+    else:
+        with tempfile.TemporaryDirectory() as work_dir:
+            results, mismatches = run_benchmark(work_dir)
+
+    print_results(results)
+    for name, fi, reason in mismatches:
+        print(f"PARITY: {name} {fi}: {reason}")
+    if FLAGS.check_parity and not mismatches:
+        print("go_json and go_players match go")
+
+    if FLAGS.save_baseline:
+        with open(FLAGS.save_baseline, "w") as f:
+            json.dump(results, f, indent=2)
+        print("Saved baseline:", FLAGS.save_baseline)
+
+    if FLAGS.baseline:
+        with open(FLAGS.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, FLAGS.tolerance)
+        for stage, metric, base, value, change in regressions:
+            print(f"REGRESSION: {stage} {metric}: {base:.2f} -> {value:.2f} ({change * 100:+.1f}%)")
+        if regressions:
+            sys.exit(1)
+        print("No regressions against", FLAGS.baseline)
+
+    if mismatches:
+        sys.exit(1)
+
+def entry_point():
+    app.run(main)
+
+if __name__ == "__main__":
+    app.run(main)
@@ -19,9 +19,11 @@
 # LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
-"""Builds an SQLite database from ROFL file embedded JSON data for analysis."""
+"""Builds an SQLite database or Parquet file of per-player stats from ROFL
+file embedded JSON data for analysis. Players can be filtered by champion
+and by role so per-champion stats tables can be built in a single pass
+over the replay archive."""
 
-import json
 import sqlite3
 
 import os
@@ -29,11 +31,17 @@ import os
 from absl import app
 from absl import flags
 
-from tlol.replays.scraper import ReplayScraper
+from tlol.replays.rofl import ReplayIndex
 
 FLAGS = flags.FLAGS
 flags.DEFINE_string("replay_dir", None,  "League of Legends *.rofl replay directory")
 flags.DEFINE_integer("max_games", -1,    "(Optional) Maximum number of replays to build metadata for")
+flags.DEFINE_string("index_path", None,  "(Default: <replay_dir>/rofl_index.db) Replay metadata index")
+flags.DEFINE_string("champs",     "",    "(Default: \"\", any champion) Comma-separated list of champions to extract")
+flags.DEFINE_string("roles",      "",    "(Default: \"\", any role) Comma-separated list of team positions to extract, e.g. BOTTOM,UTILITY")
+flags.DEFINE_string("out_path",   "players.db", "Output SQLite database or Parquet file")
+flags.DEFINE_enum("format",       "sqlite", ["sqlite", "parquet"], "Output format")
+flags.DEFINE_integer("batch_size", 10000, "Number of player rows written per batch")
 flags.mark_flag_as_required('replay_dir')
 
 SQL_TO_JSON_MAPPING = { "team": "TEAM", "seconds": "TIME_PLAYED", "kills": "CHAMPIONS_KILLED", "deaths": "NUM_DEATHS", "gold_earned": "GOLD_EARNED", "damage_dealt": "TOTAL_DAMAGE_DEALT_TO_CHAMPIONS", "time_spent_dead": "TOTAL_TIME_SPENT_DEAD", "win": "WIN", "all_in_pings": "ALL_IN_PINGS", "assists": "ASSISTS", "assist_me_pings": "ASSIST_ME_PINGS", "bait_pings": "BAIT_PINGS", "baron_kills": "BARON_KILLS", "barracks_killed": "BARRACKS_KILLED", "barracks_takedowns": "BARRACKS_TAKEDOWNS", "basic_pings": "BASIC_PINGS", "bounty_level": "BOUNTY_LEVEL", "champions_killed": "CHAMPIONS_KILLED", "champion_mission_stat_0": "CHAMPION_MISSION_STAT_0", "champion_mission_stat_1": "CHAMPION_MISSION_STAT_1", "champion_mission_stat_2": "CHAMPION_MISSION_STAT_2", "champion_mission_stat_3": "CHAMPION_MISSION_STAT_3", "champion_transform": "CHAMPION_TRANSFORM", "command_pings": "COMMAND_PINGS", "consumables_purchased": "CONSUMABLES_PURCHASED", "danger_pings": "DANGER_PINGS", "double_kills": "DOUBLE_KILLS", "dragon_kills": "DRAGON_KILLS", "enemy_missing_pings": "ENEMY_MISSING_PINGS", "enemy_vision_pings": "ENEMY_VISION_PINGS", "exp": "EXP", "friendly_dampen_lost": "FRIENDLY_DAMPEN_LOST", "friendly_hq_lost": "FRIENDLY_HQ_LOST", "friendly_turret_lost": "FRIENDLY_TURRET_LOST", "game_ended_in_early_surrender": "GAME_ENDED_IN_EARLY_SURRENDER", "game_ended_in_surrender": "GAME_ENDED_IN_SURRENDER", "get_back_pings": "GET_BACK_PINGS", "gold_spent": "GOLD_SPENT", "hold_pings": "HOLD_PINGS", "horde_kills": "HORDE_KILLS", "hq_killed": "HQ_KILLED", "hq_takedowns": "HQ_TAKEDOWNS", "id": "ID", "individual_position": "INDIVIDUAL_POSITION", "item0": "ITEM0", "item1": "ITEM1", "item2": "ITEM2", "item3": "ITEM3", "item4": "ITEM4", "item5": "ITEM5", "item6": "ITEM6", "items_purchased": "ITEMS_PURCHASED", "keystone_id": "KEYSTONE_ID", "killing_sprees": "KILLING_SPREES", "largest_ability_damage": "LARGEST_ABILITY_DAMAGE", "largest_attack_damage": "LARGEST_ATTACK_DAMAGE", "largest_critical_strike": "LARGEST_CRITICAL_STRIKE", "largest_killing_spree": "LARGEST_KILLING_SPREE", "largest_multi_kill": "LARGEST_MULTI_KILL", "last_takedown_time": "LAST_TAKEDOWN_TIME", "level": "LEVEL", "longest_time_spent_living": "LONGEST_TIME_SPENT_LIVING", "magic_damage_dealt_player": "MAGIC_DAMAGE_DEALT_PLAYER", "magic_damage_dealt_to_champions": "MAGIC_DAMAGE_DEALT_TO_CHAMPIONS", "magic_damage_taken": "MAGIC_DAMAGE_TAKEN", "minions_killed": "MINIONS_KILLED", "muted_all": "MUTED_ALL", "name": "NAME", "need_vision_pings": "NEED_VISION_PINGS", "neutral_minions_killed": "NEUTRAL_MINIONS_KILLED", "neutral_minions_killed_enemy_jungle": "NEUTRAL_MINIONS_KILLED_ENEMY_JUNGLE", "neutral_minions_killed_your_jungle": "NEUTRAL_MINIONS_KILLED_YOUR_JUNGLE", "node_capture": "NODE_CAPTURE", "node_capture_assist": "NODE_CAPTURE_ASSIST", "node_neutralize": "NODE_NEUTRALIZE", "node_neutralize_assist": "NODE_NEUTRALIZE_ASSIST", "num_deaths": "NUM_DEATHS", "objectives_stolen": "OBJECTIVES_STOLEN", "objectives_stolen_assists": "OBJECTIVES_STOLEN_ASSISTS", "on_my_way_pings": "ON_MY_WAY_PINGS", "penta_kills": "PENTA_KILLS", "perk0": "PERK0", "perk0_var1": "PERK0_VAR1", "perk0_var2": "PERK0_VAR2", "perk0_var3": "PERK0_VAR3", "perk1": "PERK1", "perk1_var1": "PERK1_VAR1", "perk1_var2": "PERK1_VAR2", "perk1_var3": "PERK1_VAR3", "perk2": "PERK2", "perk2_var1": "PERK2_VAR1", "perk2_var2": "PERK2_VAR2", "perk2_var3": "PERK2_VAR3", "perk3": "PERK3", "perk3_var1": "PERK3_VAR1", "perk3_var2": "PERK3_VAR2", "perk3_var3": "PERK3_VAR3", "perk4": "PERK4", "perk4_var1": "PERK4_VAR1", "perk4_var2": "PERK4_VAR2", "perk4_var3": "PERK4_VAR3", "perk5": "PERK5", "perk5_var1": "PERK5_VAR1", "perk5_var2": "PERK5_VAR2", "perk5_var3": "PERK5_VAR3", "perk_primary_style": "PERK_PRIMARY_STYLE", "perk_sub_style": "PERK_SUB_STYLE", "physical_damage_dealt_player": "PHYSICAL_DAMAGE_DEALT_PLAYER", "physical_damage_dealt_to_champions": "PHYSICAL_DAMAGE_DEALT_TO_CHAMPIONS", "physical_damage_taken": "PHYSICAL_DAMAGE_TAKEN", "ping": "PING", "players_i_muted": "PLAYERS_I_MUTED", "players_that_muted_me": "PLAYERS_THAT_MUTED_ME", "player_augment_1": "PLAYER_AUGMENT_1", "player_augment_2": "PLAYER_AUGMENT_2", "player_augment_3": "PLAYER_AUGMENT_3", "player_augment_4": "PLAYER_AUGMENT_4", "player_position": "PLAYER_POSITION", "player_role": "PLAYER_ROLE", "player_score_0": "PLAYER_SCORE_0", "player_score_1": "PLAYER_SCORE_1", "player_score_10": "PLAYER_SCORE_10", "player_score_11": "PLAYER_SCORE_11", "player_score_2": "PLAYER_SCORE_2", "player_score_3": "PLAYER_SCORE_3", "player_score_4": "PLAYER_SCORE_4", "player_score_5": "PLAYER_SCORE_5", "player_score_6": "PLAYER_SCORE_6", "player_score_7": "PLAYER_SCORE_7", "player_score_8": "PLAYER_SCORE_8", "player_score_9": "PLAYER_SCORE_9", "player_subteam": "PLAYER_SUBTEAM", "player_subteam_placement": "PLAYER_SUBTEAM_PLACEMENT", "push_pings": "PUSH_PINGS", "puuid": "PUUID", "quadra_kills": "QUADRA_KILLS", "retreat_pings": "RETREAT_PINGS", "rift_herald_kills": "RIFT_HERALD_KILLS", "sight_wards_bought_in_game": "SIGHT_WARDS_BOUGHT_IN_GAME", "skin": "SKIN", "spell1_cast": "SPELL1_CAST", "spell2_cast": "SPELL2_CAST", "spell3_cast": "SPELL3_CAST", "spell4_cast": "SPELL4_CAST", "stat_perk_0": "STAT_PERK_0", "stat_perk_1": "STAT_PERK_1", "stat_perk_2": "STAT_PERK_2", "summon_spell1_cast": "SUMMON_SPELL1_CAST", "summon_spell2_cast": "SUMMON_SPELL2_CAST", "team_early_surrendered": "TEAM_EARLY_SURRENDERED", "team_objective": "TEAM_OBJECTIVE", "team_position": "TEAM_POSITION", "time_ccing_others": "TIME_CCING_OTHERS", "time_of_from_last_disconnect": "TIME_OF_FROM_LAST_DISCONNECT", "time_played": "TIME_PLAYED", "time_spent_disconnected": "TIME_SPENT_DISCONNECTED", "total_damage_dealt": "TOTAL_DAMAGE_DEALT", "total_damage_dealt_to_buildings": "TOTAL_DAMAGE_DEALT_TO_BUILDINGS", "total_damage_dealt_to_champions": "TOTAL_DAMAGE_DEALT_TO_CHAMPIONS", "total_damage_dealt_to_objectives": "TOTAL_DAMAGE_DEALT_TO_OBJECTIVES", "total_damage_dealt_to_turrets": "TOTAL_DAMAGE_DEALT_TO_TURRETS", "total_damage_self_mitigated": "TOTAL_DAMAGE_SELF_MITIGATED", "total_damage_shielded_on_teammates": "TOTAL_DAMAGE_SHIELDED_ON_TEAMMATES", "total_damage_taken": "TOTAL_DAMAGE_TAKEN", "total_heal": "TOTAL_HEAL", "total_heal_on_teammates": "TOTAL_HEAL_ON_TEAMMATES", "total_time_crowd_control_dealt": "TOTAL_TIME_CROWD_CONTROL_DEALT", "total_time_crowd_control_dealt_to_champions": "TOTAL_TIME_CROWD_CONTROL_DEALT_TO_CHAMPIONS", "total_time_spent_dead": "TOTAL_TIME_SPENT_DEAD", "total_units_healed": "TOTAL_UNITS_HEALED", "triple_kills": "TRIPLE_KILLS", "true_damage_dealt_player": "TRUE_DAMAGE_DEALT_PLAYER", "true_damage_dealt_to_champions": "TRUE_DAMAGE_DEALT_TO_CHAMPIONS", "true_damage_taken": "TRUE_DAMAGE_TAKEN", "turrets_killed": "TURRETS_KILLED", "turret_takedowns": "TURRET_TAKEDOWNS", "unreal_kills": "UNREAL_KILLS", "victory_point_total": "VICTORY_POINT_TOTAL", "vision_cleared_pings": "VISION_CLEARED_PINGS", "vision_score": "VISION_SCORE", "vision_wards_bought_in_game": "VISION_WARDS_BOUGHT_IN_GAME", "ward_killed": "WARD_KILLED", "ward_placed": "WARD_PLACED", "ward_placed_detector": "WARD_PLACED_DETECTOR", "was_afk": "WAS_AFK", "was_afk_after_failed_surrender": "WAS_AFK_AFTER_FAILED_SURRENDER", "was_early_surrender_accomplice": "WAS_EARLY_SURRENDER_ACCOMPLICE", "was_leaver": "WAS_LEAVER", "was_surrender_due_to_afk": "WAS_SURRENDER_DUE_TO_AFK", "win": "WIN"}
@@ -43,55 +51,138 @@ SQL_METADATA_TABLE = f"""CREATE TABLE IF NOT EXISTS players (
     {",".join([f"{field} {type}" for field, type in zip(SQL_FIELDS, SQL_TYPES)])}
 )"""
 
+def to_int(val):
+    try:
+        return int(val)
+    except (TypeError, ValueError):
+        try:
+            return int(float(val))
+        except (TypeError, ValueError):
+            return 0
+
+def to_float(val):
+    try:
+        return float(val)
+    except (TypeError, ValueError):
+        return 0.0
+
+def compile_row_builder(typed=False):
+    """Projects `SQL_TO_JSON_MAPPING` once into a function which builds
+    a `players` row from a game ID and a player's stats. When `typed` is
+    set, values are converted to the Python type of their SQL column."""
+    converters = {"INTEGER": to_int, "REAL": to_float, "TEXT": str}
+    spec = [(SQL_TO_JSON_MAPPING[sql_field],
+             0 if sql_type in ["REAL", "INTEGER"] else "",
+             converters[sql_type])
+            for sql_field, sql_type in zip(SQL_FIELDS[1:], SQL_TYPES[1:])]
+
+    if typed:
+        def build_row(game_id, player):
+            get = player.get
+            return (game_id,) + tuple(convert(get(json_field, placeholder))
+                                      for json_field, placeholder, convert in spec)
+    else:
+        def build_row(game_id, player):
+            get = player.get
+            return (game_id,) + tuple(get(json_field, placeholder)
+                                      for json_field, placeholder, _ in spec)
+    return build_row
+
+def compile_player_filter(champs, roles):
+    """Returns a predicate which selects players by champion and role."""
+    champs = set(c.strip().lower() for c in champs if c.strip())
+    roles  = set(r.strip().upper() for r in roles if r.strip())
+
+    def player_filter(player):
+        if champs and player.get("SKIN", "").lower() not in champs:
+            return False
+        if roles and player.get("TEAM_POSITION", "").upper() not in roles:
+            return False
+        return True
+    return player_filter
+
+
+class SQLiteWriter(object):
+    def __init__(self, out_path):
+        self.conn = sqlite3.connect(out_path)
+        self.conn.execute(SQL_METADATA_TABLE)
+        question_marks = ",".join(["?" for f in range(len(SQL_FIELDS))])
+        self.insert = f"INSERT INTO players VALUES ({question_marks})"
+
+    def write(self, rows):
+        self.conn.executemany(self.insert, rows)
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+
+class ParquetWriter(object):
+    def __init__(self, out_path):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        arrow_types = {"INTEGER": pa.int64(), "REAL": pa.float64(), "TEXT": pa.string()}
+        self.pa = pa
+        self.schema = pa.schema([(field, arrow_types[sql_type])
+                                 for field, sql_type in zip(SQL_FIELDS, SQL_TYPES)])
+        self.writer = pq.ParquetWriter(out_path, self.schema)
+
+    def write(self, rows):
+        columns = list(zip(*rows))
+        table = self.pa.Table.from_arrays(
+            [self.pa.array(col, type=field.type)
+             for col, field in zip(columns, self.schema)],
+            schema=self.schema)
+        self.writer.write_table(table)
+
+    def close(self):
+        self.writer.close()
+
+
 def main(unused_argv):
-    # Set up SQLite database
-    conn = sqlite3.connect('ezreal_players.db')
-    c = conn.cursor()
-    
-    c.execute(SQL_METADATA_TABLE)
-
-    scraper = ReplayScraper(
-        game_dir="",
-        replay_dir=FLAGS.replay_dir,
-        dataset_dir="",
-        scraper_dir="",
-        region="",
-        replay_speed=0)
-
-    replays = os.listdir(FLAGS.replay_dir)
-    replays = replays[0:FLAGS.max_games]
-
-    print('game_ids:', replays)
+    if FLAGS.format == "parquet":
+        writer = ParquetWriter(FLAGS.out_path)
+    else:
+        writer = SQLiteWriter(FLAGS.out_path)
+    build_row = compile_row_builder(typed=FLAGS.format == "parquet")
+    player_filter = compile_player_filter(
+        FLAGS.champs.split(","), FLAGS.roles.split(","))
+
+    index_path = FLAGS.index_path or \
+        os.path.join(FLAGS.replay_dir, "rofl_index.db")
+    index = ReplayIndex(index_path)
+
+    replays = sorted(index.scan(FLAGS.replay_dir))
+    if FLAGS.max_games != -1:
+        replays = replays[0:FLAGS.max_games]
+
+    print('game_ids:', len(replays))
+    rows = []
+    row_count = 0
     for i, replay_path in enumerate(replays):
-        print(f"SCRAPING {i}/{len(replays)}: {replay_path}")
-        full_game_id = replay_path.replace(".rofl", "")
-        metadata, _ = scraper.get_metadata(
-            replay_path,
-            path=True)
-        if metadata == None:
+        full_game_id = os.path.basename(replay_path).replace(".rofl", "")
+        try:
+            metadata, stats = index.lookup(replay_path)
+        except Exception as e:
+            print("ERR PROCESSING REPLAY FILE:", str(e))
             continue
 
-         # Extract Ezreal player data
-        stats = json.loads(metadata['statsJson'])
-        for player in stats:
-            if 'Ezreal' in player['SKIN']:
-                vals = [full_game_id]
-
-                for sql_field, sql_type in zip(SQL_FIELDS[1:], SQL_TYPES[1:]):
-                    json_field = SQL_TO_JSON_MAPPING[sql_field]
-                    placeholder = 0 if sql_type in ["REAL", "INTEGER"] else ""
-                    val = player.get(json_field, placeholder)
-                    vals.append(val)
-
-                # # Insert into database
-                question_marks = ",".join(["?" for f in range(len(SQL_FIELDS))])
-                c.execute(f"INSERT INTO players VALUES ({question_marks})", tuple(vals))
-                
-                break
-    
-    # Save (commit) the changes and close the connection
-    conn.commit()
-    conn.close()
+        rows += [build_row(full_game_id, player)
+                 for player in stats if player_filter(player)]
+        if len(rows) >= FLAGS.batch_size:
+            writer.write(rows)
+            row_count += len(rows)
+            rows = []
+            print(f"Processed {i+1}/{len(replays)} replays, {row_count} players")
+
+    if rows:
+        writer.write(rows)
+        row_count += len(rows)
+    print(f"Processed {len(replays)} replays, {row_count} players")
+
+    writer.close()
+    index.close()
 
 def entry_point():
     app.run(main)
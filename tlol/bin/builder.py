@@ -26,15 +26,24 @@ from absl import app
 from absl import flags
 import os
 
-from tlol.datasets.builder import go
+from tlol.datasets.builder import \
+    go, go_json, go_players, go_json_players, is_multi_player
+from tlol.datasets.actions import load_specs
 
 FLAGS = flags.FLAGS
 flags.DEFINE_string("db_path", None,  "Path to replay")
+flags.DEFINE_string("json_path", None, "(Optional) Path to a scraped *.json replay, built without a replay DB")
 flags.DEFINE_string("out_path", None, "Output directory")
-flags.DEFINE_string("player", "jinx", "Player to tailor observations towards")
+flags.DEFINE_string("player", "jinx", "Player to tailor observations towards, a comma separated list of players or `all` to build every champion from one read")
 flags.DEFINE_float("cutoff",  5.0,    "Timestep to start dataset from")
-flags.mark_flag_as_required("db_path")
+flags.DEFINE_float("end",     None,   "(Optional) Timestep to end dataset at, the end of the game by default")
+flags.DEFINE_string("action_specs", None, "(Optional) JSON file of per-champion action inference specs to register")
+flags.DEFINE_string("profile_path", None, "(Optional) JSON file the time and memory of each build stage are written to")
 flags.mark_flag_as_required("out_path")
+flags.register_multi_flags_validator(
+    ["db_path", "json_path"],
+    lambda paths: bool(paths["db_path"]) != bool(paths["json_path"]),
+    message="Exactly one of --db_path and --json_path must be set")
 
 def main(unused_argv):
     # DB construction settings
@@ -43,9 +52,20 @@ def main(unused_argv):
     cutoff   = FLAGS.cutoff
     out_path = FLAGS.out_path
 
-    res = go(db_path, player, cutoff, out_path)
+    if FLAGS.action_specs:
+        print("Registered action specs:", ", ".join(load_specs(FLAGS.action_specs)))
+
+    replay_path = FLAGS.json_path or db_path
+    if is_multi_player(player):
+        build_fn = go_json_players if FLAGS.json_path else go_players
+    else:
+        build_fn = go_json if FLAGS.json_path else go
+    res = build_fn(replay_path, player, cutoff, out_path, FLAGS.profile_path, FLAGS.end)
     if res == -1:
-        print("Invalid replay:", os.path.basename(db_path))
+        print("Invalid replay:", os.path.basename(replay_path))
+    elif isinstance(res, dict):
+        print("Valid replay, built players:",
+              ", ".join(p for p, player_res in res.items() if player_res != -1))
     else:
         print("Valid replay")
 
@@ -23,27 +23,49 @@
 training machine learning models or performing bulk analysis."""
 
 import os
+import json
 
 from absl import app
 from absl import flags
 
-from tlol.datasets.builder import go
-
-import concurrent.futures
+from tlol.datasets.builder import \
+    go, go_json, go_players, go_json_players, is_multi_player
+from tlol.datasets.actions import load_specs
+from tlol.lib.batch import BatchRunner, progress_printer, summarize
+from tlol.lib.profiling import aggregate_profiles, format_aggregate
 
 FLAGS = flags.FLAGS
 flags.DEFINE_string("db_dir",   None,  "Directory of replay DBs to convert")
+flags.DEFINE_bool("from_json", False,  "Build from the scraped *.json replays in --db_dir instead of replay DBs")
 flags.DEFINE_string("out_path", None,  "Output directory")
-flags.DEFINE_string("player", "jinx",  "Player to tailor observations towards")
+flags.DEFINE_string("player", "jinx",  "Player to tailor observations towards, a comma separated list of players or `all` to build every champion from one read")
 flags.DEFINE_float("cutoff",  5.0,     "Timestep to start dataset from")
+flags.DEFINE_float("end",     None,    "(Optional) Timestep to end datasets at, the end of each game by default")
 flags.DEFINE_integer("max_workers", 4, "Maximum number of workers to generate dataset")
+flags.DEFINE_integer("max_rss_mb", None, "(Optional) Memory limit of a worker in MB, workers over it are killed")
+flags.DEFINE_integer("max_tasks_per_child", None, "(Optional) Replays built by a worker before it's replaced")
+flags.DEFINE_string("log_path", None,  "(Optional) JSON lines log of every replay's outcome")
+flags.DEFINE_string("action_specs", None, "(Optional) JSON file of per-champion action inference specs to register")
+flags.DEFINE_string("profile_dir", None, "(Optional) Directory of per-replay stage profiles, aggregated after the run")
 flags.mark_flag_as_required("db_dir")
 flags.mark_flag_as_required("out_path")
 
-def go_wrapper(fi, db_dir, player, cutoff, out_path):
-    db_path = os.path.join(db_dir, fi)
+def profile_path(db_path, profile_dir):
+    if not profile_dir:
+        return None
+    return os.path.join(profile_dir, os.path.basename(db_path) + ".json")
+
+def go_wrapper(db_path, player, cutoff, out_path, from_json=False, profile_dir=None,
+               end=None, action_specs=None):
     print(f"Started: {db_path}")
-    res = go(db_path, player, cutoff, out_path)
+    if action_specs:
+        load_specs(action_specs)
+    prof_path = profile_path(db_path, profile_dir)
+    if is_multi_player(player):
+        build_fn = go_json_players if from_json else go_players
+    else:
+        build_fn = go_json if from_json else go
+    res = build_fn(db_path, player, cutoff, out_path, prof_path, end)
     if res == -1:
         print("Invalid replay:", os.path.basename(db_path))
     else:
@@ -51,29 +73,41 @@ def go_wrapper(fi, db_dir, player, cutoff, out_path):
     return res
 
 def main(unused_argv):
-    fi_s     = os.listdir(FLAGS.db_dir)
-    player   = FLAGS.player
-    cutoff   = FLAGS.cutoff
-    out_path = FLAGS.out_path
+    ext      = ".json" if FLAGS.from_json else ".db"
+    paths    = [os.path.join(FLAGS.db_dir, fi)
+                for fi in os.listdir(FLAGS.db_dir) if fi.endswith(ext)]
+
+    runner = BatchRunner(
+        go_wrapper,
+        args=(FLAGS.player, FLAGS.cutoff, FLAGS.out_path, FLAGS.from_json,
+              FLAGS.profile_dir, FLAGS.end, FLAGS.action_specs),
+        max_workers=FLAGS.max_workers,
+        max_rss_mb=FLAGS.max_rss_mb,
+        max_tasks_per_child=FLAGS.max_tasks_per_child,
+        log_path=FLAGS.log_path)
+    outcomes = runner.run(paths, on_result=progress_printer(len(paths)))
+    invalid = sum(1 for outcome in outcomes if outcome.get("result") == -1)
+    print("Replays:", summarize(outcomes), "invalid:", invalid)
+
+    if FLAGS.profile_dir:
+        report_profiles(paths, FLAGS.profile_dir)
 
-    with concurrent.futures.ProcessPoolExecutor(max_workers=FLAGS.max_workers) as executor:
-        future_res = (executor.submit(
-            go_wrapper,
-            fi,
-            FLAGS.db_dir,
-            player,
-            cutoff,
-            out_path
-        ) for fi in fi_s)
-        for future in concurrent.futures.as_completed(future_res):
-            print(future.result())
-            try:
-                print(future.result())
-            except Exception as exc:
-                import traceback
-                print("GLOBAL EXCEPTION:", traceback.format_exc())
-            finally:
-                print("Cur replay done!")
+def report_profiles(paths, profile_dir):
+    """Aggregates the stage profiles of this run's replays."""
+    profiles = []
+    for path in paths:
+        try:
+            with open(profile_path(path, profile_dir)) as f:
+                profiles.append(json.load(f))
+        except (OSError, ValueError):
+            pass
+    if not profiles:
+        return
+    summaries = aggregate_profiles(profiles)
+    with open(os.path.join(profile_dir, "aggregate.json"), "w") as f:
+        json.dump(summaries, f, indent=2)
+    print(f"Stage profile of {len(profiles)} replays:")
+    print(format_aggregate(summaries))
 
 def entry_point():
     app.run(main)
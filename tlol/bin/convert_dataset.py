@@ -23,12 +23,12 @@
 for each replay."""
 
 import os
-import concurrent.futures
 
 from absl import app
 from absl import flags
 
 from tlol.datasets.convertor import convert_dataset
+from tlol.lib.batch import BatchRunner, progress_printer, summarize
 
 FLAGS = flags.FLAGS
 
@@ -36,7 +36,12 @@ flags.DEFINE_string("json_dir",     None,  "Directory of the source *.json repla
 flags.DEFINE_string("db_dir",       None,  "Directory of the output *.db replay SQLite database")
 flags.DEFINE_string("idxs",         None,  "(Optional) Only convert these files")
 flags.DEFINE_string("region",       "EUW", "(Default: EUW) Game region")
-flags.DEFINE_integer("max_workers", 4,     "(Optional) Maximum threads to generate DBs")
+flags.DEFINE_integer("max_workers", 4,     "(Optional) Maximum processes to generate DBs")
+flags.DEFINE_integer("max_rss_mb",  None,  "(Optional) Memory limit of a worker in MB, workers over it are killed")
+flags.DEFINE_integer("max_tasks_per_child", None, "(Optional) Replays converted by a worker before it's replaced")
+flags.DEFINE_string("log_path",     None,  "(Optional) JSON lines log of every replay's outcome")
+flags.DEFINE_float("start",         None,  "(Optional) Only store observations from this timestep on")
+flags.DEFINE_float("end",           None,  "(Optional) Only store observations before this timestep")
 
 flags.mark_flag_as_required("json_dir")
 flags.mark_flag_as_required("db_dir")
@@ -51,23 +56,16 @@ def main(unused_argv):
         jsons = set(game_ids).intersection(idxs)
         jsons = [f"{FLAGS.region}1-{game_id}.json" for game_id in jsons]
 
-    with concurrent.futures.ProcessPoolExecutor(max_workers=FLAGS.max_workers) as executor:
-        future_game_insert_to_sql = (executor.submit(
-            convert_dataset,
-            os.path.join(FLAGS.json_dir, fi),
-            FLAGS.db_dir
-        ) for fi in jsons)
-
-        i = 1
-        for future in concurrent.futures.as_completed(future_game_insert_to_sql):
-            try:
-                data = future.result()
-            except Exception as exc:
-                data = exc
-                print('err:', exc)
-            finally:
-                print(f'No of inserted replays: {i}/{len(jsons)}', data)
-                i += 1
+    paths = [os.path.join(FLAGS.json_dir, fi) for fi in jsons]
+    runner = BatchRunner(
+        convert_dataset,
+        args=(FLAGS.db_dir, False, FLAGS.start, FLAGS.end),
+        max_workers=FLAGS.max_workers,
+        max_rss_mb=FLAGS.max_rss_mb,
+        max_tasks_per_child=FLAGS.max_tasks_per_child,
+        log_path=FLAGS.log_path)
+    outcomes = runner.run(paths, on_result=progress_printer(len(paths)))
+    print("Inserted replays:", summarize(outcomes))
 
 def entry_point():
     app.run(main)
@@ -21,30 +21,49 @@
 # SOFTWARE.
 """Counts the total number of frames for a converted ML dataset."""
 
-import os
-import pandas as pd
+import numpy as np
 
 from absl import app
 from absl import flags
 
+from tlol.datasets.manifest import \
+    collect_manifests, frame_percentiles, frame_histogram
+
 FLAGS = flags.FLAGS
 flags.DEFINE_string("db_dir", None, "Directory of replay DBs to convert")
+flags.DEFINE_integer("max_workers", None, "(Optional) Processes used to scan games without a manifest")
+flags.DEFINE_integer("bins", 10, "Number of game length histogram bins")
+flags.DEFINE_bool("verbose", False, "Print the frame count of every game")
 flags.mark_flag_as_required("db_dir")
 
 def main(unused_argv):
-    db_dir = FLAGS.db_dir
-    files  = os.listdir(db_dir)
-
-    total_frames = 0
-    for i, fi in enumerate(files):
-        cur_path = os.path.join(db_dir, fi)
-        game_data = pd.read_pickle(cur_path)
-        cur_frames, cols = game_data.shape
-        print(f"Game {i} frames: {cur_frames}, cols: {cols}")
-        total_frames += cur_frames
-
-    print(f"Total Frames: {total_frames}")
-    print(f"Mean Frames:  {total_frames / len(files)}")
+    manifests = collect_manifests(FLAGS.db_dir, FLAGS.max_workers)
+    if not manifests:
+        print("No games found")
+        return
+
+    if FLAGS.verbose:
+        for i, manifest in enumerate(manifests):
+            print(f"Game {i} frames: {manifest['frames']}, cols: {manifest['columns']}")
+
+    frames = np.array([manifest["frames"] for manifest in manifests])
+    total_bytes = sum(manifest["bytes"] for manifest in manifests)
+    columns = sorted(set(manifest["columns"] for manifest in manifests))
+    dtypes = sorted(set(manifest["dtype"] for manifest in manifests))
+
+    print(f"Games:        {len(manifests)}")
+    print(f"Total Frames: {frames.sum()}")
+    print(f"Mean Frames:  {frames.mean()}")
+    print(f"Min Frames:   {frames.min()}")
+    print(f"Max Frames:   {frames.max()}")
+    print(f"Columns:      {', '.join(str(c) for c in columns)}")
+    print(f"Dtypes:       {', '.join(dtypes)}")
+    print(f"Total Size:   {total_bytes / 1e6:.1f} MB")
+    print("Frame percentiles:")
+    for p, value in frame_percentiles(frames).items():
+        print(f"  p{p:<3} {value:.0f}")
+    print("Game length histogram (frames):")
+    print(frame_histogram(frames, FLAGS.bins))
 
 def entry_point():
     app.run(main)
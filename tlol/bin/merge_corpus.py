@@ -0,0 +1,58 @@
+# MIT License
+# 
+# Copyright (c) 2023 MiscellaneousStuff
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""Merges a directory of per-replay SQLite databases into a single corpus
+database, and optionally runs a corpus wide statistic over it."""
+
+from absl import app
+from absl import flags
+
+import pandas as pd
+
+from tlol.datasets.corpus import Corpus, find_replays
+
+FLAGS = flags.FLAGS
+flags.DEFINE_string("db_dir",      None, "(Optional) Directory of the *.db replay databases to merge")
+flags.DEFINE_string("corpus_path", None, "Path of the corpus database, created if it doesn't exist")
+flags.DEFINE_string("stat",        None, "(Optional) Column to aggregate per champion, e.g. total_gold")
+flags.DEFINE_float("stat_time",    600.0, "Game time in seconds the statistic is taken at")
+flags.DEFINE_string("stat_agg",    "AVG", "SQL aggregate of the statistic")
+flags.mark_flag_as_required("corpus_path")
+
+def main(unused_argv):
+    corpus = Corpus(FLAGS.corpus_path)
+    if FLAGS.db_dir:
+        replay_paths = find_replays(FLAGS.db_dir)
+        added, failed = corpus.merge(replay_paths)
+        print(f"Merged {added} new games from {len(replay_paths)} replays, "
+              f"{len(failed)} failed. Corpus holds {len(corpus.game_ids())} games.")
+    if FLAGS.stat:
+        stat_df = corpus.stat_at(
+            FLAGS.stat, FLAGS.stat_time, agg=FLAGS.stat_agg)
+        with pd.option_context("display.max_rows", None):
+            print(stat_df)
+    corpus.close()
+
+def entry_point():
+    app.run(main)
+
+if __name__ == "__main__":
+    app.run(main)
@@ -23,11 +23,16 @@
 Solo/Duo ladder and gathers all of the games which those players have played
 which match a certain criteria."""
 
+import os
+import asyncio
+
 from absl import app
 from absl import flags
 
 from tlol.stats.u_gg         import U_GG_API
+from tlol.stats.cache        import ResponseCache
 from tlol.replays.downloader import ReplayDownloader
+from tlol.replays.download_queue import DownloadQueue
 
 FLAGS = flags.FLAGS
 flags.DEFINE_string("champs", "", \
@@ -39,10 +44,27 @@ flags.DEFINE_integer("max_games", -1, \
     """(Default: Max returned games)
     Limits the number of replay files downloaded up to a maximum number of games.""")
 flags.DEFINE_integer("max_workers", 10, "Max workers per process")
-flags.DEFINE_float("delay", 0.5, "Request delay")
-flags.DEFINE_string("outfile", "", "(Optional) Save match ID list to a text file")
+flags.DEFINE_float("delay", 0.5, "Base delay of the u.gg request retry backoff")
+flags.DEFINE_integer("max_retries", 5, "Retries of throttled or failed u.gg requests")
+flags.DEFINE_string("outfile", "", "(Optional) Stream the harvested match ID list to a text file")
 flags.DEFINE_string("infile", "", "(Optional) Use a text file of match IDs")
 flags.DEFINE_string("regionId", "euw1", "(Optional) Specify which region to download replays from")
+flags.DEFINE_bool("use_async", False, "(Optional) Query u.gg with the asyncio client (requires aiohttp)")
+flags.DEFINE_float("rate", 2.0, "(Optional) Requests per second when using the asyncio client")
+flags.DEFINE_integer("max_pages", None, "(Optional) Maximum match history pages fetched per summoner")
+flags.DEFINE_string("cache_path", "", "(Optional) SQLite cache of u.gg responses")
+flags.DEFINE_integer("cache_mb", 256, "(Optional) Maximum size of the u.gg response cache in MB")
+flags.DEFINE_bool("offline", False, "(Optional) Only use cached u.gg responses (requires --cache_path)")
+
+flags.DEFINE_string("replay_dir", os.path.expanduser(os.path.join("~", "Documents", "League of Legends", "Replays")), \
+    "League of Legends *.rofl replay directory, watched to confirm downloads")
+flags.DEFINE_string("lockfile_path", "", "(Optional) League client lockfile with the LCU credentials")
+flags.DEFINE_string("lcu_url", "", "(Optional) LCU base URL, e.g. of a local stub server")
+flags.DEFINE_string("state_path", "downloads.jsonl", "JSON lines journal of the state of every download, used to resume")
+flags.DEFINE_integer("download_workers", 4, "Maximum number of replay downloads in progress")
+flags.DEFINE_float("download_timeout", 120.0, "Seconds to wait for a requested replay to appear")
+flags.DEFINE_integer("download_retries", 2, "Retries of a failed replay download")
+flags.DEFINE_bool("retry_failed", False, "Retry downloads which failed in a previous run")
 
 flags.DEFINE_integer("start_page", 1, \
     "Sets the first leaderboard page which is scraped")
@@ -51,12 +73,23 @@ flags.DEFINE_integer("last_page", None, \
 
 flags.mark_flag_as_required("last_page")
 
-def main(unused_argv):
-    # Setup APIs
-    u_gg       = U_GG_API()
-    downloader = ReplayDownloader()
-    
-     # Get top players on EUW Ranked/Solo Duo leaderboard
+def open_cache():
+    """Returns the u.gg response cache selected by the flags, if any."""
+    if not FLAGS.cache_path:
+        if FLAGS.offline:
+            raise ValueError("--offline requires --cache_path")
+        return None
+    return ResponseCache(
+        FLAGS.cache_path,
+        max_bytes=FLAGS.cache_mb * 1024 * 1024,
+        offline=FLAGS.offline)
+
+def harvest(champs):
+    """Gets the leaderboard summoners and their matches using the threaded
+    u.gg client."""
+    u_gg = U_GG_API(max_retries=FLAGS.max_retries, cache=open_cache())
+
+    # Get top players on EUW Ranked/Solo Duo leaderboard
     summoners = u_gg.get_leaderboard(
         page_start=FLAGS.start_page,
         page_end=FLAGS.last_page,
@@ -71,26 +104,64 @@ def main(unused_argv):
 
     print("Summoner names:", summoner_names)
 
-    if not FLAGS.infile:
-        # Get matches for above summoners matching specific criteria
-        matches = u_gg.get_matches(
+    # Get matches for above summoners matching specific criteria
+    matches = u_gg.get_matches(
+        summoner_names=summoner_names,
+        champs=champs, # ["Caitlyn"],
+        target_patch=FLAGS.target_patch,
+        outpath=FLAGS.outfile,
+        win_only=False,
+        max_workers=FLAGS.max_workers,
+        seasonIds=[20, 21],
+        delay=FLAGS.delay,
+        regionId=FLAGS.regionId,
+        max_pages=FLAGS.max_pages)
+    return list(matches)
+
+async def harvest_async(champs):
+    """Gets the leaderboard summoners and their matches using the asyncio
+    u.gg client."""
+    from tlol.stats.u_gg_async import AsyncU_GG_API
+
+    async with AsyncU_GG_API(
+            rate=FLAGS.rate,
+            burst=FLAGS.max_workers,
+            max_connections=FLAGS.max_workers,
+            cache=open_cache(),
+            max_retries=FLAGS.max_retries,
+            base_delay=FLAGS.delay) as u_gg:
+        summoners = await u_gg.get_leaderboard(
+            page_start=FLAGS.start_page,
+            page_end=FLAGS.last_page,
+            regionId=FLAGS.regionId)
+        summoner_names = [s["summonerName"] if "summonerName" in s else ""
+                          for s in summoners]
+        print('Summoner count:', len(summoner_names))
+
+        matches = await u_gg.get_matches(
             summoner_names=summoner_names,
-            champs=FLAGS.champs.split(","), # ["Caitlyn"],
+            champs=champs,
             target_patch=FLAGS.target_patch,
-            outpath="", # set the outfile to write the match ids to a file
+            outpath=FLAGS.outfile,
             win_only=False,
-            max_workers=FLAGS.max_workers,
             seasonIds=[20, 21],
-            delay=FLAGS.delay,
-            regionId=FLAGS.regionId)
-        matches = list(matches)
-    else:
+            regionId=FLAGS.regionId,
+            max_pages=FLAGS.max_pages)
+        return list(matches)
+
+def main(unused_argv):
+    # Setup APIs
+    downloader = ReplayDownloader(
+        lockfile_path=FLAGS.lockfile_path or None,
+        base_url=FLAGS.lcu_url or None)
+
+    if FLAGS.infile:
         with open(FLAGS.infile) as f:
             matches = f.read().split("\n")
-
-    if FLAGS.outfile:
-        with open(FLAGS.outfile, "w+") as f:
-            f.write("\n".join([str(m) for m in matches]))
+    elif FLAGS.use_async:
+        matches = asyncio.run(harvest_async(FLAGS.champs.split(",")))
+    else:
+        matches = harvest(FLAGS.champs.split(","))
 
     if FLAGS.max_games != -1:
         matches = matches[0:FLAGS.max_games]
@@ -98,9 +169,19 @@ def main(unused_argv):
     print(matches)
 
     # Download all games
-    for i, game_id in enumerate(matches):
-        req = downloader.download(game_id)
-        print(f'{i}/{len(matches)} Replay DL Status:', game_id, req.content, req.status_code)
+    queue = DownloadQueue(
+        downloader,
+        replay_dir=FLAGS.replay_dir,
+        state_path=FLAGS.state_path,
+        region=FLAGS.regionId.upper(),
+        max_concurrency=FLAGS.download_workers,
+        timeout=FLAGS.download_timeout,
+        max_retries=FLAGS.download_retries)
+    try:
+        downloaded, failed = queue.run(matches, retry_failed=FLAGS.retry_failed)
+    finally:
+        queue.close()
+    print(f"Downloaded: {downloaded}, failed: {failed}")
 
 def entry_point():
     app.run(main)
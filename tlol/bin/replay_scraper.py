@@ -38,6 +38,7 @@ flags.DEFINE_string("region",        "EUW", "Region of the replay files")
 flags.DEFINE_integer("replay_speed", 8,     "League client replay speed multiplier")
 flags.DEFINE_integer("end_time",     "-1",  "(Default: Full game) Set maximum replay length in seconds")
 flags.DEFINE_bool("use_scraper",     True,  "(Optional) Disable the scraper for debugging")
+flags.DEFINE_string("index_path",    None,  "(Optional) Replay metadata index to reuse between runs")
 flags.mark_flag_as_required('game_dir')
 flags.mark_flag_as_required('replay_dir')
 flags.mark_flag_as_required('dataset_dir')
@@ -50,7 +51,8 @@ def main(unused_argv):
         dataset_dir=FLAGS.dataset_dir,
         scraper_dir=FLAGS.scraper_dir,
         region=FLAGS.region,
-        replay_speed=FLAGS.replay_speed)
+        replay_speed=FLAGS.replay_speed,
+        index_path=FLAGS.index_path)
 
     replay_paths = scraper.get_replay_paths()
 
@@ -21,13 +21,16 @@
 # SOFTWARE.
 
 import os
+import traceback
 
-from queue import Queue
 from threading import Thread
 import argparse
 
-from flask import Flask, request, jsonify, send_from_directory, after_this_request, Response
+from flask import Flask, request, jsonify, send_file
 from tlol.replays.scraper import ReplayScraper
+from tlol.replays.jobs import ScrapeJobQueue, QUEUED, RUNNING
+from tlol.replays.catalog import ScrapedCatalog, count_frames
+from tlol.replays.artifacts import ENCODINGS, negotiate_encoding, ensure_artifact
 
 # Set up argparse
 parser = argparse.ArgumentParser(description="League of Legends Replay Data Service")
@@ -37,33 +40,29 @@ parser.add_argument('--game_dir', required=True, type=str, help='League of Legen
 parser.add_argument('--replay_dir', required=True, type=str, help='League of Legends *.rofl replay directory')
 parser.add_argument('--dataset_dir', required=True, type=str, help='JSON replay files output directory')
 parser.add_argument('--scraper_dir', required=True, type=str, help='Path to the scraper program')
+parser.add_argument('--jobs_db', default='scrape_jobs.db', type=str, help='Persistent scraping job queue database')
+parser.add_argument('--workers', default=1, type=int, help='Number of replays scraped concurrently')
+parser.add_argument('--max_retries', default=2, type=int, help='Number of times a failed scrape is retried')
+parser.add_argument('--catalog_db', default='scraped_catalog.db', type=str, help='Scraped replay catalog database')
+parser.add_argument('--artifact_dir', default=None, type=str, help='(Default: <dataset_dir>_compressed) Compressed replay directory')
 
 args = parser.parse_args()
+if not args.artifact_dir:
+    args.artifact_dir = args.dataset_dir.rstrip("/\\") + "_compressed"
 
 app = Flask(__name__)
-scraping_queue = Queue()
-currently_scraping = ""
+scraping_queue = ScrapeJobQueue(args.jobs_db, max_retries=args.max_retries)
+catalog = ScrapedCatalog(args.catalog_db)
 
-def get_queue_contents(queue):
-    temp_list = []
-    temp_queue = Queue()
-
-    # Transfer all items to a temporary list and a temporary queue
-    while not queue.empty():
-        item = queue.get()
-        temp_list.append(item)
-        temp_queue.put(item)
-
-    # Put items back into the original queue
-    while not temp_queue.empty():
-        queue.put(temp_queue.get())
-
-    return temp_list
+def job_to_request(job):
+    return {
+        "game_id": job["game_id"],
+        "replay_speed": job["replay_speed"],
+        "end_time": job["end_time"]
+    }
 
 def check_existing_scraped_replay(game_id):
-    full_path = os.path.join(args.dataset_dir, f"{game_id}.json")
-    print("DOES IT EXIST?:", full_path)
-    return os.path.exists(full_path)
+    return catalog.exists(game_id)
 
 @app.route('/api/scrape/add', methods=['POST'])
 def scrape_add():
@@ -75,52 +74,132 @@ def scrape_add():
         else:
             replay_speed = request.json.get('replay_speed')
             end_time     = request.json.get('end_time')
-            scrape_request = {
-                "game_id": game_id,
-                "replay_speed": replay_speed,
-                "end_time": end_time
-            }
-            scraping_queue.put(scrape_request)
-            return jsonify({"message": f"Game {game_id} added to the queue"}), 202
+            if scraping_queue.put(game_id, replay_speed, end_time):
+                return jsonify({"message": f"Game {game_id} added to the queue"}), 202
+            else:
+                return jsonify({"message": f"Game {game_id} is already queued!"}), 202
     except Exception as e:
         return jsonify({
             "error":
             f"Internal server error while adding game: {str(e)}"}
         ), 500
     
+def unique_game_ids(game_ids):
+    return list(dict.fromkeys(str(game_id) for game_id in game_ids))
+
+@app.route('/api/scrape/add_batch', methods=['POST'])
+def scrape_add_batch():
+    try:
+        game_ids     = unique_game_ids(request.json.get('game_ids', []))
+        replay_speed = request.json.get('replay_speed')
+        end_time     = request.json.get('end_time')
+
+        scraped = catalog.lookup_many(game_ids)
+        pending = [game_id for game_id in game_ids if game_id not in scraped]
+        added   = set(scraping_queue.put_many(pending, replay_speed, end_time))
+
+        results = {}
+        for game_id in game_ids:
+            if game_id in scraped:
+                results[game_id] = "exists"
+            elif game_id in added:
+                results[game_id] = "added"
+            else:
+                results[game_id] = "already_queued"
+        return jsonify({
+            "results": results,
+            "added": len(added),
+            "exists": len(scraped),
+            "already_queued": len(pending) - len(added)
+        }), 202
+    except Exception as e:
+        return jsonify({
+            "error":
+            f"Internal server error while adding games: {str(e)}"}
+        ), 500
+
+@app.route('/api/scrape/status_batch', methods=['POST'])
+def scrape_status_batch():
+    try:
+        game_ids = unique_game_ids(request.json.get('game_ids', []))
+        scraped  = catalog.lookup_many(game_ids)
+        jobs     = scraping_queue.lookup_many(
+            [game_id for game_id in game_ids if game_id not in scraped])
+
+        results = {}
+        for game_id in game_ids:
+            if game_id in scraped:
+                results[game_id] = {"state": "scraped", **scraped[game_id]}
+            elif game_id in jobs:
+                results[game_id] = jobs[game_id]
+            else:
+                results[game_id] = {"state": "unknown"}
+        return jsonify({"results": results}), 200
+    except Exception as e:
+        return jsonify({
+            "error":
+            f"Internal server error while getting game statuses: {str(e)}"}
+        ), 500
+
 @app.route('/api/scrape/list', methods=['GET'])
 def scrape_list():
-    lst = os.listdir(args.dataset_dir)
-    lst = [fi.replace(".json", "") for fi in lst]
-    if lst:
-        return jsonify(lst), 200
-    else:
+    offset     = request.args.get('offset', 0, type=int)
+    limit      = request.args.get('limit', None, type=int)
+    min_frames = request.args.get('min_frames', None, type=int)
+    since      = request.args.get('since', None, type=float)
+    details    = request.args.get('details', 0, type=int)
+    entries = catalog.entries(
+        offset=offset, limit=limit, min_frames=min_frames, since=since)
+    if not entries:
         return jsonify("No replays scraped!"), 200
+    elif details:
+        return jsonify(entries), 200
+    else:
+        return jsonify([entry["game_id"] for entry in entries]), 200
+
+@app.route('/api/scrape/info/<game_id>', methods=['GET'])
+def scrape_info(game_id):
+    entry = catalog.lookup(game_id)
+    if entry:
+        return jsonify(entry), 200
+    else:
+        return jsonify({"error": f"Game {game_id} hasn't been scraped"}), 404
 
 @app.route('/api/scrape/queue', methods=['GET'])
 def scrape_queue():
-    lst = get_queue_contents(scraping_queue)
-    return jsonify({"queue": lst}), 200
+    state  = request.args.get('state', QUEUED)
+    offset = request.args.get('offset', 0, type=int)
+    limit  = request.args.get('limit', None, type=int)
+    lst = [job_to_request(job)
+           for job in scraping_queue.jobs(state, offset=offset, limit=limit)]
+    return jsonify({
+        "queue": lst,
+        "total": scraping_queue.count(state),
+        "offset": offset
+    }), 200
+
+@app.route('/api/scrape/status/<game_id>', methods=['GET'])
+def scrape_status(game_id):
+    job = scraping_queue.lookup(game_id)
+    if job:
+        return jsonify(job), 200
+    else:
+        return jsonify({"error": f"Game {game_id} has never been queued"}), 404
 
 @app.route('/api/scrape/current', methods=['GET'])
 def scrape_current():
-    return jsonify(currently_scraping), 200
+    lst = [job_to_request(job) for job in scraping_queue.jobs(RUNNING)]
+    if not lst:
+        return jsonify("Not currently scraping!"), 200
+    elif args.workers == 1:
+        return jsonify(lst[0]), 200
+    else:
+        return jsonify(lst), 200
 
 @app.route('/api/scrape/remove/<game_id>', methods=['DELETE'])
 def scrape_remove(game_id):
-    global scraping_queue
     try:
-        # Create a temporary queue
-        temp_queue = Queue()
-
-        # Transfer all items except the one to remove to the temporary queue
-        while not scraping_queue.empty():
-            item = scraping_queue.get()
-            if item['game_id'] != game_id:
-                temp_queue.put(item)
-
-        # Swap the queues
-        scraping_queue = temp_queue
+        scraping_queue.remove(game_id)
 
         return jsonify({"message": f"Game {game_id} removal requested"}), 200
     except Exception as e:
@@ -128,92 +207,108 @@ def scrape_remove(game_id):
 
 @app.route('/api/scrape/download/<game_id>', methods=['GET'])
 def scrape_download(game_id):
-    directory = args.dataset_dir  # Replace with your directory path
-    filename = f"{game_id}.json"  # Adjust based on how you store files
+    directory = args.dataset_dir
+    filename = f"{game_id}.json"
     full_path = os.path.join(directory, filename)
     
-    if os.path.exists(full_path):
-        chunk_size = 1024 * 1024 # MiB
-
-        def generate():
-            with open(full_path, 'rb') as file:
-                while True:
-                    data = file.read(chunk_size)
-                    if not data:
-                        break
-                    yield data
-
-        return Response(generate(), 
-                        mimetype='application/zip',
-                        headers={'Content-Disposition': f'attachment; filename={filename}'})
-    else:
+    if not os.path.exists(full_path):
         return f"Scraped replay file: {game_id}, doesn't exist", 404
 
+    # Serve a compressed artifact to clients which accept one
+    encoding = negotiate_encoding(request.accept_encodings)
+    if encoding:
+        compressed_path = ensure_artifact(full_path, args.artifact_dir, encoding)
+        response = send_file(
+            compressed_path,
+            mimetype='application/json',
+            as_attachment=True,
+            download_name=filename,
+            conditional=True)
+        response.headers['Content-Encoding'] = encoding
+    else:
+        response = send_file(
+            full_path,
+            mimetype='application/json',
+            as_attachment=True,
+            download_name=filename,
+            conditional=True)
+    response.headers['Vary'] = 'Accept-Encoding'
+    return response
+
 @app.route('/api/scrape/download_rofl/<game_id>', methods=['GET'])
 def scrape_download_rofl(game_id):
-    directory = args.replay_dir  # Replace with your directory path
-    filename = f"{game_id}.rofl"  # Adjust based on how you store files
+    directory = args.replay_dir
+    filename = f"{game_id}.rofl"
     full_path = os.path.join(directory, filename)
     
+    # Replays are already compressed, so they're always sent as-is
     if os.path.exists(full_path):
-        chunk_size = 1024 * 1024 # MiB
-
-        def generate():
-            with open(full_path, 'rb') as file:
-                while True:
-                    data = file.read(chunk_size)
-                    if not data:
-                        break
-                    yield data
-
-        return Response(generate(), 
-                        mimetype='application/zip',
-                        headers={'Content-Disposition': f'attachment; filename={filename}'})
+        return send_file(
+            full_path,
+            mimetype='application/octet-stream',
+            as_attachment=True,
+            download_name=filename,
+            conditional=True)
     else:
         return f"Original replay file: {game_id}, doesn't exist", 404
 
+def scrape_job(job):
+    replay_path = job["game_id"] + ".rofl"
+    end_time = job["end_time"]
+    replay_speed = job["replay_speed"]
+
+    # Initialise scraping settings
+    scraper = ReplayScraper(
+        game_dir=args.game_dir,
+        replay_dir=args.replay_dir,
+        dataset_dir=args.dataset_dir,
+        scraper_dir=args.scraper_dir,
+        region="",
+        replay_speed=replay_speed)
+    full_replay_path = os.path.join(args.replay_dir, replay_path)
+    metadata, _ = scraper.get_metadata(full_replay_path, path=True)
+    if metadata is None:
+        raise ValueError(f"Unable to read replay metadata: {full_replay_path}")
+    seconds = (metadata["gameLength"] // 1000) - 1
+
+    end_time = seconds \
+               if end_time == -1 or seconds <= end_time \
+               else end_time
+
+    # Perform scraping using T_T-Pandoras-Box and Lol client in replay mode
+    scraper.scrape(
+        replay_path=replay_path,
+        end_time=end_time,
+        delay=2,
+        scraper=True,
+        exclusive=args.workers == 1)
+
+    output_path = os.path.join(args.dataset_dir, f"{job['game_id']}.json")
+    if not os.path.exists(output_path):
+        raise RuntimeError(f"Scraper didn't produce an output for {job['game_id']}")
+    try:
+        frames = count_frames(output_path)
+    except Exception:
+        frames = None
+    catalog.add(job["game_id"], output_path, frames=frames)
+    ensure_artifact(output_path, args.artifact_dir, ENCODINGS[0])
+
 def process_queue():
-    global currently_scraping
     while True:
-        if not scraping_queue.empty():
-            # Get scrape request info
-            scrape_request = scraping_queue.get()
-            replay_path = scrape_request["game_id"] + ".rofl"
-            end_time = scrape_request["end_time"]
-            replay_speed = scrape_request["replay_speed"]
-            game_id = os.path.basename(replay_path).replace(".rofl", "")
-
-            # Set server state info
-            currently_scraping = scrape_request
-
-            # Initialise scraping settings
-            scraper = ReplayScraper(
-                game_dir=args.game_dir,
-                replay_dir=args.replay_dir,
-                dataset_dir=args.dataset_dir,
-                scraper_dir=args.scraper_dir,
-                region="",
-                replay_speed=replay_speed)
-            full_replay_path = os.path.join(args.replay_dir, replay_path)
-            metadata, _ = scraper.get_metadata(full_replay_path, path=True)
-            seconds = (metadata["gameLength"] // 1000) - 1
-
-            end_time = seconds \
-                       if end_time == -1 or seconds <= end_time \
-                       else end_time
-
-            # Perform scraping using T_T-Pandoras-Box and Lol client in replay mode
-            scraper.scrape(
-                replay_path=replay_path,
-                end_time=end_time,
-                delay=2,
-                scraper=True)
-            
-            # Update `currently_scraping` state
-            currently_scraping = "Not currently scraping!"
+        # Blocks until a scrape request is available
+        job = scraping_queue.get()
+        try:
+            scrape_job(job)
+            scraping_queue.complete(job)
+        except Exception as e:
+            state = scraping_queue.fail(job, e)
+            print(f"Scraping {job['game_id']} failed ({state}):", traceback.format_exc())
 
 if __name__ == "__main__":
-    thread = Thread(target=process_queue)
-    thread.daemon = True
-    thread.start()
-    app.run(debug=True, host=args.host, port=args.port)
\ No newline at end of file
+    print("Catalogued scraped replays:", catalog.sync(args.dataset_dir))
+    for _ in range(args.workers):
+        thread = Thread(target=process_queue)
+        thread.daemon = True
+        thread.start()
+    # The reloader would start a second set of workers on the same job queue
+    app.run(debug=True, use_reloader=False, host=args.host, port=args.port)
\ No newline at end of file
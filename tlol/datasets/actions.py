@@ -0,0 +1,187 @@
+# MIT License
+# 
+# Copyright (c) 2023 MiscellaneousStuff
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""Per-champion specs of how actions are inferred from replay observations.
+
+Most actions (movement, spell casts from cooldowns, flashes, wards and
+recalls) are inferred the same way for every champion. What differs is
+which missiles a champion's auto attacks and skillshots create, which is
+what an `ActionSpec` describes. Champions without a registered spec get
+an empty one, so only their champion-agnostic actions are inferred.
+
+Specs can also be loaded from a JSON file of champion name to spec
+arguments, so adding a champion needs no code:
+
+    {"caitlyn": {"aa_missiles": ["caitlynbasicattack"],
+                 "skillshots": {"e": ["caitlynentrapmentmissile"]}}}"""
+
+import json
+
+import numpy as np
+import pandas as pd
+
+# Spells whose target position is part of the dataset
+SKILLSHOT_SLOTS = ["w", "e"]
+
+# Tables searched for auto attack targets, in order
+AA_TARGET_TABLES = ["objects", "champs"]
+
+
+class ActionSpec(object):
+    """How the actions of a champion are inferred.
+
+    Args:
+        champion: Champion name, as in the `name` column of `champs`.
+        aa_missiles: Names of the missiles created by auto attacks.
+        skillshots: Dict of spell slot (`w` or `e`) to the names of the
+            missiles which mark where that spell was aimed.
+        recast_intervals: Dict of spell slot to the seconds within which
+            consecutive missiles belong to the same cast, e.g. one Jinx E
+            creating several `jinxehit` missiles.
+        aa_target_tables: Tables searched for the unit at the end of an auto
+            attack missile, in order of priority.
+    """
+    def __init__(self, champion, aa_missiles=None, skillshots=None,
+                 recast_intervals=None, aa_target_tables=None):
+        self.champion = champion
+        self.aa_missiles = list(aa_missiles or [])
+        self.skillshots = dict(skillshots or {})
+        self.recast_intervals = dict(recast_intervals or {})
+        self.aa_target_tables = list(aa_target_tables or AA_TARGET_TABLES)
+        unknown = [slot for slot in self.skillshots
+                   if slot not in SKILLSHOT_SLOTS]
+        if unknown:
+            raise ValueError(
+                f"{champion}: skillshots must be one of {SKILLSHOT_SLOTS}, "
+                f"got {', '.join(unknown)}")
+
+    def __repr__(self):
+        return f"ActionSpec({self.champion})"
+
+
+ACTION_SPECS = {}
+
+def register_spec(spec):
+    """Registers the action spec of a champion, replacing any existing one."""
+    ACTION_SPECS[spec.champion] = spec
+    return spec
+
+def get_spec(champion):
+    return ACTION_SPECS.get(champion) or ActionSpec(champion)
+
+def load_specs(path):
+    """Registers the action specs within a JSON file. Returns their names."""
+    with open(path) as f:
+        specs = json.load(f)
+    for champion, kwargs in specs.items():
+        register_spec(ActionSpec(champion, **kwargs))
+    return list(specs)
+
+register_spec(ActionSpec(
+    "jinx",
+    aa_missiles=["jinxbasicattack",
+                 "jinxbasicattack2",
+                 "jinxqattack",
+                 "jinxqattack2"],
+    skillshots={"w": ["jinxwmissile"],
+                "e": ["jinxehit"]},
+    # Jinx E is never 5 sec or lower so this is guaranteed to always be right
+    recast_intervals={"e": 5.0}))
+
+
+def skillshot_missiles(missiles_df, spec, slot):
+    """Returns the missiles marking each cast of a skillshot. Missiles within
+    the recast interval of the previous missile are left out."""
+    names = spec.skillshots.get(slot, [])
+    slot_missiles = missiles_df[missiles_df["name"].isin(names)]
+    interval = spec.recast_intervals.get(slot)
+    if interval is None or len(slot_missiles) == 0:
+        return slot_missiles
+    recast = slot_missiles["time"].diff() < interval
+    return slot_missiles[~recast.to_numpy()]
+
+def find_aa_targets(aa_missiles, tables, spec):
+    """Finds the unit at the end position of each auto attack missile, as a
+    join on position against each of the spec's target tables in turn.
+    The first unit of a table at that position is the target.
+
+    Args:
+        aa_missiles: Auto attack missiles with `end_position_x/z` columns.
+        tables: Dict of table name to observations.
+        spec: `ActionSpec` of the attacking champion.
+
+    Returns:
+        (target_type, target_id) Series aligned with `aa_missiles`, which
+        are None and -1 for missiles without a target.
+    """
+    keys = ["end_position_x", "end_position_z"]
+    aa_missiles = aa_missiles.rename_axis("row")
+    target_type = pd.Series(None, index=aa_missiles.index, dtype=object)
+    target_id   = pd.Series(-1, index=aa_missiles.index, dtype="int64")
+    remaining   = aa_missiles[keys].dropna()
+    for table in spec.aa_target_tables:
+        if len(remaining) == 0:
+            break
+        units = tables[table][["position_x", "position_z", "obj_type", "net_id"]]
+        units = units.dropna(subset=["position_x", "position_z"])
+        units = units.drop_duplicates(subset=["position_x", "position_z"])
+        found = remaining.reset_index().merge(
+            units,
+            how="inner",
+            left_on=keys,
+            right_on=["position_x", "position_z"]).set_index("row")
+        target_type.loc[found.index] = found["obj_type"].astype(object)
+        target_id.loc[found.index]   = found["net_id"].astype("int64")
+        remaining = remaining[~remaining.index.isin(found.index)]
+    return target_type, target_id
+
+def target_ranks(targets, units_by_type):
+    """Returns the rank of each auto attack target by distance from the
+    player, among the units of its type observed at the same time (1 is
+    the closest). Targets which aren't found are ranked 0.
+
+    Args:
+        targets: DataFrame of `time`, `target_type` and `target_id`.
+        units_by_type: Dict of target type to the unit observations the
+            rank is taken within.
+    """
+    ranked = []
+    for target_type, units in units_by_type.items():
+        units = units[units["obj_type"] != 0]
+        units = units.sort_values(
+            ["time", "x_z_diff_from_player"], ascending=True, kind="mergesort")
+        units = units[["time", "net_id"]].astype("float64").assign(
+            target_type=target_type,
+            target_idx=units.groupby("time").cumcount().to_numpy() + 1)
+        ranked.append(units.drop_duplicates(subset=["time", "net_id"]))
+    if not ranked or len(targets) == 0:
+        return pd.Series(0, index=targets.index, dtype="int64")
+    ranked = pd.concat(ranked, ignore_index=True)
+    ranked["net_id"] = ranked["net_id"].astype("int64")
+
+    targets = targets[["time", "target_type", "target_id"]].rename_axis("row")
+    targets = targets.astype({"time": "float64", "target_id": "int64"})
+    found = targets.reset_index().merge(
+        ranked,
+        how="left",
+        left_on=["time", "target_type", "target_id"],
+        right_on=["time", "target_type", "net_id"]).set_index("row")
+    return found["target_idx"].reindex(targets.index).fillna(0).astype("int64")
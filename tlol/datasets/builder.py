@@ -29,21 +29,19 @@ import os
 import pandas as pd
 import numpy as np
 
-from itertools import compress
+
+from tlol.datasets.manifest import write_manifest
+from tlol.datasets.convertor import game_frames, compact_frame
+from tlol.datasets.query import query_table
+from tlol.datasets.actions import \
+    get_spec, skillshot_missiles, find_aa_targets, target_ranks
+from tlol.lib.profiling import profile, lap
 
 import warnings
 warnings.filterwarnings('ignore')
 
-def set_player_pos(player_pos, row):
-    player_pos[row["time"]] = [row["position_x"], row["position_z"]]
-
-def linear_diff(row, col, player_pos, player_pos_idx):
-    return row[col] - player_pos[row["time"]][player_pos_idx]
-
-def multi_diff(row, player_pos):
-    cur_pos  = row[["position_x", "position_z"]]
-    player_p = player_pos[row["time"]]
-    return math.dist(cur_pos, player_p)
+# Builds the datasets of every champion within a replay
+ALL_PLAYERS = "all"
 
 def digitize_delta(val):
     if   val < -350:                 return -4
@@ -59,6 +57,17 @@ def digitize_delta(val):
 def is_spell_cast(row, spell):
     return (row[f"{spell}_prev_cd"] < row[f"{spell}_cd"]) & (row[f"{spell}_prev_cd"] == 0)
 
+def fill_zeros(table_df):
+    """`fillna(0)` which also fills categorical string columns, whose
+    missing values (e.g. NULL spell names) become a `0` category as they
+    did when these columns were plain objects."""
+    for col in table_df.columns:
+        values = table_df[col]
+        if isinstance(values.dtype, pd.CategoricalDtype) and \
+            values.isna().any() and 0 not in values.cat.categories:
+            table_df[col] = values.cat.add_categories([0])
+    return table_df.fillna(0)
+
 def get_previous_positions(table_df):
     champs_prev_pos_x = table_df["position_x"].shift(10)
     champs_prev_pos_y = table_df["position_y"].shift(10)
@@ -66,27 +75,21 @@ def get_previous_positions(table_df):
     table_df["prev_position_x"] = champs_prev_pos_x
     table_df["prev_position_y"] = champs_prev_pos_y
     table_df["prev_position_z"] = champs_prev_pos_z
-    table_df = table_df.fillna(0)
+    table_df = fill_zeros(table_df)
 
     return table_df
 
 def get_distances_from_player(table_df, champs_df, player):
-    # Get X, Y, (X, Y) Distances from Player
-    player_df = champs_df[champs_df["name"] == player]
-    player_pos = {}
-    player_df.apply(lambda row: set_player_pos(player_pos, row), axis=1)
-    x_champ_diffs   = table_df[["time", "position_x"]].apply(\
-        lambda row: linear_diff(row,
-                                "position_x",
-                                player_pos,
-                                player_pos_idx=0), axis=1)
-    z_champ_diffs   = table_df[["time", "position_z"]].apply(\
-        lambda row: linear_diff(row,
-                                "position_z",
-                                player_pos,
-                                player_pos_idx=1), axis=1)
-    x_z_champ_diffs = table_df[["time", "position_x", "position_z"]].apply(\
-        lambda row: multi_diff(row, player_pos), axis=1)
+    # Get X, Y, (X, Y) Distances from Player at the time of each row
+    player_df  = champs_df[champs_df["name"] == player]
+    player_pos = player_df.drop_duplicates(subset=["time"], keep="last")
+    player_pos = player_pos.set_index("time")
+    x_champ_diffs   = table_df["position_x"] - \
+        table_df["time"].map(player_pos["position_x"])
+    z_champ_diffs   = table_df["position_z"] - \
+        table_df["time"].map(player_pos["position_z"])
+    x_z_champ_diffs = np.hypot(x_champ_diffs.astype("float64"),
+                               z_champ_diffs.astype("float64"))
 
     # Append X, Y, (X, Y) Distances from Player
     table_df["x_diff_from_player"]   = x_champ_diffs
@@ -95,37 +98,39 @@ def get_distances_from_player(table_df, champs_df, player):
 
     return table_df
 
-def find_aa_target(row, objects_df, champs_df):
-    # Get auto attack time and destination
-    t, x, z = row[["time", "end_position_x", "end_position_z"]]
-    
-    # Search turrets, jungle camps and minions for auto attack destination
-    found_obj = objects_df[\
-        (objects_df["position_x"] == x) &
-        (objects_df["position_z"] == z)]
-    if len(found_obj) > 0:
-        return found_obj.iloc[0]["obj_type"], found_obj.iloc[0]["net_id"]
-
-    # Search champs for auto attack destination
-    found_champ = champs_df[\
-        (champs_df["position_x"] == x) &
-        (champs_df["position_z"] == z)]
-    if len(found_champ) > 0:
-        return found_champ.iloc[0]["obj_type"], found_champ.iloc[0]["net_id"]
-        
-    return None, -1
+def read_table(con, table, cutoff=None, end=None):
+    """Reads the rows of a replay database table from `cutoff` until `end`,
+    with compact dtypes. The time window is applied in SQL."""
+    return query_table(con, table, start=cutoff, end=end)
+
+def within_window(table_df, cutoff, end=None):
+    table_df = table_df[table_df["time"] > cutoff]
+    if end is not None:
+        table_df = table_df[table_df["time"] < end]
+    return table_df
+
+def get_champs_df(con, player, cutoff=5.0, end=None):
+    return prepare_champs_df(
+        read_table(con, "champs", cutoff, end), player, cutoff, end)
 
-def get_champs_df(con, player, cutoff=5.0):
+def prepare_champs_df(champs_df, player, cutoff=5.0, end=None):
+    champs_df = clean_champs_df(champs_df, cutoff, end)
+    if isinstance(champs_df, int):
+        return champs_df
+    return player_champs_df(champs_df, player)
+
+def clean_champs_df(champs_df, cutoff=5.0, end=None):
+    """Player independent preparation of the champion observations. Returns
+    -1 for invalid replays."""
     # Get unique champion records after cutoff
-    champs_sql = pd.read_sql_query("SELECT * FROM champs", con)
-    champs_df  = pd.DataFrame(champs_sql)
     champs_df  = champs_df.drop(labels=["game_id"], axis=1)
-    champs_df  = champs_df[champs_df["time"] > cutoff]
+    champs_df  = within_window(champs_df, cutoff, end)
     champs_df = champs_df.drop_duplicates(subset=["time", "obj_type", "name"])
 
     # If there aren't 10 champs or the champ obs aren't all the same length,
     # ... then this replay database is invalid :/
     val_counts = champs_df["name"].value_counts()
+    val_counts = val_counts[val_counts > 0]
     champ_cnt  = len(champs_df["name"].unique())
     if champ_cnt != 10:
         print(f"Invalid Replay: There aren't 10 champs - Found {champ_cnt} champs.")
@@ -163,123 +168,99 @@ def get_champs_df(con, player, cutoff=5.0):
     for spell in ["q", "w", "e", "r", "d", "f"]:
         champs_df[f"{spell}_cast"] = \
             champs_df.apply(lambda row: is_spell_cast(row, spell), axis=1)
-    champs_df = champs_df.fillna(0)
+    champs_df = fill_zeros(champs_df)
 
-    # Get X, Y, (X, Y) Distances from Player
-    player_df = champs_df[champs_df["name"] == player]
-    player_pos = {}
-    player_df.apply(lambda row: set_player_pos(player_pos, row), axis=1)
-    x_champ_diffs   = champs_df[["time", "position_x"]].apply(\
-        lambda row: linear_diff(row,
-                                "position_x",
-                                player_pos,
-                                player_pos_idx=0), axis=1)
-    z_champ_diffs   = champs_df[["time", "position_z"]].apply(\
-        lambda row: linear_diff(row,
-                                "position_z",
-                                player_pos,
-                                player_pos_idx=1), axis=1)
-    x_z_champ_diffs = champs_df[["time", "position_x", "position_z"]].apply(\
-        lambda row: multi_diff(row, player_pos), axis=1)
+    return compact_frame(champs_df)
 
-    # Append X, Y, (X, Y) Distances from Player
-    champs_df["x_diff_from_player"]   = x_champ_diffs
-    champs_df["z_diff_from_player"]   = z_champ_diffs
-    champs_df["x_z_diff_from_player"] = x_z_champ_diffs
+def player_champs_df(champs_df, player):
+    """Adds the distances from `player` to a copy of cleaned champion
+    observations."""
+    champs_df = get_distances_from_player(champs_df.copy(), champs_df, player)
+    return compact_frame(champs_df)
+
+def get_table_df(con, player, champs_df, table, cutoff=5.0, end=None):
+    return prepare_table_df(read_table(con, table, cutoff, end),
+                            player, champs_df, cutoff, end)
 
-    return champs_df
+def prepare_table_df(table_df, player, champs_df, cutoff=5.0, end=None):
+    table_df  = clean_table_df(table_df, cutoff, end)
+    return player_table_df(table_df, player, champs_df)
 
-def get_table_df(con, player, champs_df, table, cutoff=5.0):
-    table_sql = pd.read_sql_query(f"SELECT * FROM {table}", con)
-    table_df  = pd.DataFrame(table_sql)
+def clean_table_df(table_df, cutoff=5.0, end=None):
     table_df  = table_df.drop(labels=["game_id"], axis=1)
-    table_df  = table_df[table_df["time"] > cutoff]
+    table_df  = within_window(table_df, cutoff, end)
     table_df  = table_df.drop_duplicates(subset=["time", "obj_type", "name", "net_id"])
-    table_df  = get_distances_from_player(table_df, champs_df, player)
     return table_df
 
-def get_target_idx(\
-    row, enemy_champs_df_, enemy_minions_df_, jungle_df_pre_, enemy_turrets_df_):
-    tm          = row["time"]
-    target_type = row["target_type"]
-    target_id   = row["target_id"]
-
-    if target_type == "champs":
-        obj_df = enemy_champs_df_
-    elif target_type == "minions":
-        obj_df = enemy_minions_df_
-    elif target_type == "jungle":
-        obj_df = jungle_df_pre_
-    elif target_type == "turrets":
-        obj_df = enemy_turrets_df_
-    else:
-        return 0
-
-    cur_units  = obj_df[obj_df["time"] == tm]
-    cur_units  = cur_units.sort_values(["time", "x_z_diff_from_player"], ascending=True)
-    cur_units  = cur_units[
-        (cur_units["obj_type"] != 0)]
-    target_idx = cur_units[cur_units["net_id"] == target_id].index
-    if target_idx in list(cur_units.index):
-        target_idx = list(cur_units.index).index(target_idx) + 1
-        return target_idx
-    else:
-        return 0
+def player_table_df(table_df, player, champs_df):
+    table_df  = get_distances_from_player(table_df.copy(), champs_df, player)
+    return compact_frame(table_df)
 
-def collate_observations(con, player, cutoff):
-    champs_df   = get_champs_df(con, player, cutoff=cutoff)
+def collate_observations(con, player, cutoff, end=None):
+    return collate_tables(
+        lambda table: read_table(con, table, cutoff, end), player, cutoff, end)
+
+def collate_tables(read, player, cutoff, end=None):
+    """Collates the observations of a replay whose tables are returned by
+    `read(table)`, either from a replay database or straight from JSON.
+    Observations outside of the `cutoff` to `end` window are dropped."""
+    cleaned = clean_tables(read, cutoff, end)
+    if cleaned == -1:
+        return -1
+    return player_tables(cleaned, player)
+
+def clean_tables(read, cutoff, end=None):
+    """Reads and cleans the tables of a replay, the work which is shared by
+    the observations of every player. Returns -1 for invalid replays."""
+    champs_df   = read("champs")
+    lap("read_champs")
+    champs_df   = clean_champs_df(champs_df, cutoff=cutoff, end=end)
+    lap("champs")
     if isinstance(champs_df, int):
         if champs_df == -1:
             return -1
-    objects_df  = get_table_df(con, player, champs_df, "objects", cutoff=cutoff)
-    missiles_df = get_table_df(con, player, champs_df, "missiles", cutoff=cutoff)
+    objects_df  = read("objects")
+    lap("read_objects")
+    objects_df  = clean_table_df(objects_df, cutoff=cutoff, end=end)
+    lap("objects")
+    missiles_df = read("missiles")
+    lap("read_missiles")
+    missiles_df = clean_table_df(missiles_df, cutoff=cutoff, end=end)
+    lap("missiles")
     return champs_df, objects_df, missiles_df
 
+def player_tables(cleaned, player):
+    """Collates the observations of `player` from the cleaned tables of a
+    replay, leaving the cleaned tables untouched."""
+    champs_df, objects_df, missiles_df = cleaned
+    player_champs = player_champs_df(champs_df, player)
+    objects_df    = player_table_df(objects_df, player, player_champs)
+    missiles_df   = player_table_df(missiles_df, player, player_champs)
+    lap("player_distances")
+    return player_champs, objects_df, missiles_df
+
 def infer_actions(\
     champs_df, objects_df, missiles_df, player, combined_df_base,
     enemy_champs_df_, enemy_minions_df_, jungle_df_pre_, enemy_turrets_df_):
     player_df = champs_df[champs_df["name"] == player]
+    spec      = get_spec(player)
 
     # Infer Auto Attacks
-    aa_missile_names = [
-        "jinxbasicattack",
-        "jinxbasicattack2",
-        "jinxqattack",
-        "jinxqattack2"]
-    aa_missiles = missiles_df[missiles_df["name"].isin(aa_missile_names)]
+    aa_missiles = missiles_df[missiles_df["name"].isin(spec.aa_missiles)]
     aa_missile_dst_s = aa_missiles[["time", "end_position_x", "end_position_z", "x_diff_from_player", "z_diff_from_player", "x_z_diff_from_player"]]
-    aa_missile_dst      = aa_missile_dst_s.apply(\
-        lambda row: find_aa_target(row, objects_df, champs_df), axis=1)
-    aa_missile_dst_type = aa_missile_dst.apply(lambda data: data[0])
-    aa_missile_dst_id   = aa_missile_dst.apply(lambda data: data[1])
+    aa_missile_dst_type, aa_missile_dst_id = find_aa_targets(
+        aa_missile_dst_s, {"objects": objects_df, "champs": champs_df}, spec)
     aa_missile_dst_s["target_type"] = aa_missile_dst_type
     aa_missile_dst_s["target_id"]   = aa_missile_dst_id
 
-    # Infer W's
-    w_missiles    = missiles_df[missiles_df["name"] == "jinxwmissile"].index
-    w_missile_tms = missiles_df[missiles_df.index.isin(w_missiles)]["time"]
-    w_s           = player_df[player_df["w_cast"] == True]
-
-    # Infer E's
-    e_missiles    = missiles_df[missiles_df["name"] == "jinxehit"].index
-    e_missile_tms = missiles_df[missiles_df.index.isin(e_missiles)]["time"]
-    e_s           = []
-    e_missile_filter = [True]
-    for i in range(len(e_missiles[:-1])):
-        cur_tm  = e_missile_tms.iloc[i]
-        next_tm = e_missile_tms.iloc[i + 1]
-        if next_tm - cur_tm < 5.0: # Jinx E is never 5 sec or lower so this is guaranteed to always be right
-            e_missile_filter.append(False)
-        else:
-            e_missile_filter.append(True)
-    e_missiles    = list(compress(list(e_missiles),    e_missile_filter))
-    e_missile_tms = list(compress(list(e_missile_tms), e_missile_filter))
-    for e_missile_tm in e_missile_tms:
-        current_window = player_df[\
-            (abs(player_df["time"] - e_missile_tm) < 2) &
-            (player_df["e_cast"] == True)]
-        e_s.append(current_window)
-    
+    lap("actions_aa_targets")
+
+    # Infer W's and E's
+    w_missiles = skillshot_missiles(missiles_df, spec, "w").index
+    e_missiles = skillshot_missiles(missiles_df, spec, "e").index
+
+    lap("actions_skillshots")
+
     # Infer Flashes
     flash_letter = "d" if player_df.iloc[0]["d_name"] == "flash" else "f"
     f_cast_idxs  = player_df[player_df[f"{flash_letter}_cast"] == True].index
@@ -291,6 +272,8 @@ def infer_actions(\
             (player_df["position_x_z_delta"] > 300.0)]
         flashes.append(current_window.iloc[0])
     
+    lap("actions_flash")
+
     # Infer Wards
     player_frame = player_df[player_df["name"] == player]
     player_team  = player_frame.iloc[0]["team"]
@@ -317,6 +300,8 @@ def infer_actions(\
         print("WARDS EXCEPTION:", traceback.format_exc())
         wards = []
 
+    lap("actions_wards")
+
     # Combine auto attacks
     try:
         valid_aa_missile_dst_s = aa_missile_dst_s[aa_missile_dst_s["target_id"] != -1]
@@ -331,10 +316,12 @@ def infer_actions(\
                     if target_type_str in target_type_enum
                     else -1)
         
-        # This one is inting everything else
         # Get auto attack index
-        target_idx = auto_attack_df_base.apply(\
-            lambda row: get_target_idx(row, enemy_champs_df_, enemy_minions_df_, jungle_df_pre_, enemy_turrets_df_), axis=1)
+        target_idx = target_ranks(auto_attack_df_base, {
+            "champs":  enemy_champs_df_,
+            "minions": enemy_minions_df_,
+            "jungle":  jungle_df_pre_,
+            "turrets": enemy_turrets_df_})
 
         # Set auto attack dataframe
         auto_attack_df_base = aa_missile_dst_s[["time", "target_type"]]
@@ -350,6 +337,7 @@ def infer_actions(\
         print("AUTO EXCEPTION:", traceback.format_exc(), auto_attack_df_base["target_type"])
 
     print("AUTOS DONE")
+    lap("actions_aa_idx")
 
     # Combine Q
     q_spell_df_base = player_df[player_df["q_cast"] == True]
@@ -381,6 +369,7 @@ def infer_actions(\
     e_spell_df_base["using_e"] = 1
 
     print("SPELLS DONE")
+    lap("actions_spells")
 
     # Combine flash
     if flashes:
@@ -426,6 +415,8 @@ def infer_actions(\
         "position_x_delta_digital": "movement_x_delta_digital",
         "position_z_delta_digital": "movement_z_delta_digital"})
         
+    lap("actions_other")
+
     # Combine all actions
     action_df_list = [
         auto_attack_df_base,
@@ -448,6 +439,7 @@ def infer_actions(\
     combined_df_base = combined_df_base.fillna(0)
     
     print(">>> YE FINISH ACTIONS GEEZAH!")
+    lap("actions_merge")
 
     return combined_df_base
 
@@ -784,24 +776,30 @@ def combine_obs_acts(champs_df, objects_df, missiles_df, player):
     # Combined champ obs
     enemy_champs_df_, combined_champs_df_base = get_combined_champ_obs(\
         champs_df, player_df, drop_columns, player, enemy_team)
+    lap("combine_champs")
 
     # Combine minion obs
     enemy_minions_df_, combined_minions_df_base = get_combined_minion_obs(\
         objects_df, player_df, allied_minions_count, enemy_team, enemy_minions_count)
+    lap("combine_minions")
     
     # Combine turret obs
     enemy_turrets_df_, combined_turrets_df_base = get_combined_turret_obs(\
         objects_df, player_df, allied_turrets_count, enemy_turrets_count, enemy_team)
+    lap("combine_turrets")
 
     # Combine jungle obs
     enemy_jungle_df_, combined_jungle_df_base = get_combined_jungle_obs(\
         objects_df, jungle_count)
+    lap("combine_jungle")
 
     # Combine other obs
     other_df_, combined_other_df_base = get_combine_other_obs(objects_df, other_count)
+    lap("combine_others")
 
     # Combine missile obs
     missiles_df_, combined_missile_df_base = combine_missile_obs(missiles_df, missile_count)
+    lap("combine_missiles")
 
     # Combine all obs
     combined_df_base = \
@@ -834,6 +832,7 @@ def combine_obs_acts(champs_df, objects_df, missiles_df, player):
             on="time",
             how="left",
             suffixes=('_', '__'))
+    lap("combine_merge")
 
     return \
         enemy_champs_df_, \
@@ -844,12 +843,93 @@ def combine_obs_acts(champs_df, objects_df, missiles_df, player):
         missiles_df_, \
         combined_df_base
 
-def go(db_path, player, cutoff, out_path):
-    con = sqlite3.connect(db_path)
+def go(db_path, player, cutoff, out_path, profile_path=None, end=None):
+    """Builds the dataset of a replay database, from `cutoff` until `end`
+    seconds (the end of the game by default). Only rows within that window
+    are read. If `profile_path` is set, the time and peak memory of each
+    stage are written to it as JSON."""
+    with profile(profile_path, replay=os.path.basename(db_path), player=player):
+        con = sqlite3.connect(db_path)
+
+        # Collate observations
+        print("Collate obs...")
+        collated_obs = collate_observations(con, player, cutoff, end)
+        con.close()
+        return build(collated_obs, db_path, player, out_path)
+
+def go_json(json_path, player, cutoff, out_path, profile_path=None, end=None):
+    """Same as `go`, but builds the dataset straight from a scraped *.json
+    replay instead of its replay database, skipping the SQLite round trip."""
+    with profile(profile_path, replay=os.path.basename(json_path), player=player):
+        frames = game_frames(json_path, start=cutoff, end=end)
+        lap("read_json")
+
+        # Collate observations
+        print("Collate obs...")
+        collated_obs = collate_tables(frames.__getitem__, player, cutoff, end)
+        return build(collated_obs, json_path, player, out_path)
+
+def is_multi_player(players):
+    """Returns whether `players` requests the datasets of several players."""
+    return not isinstance(players, str) or \
+        players == ALL_PLAYERS or "," in players
+
+def resolve_players(champs_df, players):
+    """Returns the list of players requested by `players`, which is either
+    `ALL_PLAYERS`, a comma separated string or a list of champion names."""
+    if players == ALL_PLAYERS:
+        return sorted(champs_df["name"].unique())
+    if isinstance(players, str):
+        return [player.strip() for player in players.split(",") if player.strip()]
+    return list(players)
+
+def build_players(cleaned, replay_path, players, out_path):
+    """Builds and saves the dataset of each of `players` from the cleaned
+    tables of a replay. Returns a dict of player to build result."""
+    champs_df = cleaned[0]
+    present   = set(champs_df["name"].unique())
+    results   = {}
+    for player in resolve_players(champs_df, players):
+        if player not in present:
+            print(f"Invalid player: {player} isn't in this replay")
+            results[player] = -1
+            continue
+        print(f"Building player: {player}")
+        results[player] = build(
+            player_tables(cleaned, player), replay_path, player, out_path)
+    return results
+
+def go_players(db_path, players, cutoff, out_path, profile_path=None, end=None):
+    """Builds the datasets of several players of a replay database, reading
+    and cleaning its tables once. `players` is either `ALL_PLAYERS`, a
+    comma separated string or a list of champion names. Returns -1 for
+    invalid replays, otherwise a dict of player to build result."""
+    with profile(profile_path, replay=os.path.basename(db_path), player=players):
+        con = sqlite3.connect(db_path)
+
+        print("Collate obs...")
+        cleaned = clean_tables(
+            lambda table: read_table(con, table, cutoff, end), cutoff, end)
+        con.close()
+        if cleaned == -1:
+            return -1
+        return build_players(cleaned, db_path, players, out_path)
+
+def go_json_players(json_path, players, cutoff, out_path, profile_path=None, end=None):
+    """Same as `go_players`, but straight from a scraped *.json replay."""
+    with profile(profile_path, replay=os.path.basename(json_path), player=players):
+        frames = game_frames(json_path, start=cutoff, end=end)
+        lap("read_json")
 
-    # Collate observations
-    print("Collate obs...")
-    collated_obs = collate_observations(con, player, cutoff)
+        print("Collate obs...")
+        cleaned = clean_tables(frames.__getitem__, cutoff, end)
+        if cleaned == -1:
+            return -1
+        return build_players(cleaned, json_path, players, out_path)
+
+def build(collated_obs, replay_path, player, out_path):
+    """Builds and saves the dataset of a replay from its collated
+    observations."""
     if collated_obs != -1:
         champs_df, objects_df, missiles_df = collated_obs
     else:
@@ -881,20 +961,23 @@ def go(db_path, player, cutoff, out_path):
                else first_minion_spawn - tm)
     combined_df_base.insert(1, "minion_spawn_countdown", minion_spawn_times)
     combined_df_base = combined_df_base.fillna(0)
+    lap("global")
 
     # Save dataset...
     print("Save dataset...")
 
     try:
         player_team = champs_df[champs_df["name"] == player].iloc[0]["team"]
-        fname = os.path.basename(db_path).split(".")[0]
+        fname = os.path.basename(replay_path).split(".")[0]
         combined_df_base = combined_df_base.astype("float16")
         outname_pkl = f"./{fname}_{player}_{player_team}.pkl"
         outname_pkl = os.path.join(out_path, outname_pkl)
         print("saving:", combined_df_base.shape)
         combined_df_base.to_pickle(outname_pkl)
+        write_manifest(combined_df_base, outname_pkl)
     except Exception as e:
         import traceback
         print("SAVE EXCEPTION:", e, print(traceback.format_exc()))
-        
+    lap("save")
+
     return 0
\ No newline at end of file
@@ -19,26 +19,37 @@
 # LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
-"""Converts a directory of json replay files into either a single massive
-SQLite database containing all replays."""
+"""Converts json replay files into SQLite databases, one per replay, named
+`{region}-{game_id}.db` inside the output directory. To query many replays at
+once, merge the per-replay databases into a single store with
+`tlol.datasets.corpus.Corpus` (or `tlol.bin.merge_corpus`).
+
+Strings (object types, unit names and spell names) are dictionary encoded:
+their columns hold integer codes into the `strings` table, so the repeated
+names don't take up space on every row."""
 
 import os
 import json
 import sqlite3
 import math
 
-CREATE_GAME_TABLE  = """CREATE TABLE games(
+CREATE_GAME_TABLE  = """CREATE TABLE IF NOT EXISTS games(
                         game_id INTEGER PRIMARY KEY,
-                        duration REAL
+                        duration REAL,
+                        window_start REAL,
+                        window_end REAL
                         )"""
 
-CREATE_CHAMP_TABLE = """CREATE TABLE champs (
+# Time window of the stored observations, NULL when a bound wasn't set
+GAME_WINDOW_COLUMNS = ["window_start", "window_end"]
+
+CREATE_CHAMP_TABLE = """CREATE TABLE IF NOT EXISTS champs (
                         game_id INTEGER,
                         time REAL,
-                        obj_type TEXT,
+                        obj_type INTEGER,
                         net_id INTEGER,
                         obj_id INTEGER,
-                        name TEXT,
+                        name INTEGER,
                         health REAL,
                         max_health REAL,
                         team INTEGER,
@@ -55,23 +66,23 @@ CREATE_CHAMP_TABLE = """CREATE TABLE champs (
                         invulnerable INTEGER,
                         recallState INTEGER,
 
-                        q_name TEXT,
+                        q_name INTEGER,
                         q_level INTEGER,
                         q_cd FLOAT,
-                        w_name TEXT,
+                        w_name INTEGER,
                         w_level INTEGER,
                         w_cd FLOAT,
-                        e_name TEXT,
+                        e_name INTEGER,
                         e_level INTEGER,
                         e_cd FLOAT,
-                        r_name TEXT,
+                        r_name INTEGER,
                         r_level INTEGER,
                         r_cd FLOAT,
-                        d_name TEXT,
+                        d_name INTEGER,
                         d_level INTEGER,
                         d_cd FLOAT,
                         d_summoner_spell_type INTEGER,
-                        f_name TEXT,
+                        f_name INTEGER,
                         f_level INTEGER,
                         f_cd FLOAT,
                         f_summoner_spell_type INTEGER,
@@ -93,13 +104,13 @@ CREATE_CHAMP_TABLE = """CREATE TABLE champs (
                         total_gold REAL
                         )"""
 
-CREATE_OBJ_TABLE   = """CREATE TABLE objects (
+CREATE_OBJ_TABLE   = """CREATE TABLE IF NOT EXISTS objects (
                         game_id INTEGER,
                         time REAL,
-                        obj_type TEXT,
+                        obj_type INTEGER,
                         net_id INTEGER,
                         obj_id INTEGER,
-                        name TEXT,
+                        name INTEGER,
                         health REAL,
                         max_health REAL,
                         team INTEGER,
@@ -117,13 +128,18 @@ CREATE_OBJ_TABLE   = """CREATE TABLE objects (
                         recallState INTEGER
                         )"""
 
-CREATE_MISSILE_TABLE = """CREATE TABLE missiles (
+CREATE_STRINGS_TABLE = """CREATE TABLE IF NOT EXISTS strings (
+                        id INTEGER PRIMARY KEY,
+                        value TEXT UNIQUE
+                        )"""
+
+CREATE_MISSILE_TABLE = """CREATE TABLE IF NOT EXISTS missiles (
                         game_id INTEGER,
                         time REAL,
-                        obj_type TEXT,
+                        obj_type INTEGER,
                         net_id INTEGER,
                         obj_id INTEGER,
-                        name TEXT,
+                        name INTEGER,
                         health REAL,
                         max_health REAL,
                         team INTEGER,
@@ -145,6 +161,53 @@ CREATE_MISSILE_TABLE = """CREATE TABLE missiles (
                         destination_idx INTEGER
                         )"""
 
+TABLES = ["champs", "objects", "missiles"]
+
+# Indexes for time, unit type and team slices and per-unit lookups. They're
+# created after the bulk load, which is quicker than maintaining them per row.
+CREATE_INDEXES = [
+    stmt.format(table=table) for table in TABLES for stmt in [
+        "CREATE INDEX IF NOT EXISTS {table}_time_type_team "
+        "ON {table} (time, obj_type, team)",
+        "CREATE INDEX IF NOT EXISTS {table}_name_time ON {table} (name, time)"]]
+
+# Columns holding codes into the strings table
+STRING_COLUMNS = ["obj_type", "name",
+                  "q_name", "w_name", "e_name", "r_name", "d_name", "f_name"]
+
+# Order in which the objects of each observation are inserted
+OBSERVATION_KEYS = ["champs", "minions", "turrets", "jungle", "missiles", "others"]
+
+SPELLS = ["Q", "W", "E", "R", "D", "F"]
+
+def column_affinities(create_table):
+    """Returns the (column, SQLite type affinity) pairs of a CREATE TABLE.
+    Dictionary encoded columns are reported as TEXT, as they're decoded
+    when they're read."""
+    body = create_table[create_table.index("(") + 1:create_table.rindex(")")]
+    columns = []
+    for ln in body.split(","):
+        ln = ln.split()
+        if not ln:
+            continue
+        name, decl_type = ln[0], ln[1].upper()
+        if name in STRING_COLUMNS:
+            affinity = "TEXT"
+        elif "INT" in decl_type:
+            affinity = "INTEGER"
+        elif "CHAR" in decl_type or "TEXT" in decl_type:
+            affinity = "TEXT"
+        else:
+            affinity = "REAL"
+        columns.append((name, affinity))
+    return columns
+
+TABLE_COLUMNS = {
+    "champs":   column_affinities(CREATE_CHAMP_TABLE),
+    "objects":  column_affinities(CREATE_OBJ_TABLE),
+    "missiles": column_affinities(CREATE_MISSILE_TABLE)
+}
+
 def handle_nan(x):
     return 0 if math.isnan(x) else x
     
@@ -156,148 +219,232 @@ def handle_str(x):
     except:
         return "N/A"
 
-def insert_objs(game_id, obs, cur, time, table):
-    for c in obs[table]:
-        try:
-            if table == "champs":
-                cur.execute(f"""INSERT INTO champs VALUES (
-                   {game_id},
-                    {time},
-                    '{table}',
-                    {c["net_id"]},
-                    {c["obj_id"]},
-                    '{handle_str(c["name"])}',
-                    {handle_nan(c["health"])},
-                    {handle_nan(c["max_health"])},
-                    {int(c["team"])},
-                    {handle_nan(c["armour"])},
-                    {handle_nan(c["mr"])},
-                    {handle_nan(c["movement_speed"])},
-                    {1 if c["is_alive"] else 0},
-                    {handle_nan(c["position"]["x"])},
-                    {handle_nan(c["position"]["y"])},
-                    {handle_nan(c["position"]["z"])},
-
-                    {1 if c["is_moving"] else 0},
-                    {1 if c["targetable"] else 0},
-                    {1 if c["invulnerable"] else 0},
-                    {c["recallState"]},
-
-                    '{c["Q"]["name"]}',
-                    {c["Q"]["level"]},
-                    {c["Q"]["cd"]},
-                    '{c["W"]["name"]}',
-                    {c["W"]["level"]},
-                    {c["W"]["cd"]},
-                    '{c["E"]["name"]}',
-                    {c["E"]["level"]},
-                    {c["E"]["cd"]},
-                    '{c["R"]["name"]}',
-                    {c["R"]["level"]},
-                    {c["R"]["cd"]},
-                    '{c["D"]["name"]}',
-                    {c["D"]["level"]},
-                    {c["D"]["cd"]},
-                    {c["D"]["summoner_spell_type"]},
-                    '{c["F"]["name"]}',
-                    {c["F"]["level"]},
-                    {c["F"]["cd"]},
-                    {c["F"]["summoner_spell_type"]},
-                    
-                    {handle_nan(c["crit"])},
-                    {handle_nan(c["crit_multi"])},
-                    {handle_nan(c["level"])},
-                    {handle_nan(c["mana"])},
-                    {handle_nan(c["max_mana"])},
-                    {handle_nan(c["ability_haste"])},
-                    {handle_nan(c["ap"])},
-                    {handle_nan(c["lethality"])},
-                    {handle_nan(c["experience"])},
-                    {handle_nan(c["mana_regen"])},
-                    {handle_nan(c["health_regen"])},
-                    {handle_nan(c["attack_range"])},
-
-                    {handle_nan(c["current_gold"])},
-                    {handle_nan(c["total_gold"])}
-                    )""")
-            
-            elif table == "missiles":
-                cur.execute(f"""INSERT INTO missiles VALUES (
-                    {game_id},
-                    {time},
-                    '{table}',
-                    {c["net_id"]},
-                    {c["obj_id"]},
-                    '{handle_str(c["name"])}',
-                    {handle_nan(c["health"])},
-                    {handle_nan(c["max_health"])},
-                    {int(c["team"])},
-                    {handle_nan(c["armour"])},
-                    {handle_nan(c["mr"])},
-                    {handle_nan(c["movement_speed"])},
-                    {1 if c["is_alive"] else 0},
-                    {handle_nan(c["position"]["x"])},
-                    {handle_nan(c["position"]["y"])},
-                    {handle_nan(c["position"]["z"])},
-
-                    {handle_nan(c["start_pos"]["x"])},
-                    {handle_nan(c["start_pos"]["y"])},
-                    {handle_nan(c["start_pos"]["z"])},
-                    {handle_nan(c["end_pos"]["x"])},
-                    {handle_nan(c["end_pos"]["y"])},
-                    {handle_nan(c["end_pos"]["z"])},
-                    {int(c["src_id"])},
-                    {int(c["dest_id"])}
-                    )""")
-            
+def base_row(game_id, time, table, c):
+    return [
+        int(game_id),
+        time,
+        table,
+        c["net_id"],
+        c["obj_id"],
+        handle_str(c["name"]),
+        handle_nan(c["health"]),
+        handle_nan(c["max_health"]),
+        int(c["team"]),
+        handle_nan(c["armour"]),
+        handle_nan(c["mr"]),
+        handle_nan(c["movement_speed"]),
+        1 if c["is_alive"] else 0,
+        handle_nan(c["position"]["x"]),
+        handle_nan(c["position"]["y"]),
+        handle_nan(c["position"]["z"])
+    ]
+
+def state_row(c):
+    return [
+        1 if c["is_moving"] else 0,
+        1 if c["targetable"] else 0,
+        1 if c["invulnerable"] else 0,
+        c["recallState"]
+    ]
+
+def champ_row(game_id, time, c):
+    row = base_row(game_id, time, "champs", c) + state_row(c)
+    for spell in SPELLS:
+        row += [c[spell]["name"], c[spell]["level"], c[spell]["cd"]]
+        if spell in ["D", "F"]:
+            row.append(c[spell]["summoner_spell_type"])
+    return row + [
+        handle_nan(c["crit"]),
+        handle_nan(c["crit_multi"]),
+        handle_nan(c["level"]),
+        handle_nan(c["mana"]),
+        handle_nan(c["max_mana"]),
+        handle_nan(c["ability_haste"]),
+        handle_nan(c["ap"]),
+        handle_nan(c["lethality"]),
+        handle_nan(c["experience"]),
+        handle_nan(c["mana_regen"]),
+        handle_nan(c["health_regen"]),
+        handle_nan(c["attack_range"]),
+
+        handle_nan(c["current_gold"]),
+        handle_nan(c["total_gold"])
+    ]
+
+def missile_row(game_id, time, c):
+    return base_row(game_id, time, "missiles", c) + [
+        handle_nan(c["start_pos"]["x"]),
+        handle_nan(c["start_pos"]["y"]),
+        handle_nan(c["start_pos"]["z"]),
+        handle_nan(c["end_pos"]["x"]),
+        handle_nan(c["end_pos"]["y"]),
+        handle_nan(c["end_pos"]["z"]),
+        int(c["src_id"]),
+        int(c["dest_id"])
+    ]
+
+def object_row(game_id, time, table, c):
+    return base_row(game_id, time, table, c) + state_row(c)
+
+def game_rows(game_id, obj, start=None, end=None):
+    """Returns a dict of table name to the rows of a scraped replay, in the
+    order the observations were scraped. Objects which can't be converted
+    are reported and skipped. Only observations within the time window
+    `start <= time < end` are converted, when either bound is set."""
+    rows = {table: [] for table in TABLES}
+    for obs in obj:
+        time = obs["time"]
+        if start is not None and time < start:
+            continue
+        if end is not None and time >= end:
+            break
+        for table in OBSERVATION_KEYS:
+            for c in obs[table]:
+                try:
+                    if table == "champs":
+                        rows["champs"].append(champ_row(game_id, time, c))
+                    elif table == "missiles":
+                        rows["missiles"].append(missile_row(game_id, time, c))
+                    else:
+                        rows["objects"].append(object_row(game_id, time, table, c))
+                except Exception as e:
+                    print(e, handle_str(c["name"]))
+                    print(json.dumps(c, indent=4, sort_keys=True))
+    return rows
+
+def apply_affinity(value, affinity):
+    """Converts a value the same way SQLite's column type affinity does when
+    it's stored and read back, e.g. NaN becomes NULL and whole floats in
+    INTEGER columns become integers."""
+    if value is None or affinity == "TEXT":
+        return value
+    if isinstance(value, float):
+        if math.isnan(value):
+            return None
+        if affinity == "INTEGER" and value.is_integer():
+            return int(value)
+        return value
+    if isinstance(value, (bool, int)):
+        return float(value) if affinity == "REAL" else int(value)
+    return value
+
+def read_replay(json_path):
+    """Returns the game ID and observations of a scraped *.json replay."""
+    game_id = os.path.basename(json_path).split(".")[0].split("-")[1]
+    with open(json_path, encoding="latin-1") as f:
+        return game_id, json.loads(f.read())
+
+def game_frames(json_path, start=None, end=None):
+    """Converts a scraped *.json replay straight into the DataFrames which
+    `SELECT * FROM <table>` returns for a database written by
+    `convert_dataset`, without going through SQLite. Returns a dict of
+    table name to DataFrame, limited to the `start` to `end` time window."""
+    import pandas as pd
+
+    game_id, obj = read_replay(json_path)
+    rows = game_rows(game_id, obj, start, end)
+    frames = {}
+    for table, table_rows in rows.items():
+        columns = TABLE_COLUMNS[table]
+        affinities = [affinity for _, affinity in columns]
+        typed_rows = [tuple(apply_affinity(value, affinity)
+                            for value, affinity in zip(row, affinities))
+                      for row in table_rows]
+        frames[table] = compact_frame(pd.DataFrame.from_records(
+            typed_rows,
+            columns=[name for name, _ in columns],
+            coerce_float=True))
+    return frames
+
+def read_strings(con):
+    """Returns the (ids, values) of a replay database's strings table, or
+    None for databases which store strings as TEXT."""
+    import numpy as np
+
+    try:
+        rows = con.execute("SELECT id, value FROM strings ORDER BY id").fetchall()
+    except sqlite3.OperationalError:
+        return None
+    return np.array([i for i, _ in rows], dtype="int64"), [v for _, v in rows]
+
+def compact_frame(df, strings=None):
+    """Converts a table's DataFrame to compact dtypes: string columns become
+    categoricals (decoding their codes with `strings` from `read_strings`),
+    floats become float32 and integers the smallest integer type which
+    holds them. Categories are sorted, so frames read from databases and
+    built straight from JSON are identical."""
+    import numpy as np
+    import pandas as pd
+
+    for col in df.columns:
+        dtype = df[col].dtype
+        if isinstance(dtype, pd.CategoricalDtype):
+            continue
+        if col in STRING_COLUMNS:
+            if strings is not None and dtype != object:
+                ids, values = strings
+                codes = df[col].to_numpy(dtype="float64")
+                known = ~np.isnan(codes)
+                positions = np.full(len(codes), -1, dtype="int64")
+                positions[known] = np.searchsorted(ids, codes[known].astype("int64"))
+                cat = pd.Categorical.from_codes(positions, categories=values)
             else:
-                cur.execute(f"""INSERT INTO objects VALUES (
-                    {game_id},
-                    {time},
-                    '{table}',
-                    {c["net_id"]},
-                    {c["obj_id"]},
-                    '{handle_str(c["name"])}',
-                    {handle_nan(c["health"])},
-                    {handle_nan(c["max_health"])},
-                    {int(c["team"])},
-                    {handle_nan(c["armour"])},
-                    {handle_nan(c["mr"])},
-                    {handle_nan(c["movement_speed"])},
-                    {1 if c["is_alive"] else 0},
-                    {handle_nan(c["position"]["x"])},
-                    {handle_nan(c["position"]["y"])},
-                    {handle_nan(c["position"]["z"])},
-                    {1 if c["is_moving"] else 0},
-                    {1 if c["targetable"] else 0},
-                    {1 if c["invulnerable"] else 0},
-                    {c["recallState"]}
-                    )""")
-
-        except Exception as e:
-            print(e, handle_str(c["name"]))
-            print('check for \\u:', "\\u" in c["name"])
-            print(json.dumps(c, indent=4, sort_keys=True))
-            
-def insert_game(cur_fi, cur):
-    game_id = os.path.basename(cur_fi).split(".")[0].split("-")[1]
-
-    with open(cur_fi, encoding="latin-1") as f:
-        obj = json.loads(f.read())
-
-        duration = obj[-1]["time"]
-        cur.execute(f'INSERT INTO games VALUES({game_id}, {duration})')
-
-        for obs in obj:
-            time = obs["time"]
-            insert_objs(game_id, obs, cur, time, "champs")
-            insert_objs(game_id, obs, cur, time, "minions")
-            insert_objs(game_id, obs, cur, time, "turrets")
-            insert_objs(game_id, obs, cur, time, "jungle")
-            insert_objs(game_id, obs, cur, time, "missiles")
-            insert_objs(game_id, obs, cur, time, "others")
-
-def convert_dataset(json_path, db_dir, big_int=False):
+                cat = pd.Categorical(df[col])
+            cat = cat.remove_unused_categories()
+            df[col] = cat.reorder_categories(sorted(cat.categories))
+        elif pd.api.types.is_float_dtype(dtype):
+            df[col] = df[col].astype("float32")
+        elif pd.api.types.is_integer_dtype(dtype):
+            df[col] = pd.to_numeric(df[col], downcast="integer")
+    return df
+
+def encode_rows(rows, columns, strings):
+    """Replaces the strings of dictionary encoded columns with their codes,
+    adding new strings to the `strings` dict of string to code."""
+    string_idxs = [i for i, (name, _) in enumerate(columns)
+                   if name in STRING_COLUMNS]
+    for row in rows:
+        for i in string_idxs:
+            value = row[i]
+            if value is not None:
+                code = strings.get(value)
+                if code is None:
+                    code = strings[value] = len(strings)
+                row[i] = code
+    return rows
+
+def insert_game(cur_fi, cur, start=None, end=None):
+    game_id, obj = read_replay(cur_fi)
+
+    duration = obj[-1]["time"]
+    cur.execute(
+        'INSERT INTO games (game_id, duration, window_start, window_end) '
+        'VALUES(?, ?, ?, ?)', (int(game_id), duration, start, end))
+
+    strings = {value: code for code, value in
+               cur.execute("SELECT id, value FROM strings")}
+    known = len(strings)
+    for table, table_rows in game_rows(game_id, obj, start, end).items():
+        columns = TABLE_COLUMNS[table]
+        placeholders = ", ".join("?" * len(columns))
+        cur.executemany(
+            f"INSERT INTO {table} VALUES ({placeholders})",
+            encode_rows(table_rows, columns, strings))
+    cur.executemany(
+        "INSERT INTO strings VALUES (?, ?)",
+        [(code, value) for value, code in strings.items() if code >= known])
+
+def create_indexes(cur):
+    """Creates the table indexes of a replay database, if they don't exist."""
+    for create_index in CREATE_INDEXES:
+        cur.execute(create_index)
+
+def convert_dataset(json_path, db_dir, big_int=False, start=None, end=None):
+    """Converts a scraped *.json replay into a replay database within
+    `db_dir`. If `start` or `end` are set, only the observations within
+    that time window in seconds are stored, e.g. `end=300.0` for the first
+    five minutes. The game's duration is always its full length, and the
+    window is recorded alongside it in the games table."""
     region, game_id = \
         os.path.basename(json_path).split(".json")[0].split("-")
     db_path = os.path.join(db_dir, f"{region}-{game_id}.db")
@@ -307,11 +454,19 @@ def convert_dataset(json_path, db_dir, big_int=False):
 
     cur.execute("BEGIN;")
 
+    for create_table in [CREATE_GAME_TABLE,
+                         CREATE_CHAMP_TABLE,
+                         CREATE_OBJ_TABLE,
+                         CREATE_MISSILE_TABLE,
+                         CREATE_STRINGS_TABLE]:
+        cur.execute(create_table)
+
     try:
-        insert_game(json_path, cur)
+        insert_game(json_path, cur, start, end)
+        create_indexes(cur)
     except Exception as e:
         print(e)
     
     cur.execute("COMMIT;")
 
-    con.close()
\ No newline at end of file
+    con.close()
@@ -0,0 +1,230 @@
+# MIT License
+# 
+# Copyright (c) 2023 MiscellaneousStuff
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""Corpus of replays merged into a single SQLite database.
+
+`convert_dataset` writes a small database per replay, which is what the
+builder wants, but corpus wide statistics would have to open every one of
+them. `Corpus` appends per-replay databases into one database with the
+same tables, partitioned by game: rows of a game are stored contiguously
+and every table is indexed on (game_id, time). Dictionary encoded strings
+are remapped onto the corpus' own strings table on the way in."""
+
+import os
+import sqlite3
+
+import pandas as pd
+
+from tlol.datasets.convertor import \
+    CREATE_GAME_TABLE, CREATE_CHAMP_TABLE, CREATE_OBJ_TABLE, \
+    CREATE_MISSILE_TABLE, CREATE_STRINGS_TABLE, CREATE_INDEXES, \
+    GAME_WINDOW_COLUMNS, TABLES, TABLE_COLUMNS, STRING_COLUMNS, \
+    compact_frame, read_strings
+
+CREATE_GAME_INDEXES = [
+    f"CREATE INDEX IF NOT EXISTS {table}_game_time ON {table} (game_id, time)"
+    for table in TABLES]
+
+
+class Corpus(object):
+    """Merged database of many replays.
+
+    Args:
+        db_path: Path of the corpus database. Created if it doesn't exist.
+    """
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.con = sqlite3.connect(db_path, uri=True, isolation_level=None)
+        for create_table in [CREATE_GAME_TABLE,
+                             CREATE_CHAMP_TABLE,
+                             CREATE_OBJ_TABLE,
+                             CREATE_MISSILE_TABLE,
+                             CREATE_STRINGS_TABLE]:
+            self.con.execute(create_table)
+        # Corpora created before games recorded their time window
+        missing = set(GAME_WINDOW_COLUMNS) - self._game_columns("main")
+        for column in GAME_WINDOW_COLUMNS:
+            if column in missing:
+                self.con.execute(f"ALTER TABLE games ADD COLUMN {column} REAL")
+
+    def _game_columns(self, schema):
+        return set(row[1] for row in
+                   self.con.execute(f"PRAGMA {schema}.table_info(games)"))
+
+    def close(self):
+        self.con.close()
+
+    def game_ids(self):
+        return set(game_id for (game_id,) in
+                   self.con.execute("SELECT game_id FROM games"))
+
+    def create_indexes(self):
+        """Creates the per-game and slice indexes of every table. Merges are
+        quicker when this is done after the bulk of the replays are in."""
+        for create_index in CREATE_GAME_INDEXES + CREATE_INDEXES:
+            self.con.execute(create_index)
+
+    def _map_strings(self, src_encoded):
+        """Adds the strings of the attached replay to the corpus and fills
+        `temp.string_map` with their source to corpus codes."""
+        cur = self.con.cursor()
+        cur.execute("CREATE TEMP TABLE IF NOT EXISTS string_map "
+                    "(src INTEGER PRIMARY KEY, dst INTEGER)")
+        cur.execute("DELETE FROM temp.string_map")
+        if src_encoded:
+            cur.execute("INSERT OR IGNORE INTO main.strings (value) "
+                        "SELECT value FROM src.strings")
+            cur.execute("INSERT INTO temp.string_map "
+                        "SELECT s.id, c.id FROM src.strings s "
+                        "JOIN main.strings c ON s.value = c.value")
+            return
+        for table in TABLES:
+            for column, _ in TABLE_COLUMNS[table]:
+                if column in STRING_COLUMNS:
+                    cur.execute(
+                        f"INSERT OR IGNORE INTO main.strings (value) "
+                        f"SELECT DISTINCT {column} FROM src.{table} "
+                        f"WHERE {column} IS NOT NULL")
+
+    def _string_expr(self, column, src_encoded):
+        if src_encoded:
+            return (f"(SELECT dst FROM temp.string_map "
+                    f"WHERE src = {column})")
+        return f"(SELECT id FROM main.strings WHERE value = {column})"
+
+    def ingest(self, replay_path):
+        """Appends a per-replay database to the corpus. Returns the number of
+        games added, which is 0 for games the corpus already holds."""
+        cur = self.con.cursor()
+        cur.execute("ATTACH DATABASE ? AS src",
+                    (f"file:{replay_path}?mode=ro",))
+        try:
+            src_games = [game_id for (game_id,) in
+                         cur.execute("SELECT game_id FROM src.games")]
+            new_games = set(src_games) - self.game_ids()
+            if not new_games:
+                return 0
+            src_encoded = cur.execute(
+                "SELECT COUNT(*) FROM src.sqlite_master "
+                "WHERE type = 'table' AND name = 'strings'").fetchone()[0] > 0
+
+            cur.execute("BEGIN;")
+            try:
+                self._map_strings(src_encoded)
+                placeholders = ", ".join("?" * len(new_games))
+                # Replays converted before the window was recorded hold
+                # whole games
+                src_columns = self._game_columns("src")
+                window = ", ".join(
+                    column if column in src_columns else "NULL"
+                    for column in GAME_WINDOW_COLUMNS)
+                cur.execute(
+                    f"INSERT INTO main.games "
+                    f"(game_id, duration, {', '.join(GAME_WINDOW_COLUMNS)}) "
+                    f"SELECT game_id, duration, {window} FROM src.games "
+                    f"WHERE game_id IN ({placeholders})", list(new_games))
+                for table in TABLES:
+                    select = ", ".join(
+                        self._string_expr(column, src_encoded)
+                        if column in STRING_COLUMNS else column
+                        for column, _ in TABLE_COLUMNS[table])
+                    cur.execute(
+                        f"INSERT INTO main.{table} SELECT {select} "
+                        f"FROM src.{table} WHERE game_id IN ({placeholders}) "
+                        f"ORDER BY game_id, time", list(new_games))
+                cur.execute("COMMIT;")
+            except Exception:
+                cur.execute("ROLLBACK;")
+                raise
+            return len(new_games)
+        finally:
+            cur.execute("DETACH DATABASE src")
+
+    def merge(self, replay_paths, report_every=100):
+        """Ingests many per-replay databases, skipping those which fail to
+        open, then indexes the corpus. Returns (games added, failed paths)."""
+        added, failed = 0, []
+        for i, replay_path in enumerate(replay_paths):
+            try:
+                added += self.ingest(replay_path)
+            except sqlite3.Error as e:
+                print(f"Failed to merge {replay_path}: {e}")
+                failed.append(replay_path)
+            if report_every and (i + 1) % report_every == 0:
+                print(f"Merged {i + 1}/{len(replay_paths)} replays")
+        self.create_indexes()
+        return added, failed
+
+    def query(self, sql, params=()):
+        """Runs a query against the corpus, decoding any string columns."""
+        result_df = pd.read_sql_query(sql, self.con, params=params)
+        return compact_frame(result_df, read_strings(self.con))
+
+    def _codes(self, values):
+        strings = read_strings(self.con)
+        codes = {value: int(code) for code, value in zip(*strings)}
+        return [codes.get(value, -1) for value in values]
+
+    def stat_at(self, column, time, table="champs", agg="AVG",
+                obj_type=None):
+        """Aggregates `column` across games at `time` seconds, per unit name.
+        Each game contributes its last observation at or before `time`.
+        Games shorter than `time`, or converted with a time window which
+        doesn't cover it, are left out.
+
+        Args:
+            column: Column to aggregate, e.g. `total_gold`.
+            time: Game time in seconds, e.g. 600 for 10 minutes.
+            table: Table the column belongs to.
+            agg: SQL aggregate, one of AVG, MIN, MAX, SUM or TOTAL.
+            obj_type: (Optional) Only aggregate units of this type.
+        """
+        known = [name for name, _ in TABLE_COLUMNS.get(table, [])]
+        if column not in known:
+            raise ValueError(f"Unknown {table} column: {column}")
+        if agg.upper() not in ["AVG", "MIN", "MAX", "SUM", "TOTAL"]:
+            raise ValueError(f"Unsupported aggregate: {agg}")
+
+        type_filter, params = "", [time, time, time, time]
+        if obj_type is not None:
+            type_filter = "AND t.obj_type = ?"
+            params += self._codes([obj_type])
+        sql = f"""WITH at AS (
+                      SELECT t.game_id, MAX(t.time) AS time
+                      FROM {table} t JOIN games g ON t.game_id = g.game_id
+                      WHERE t.time <= ? AND g.duration >= ?
+                          AND (g.window_start IS NULL OR g.window_start <= ?)
+                          AND (g.window_end IS NULL OR g.window_end > ?)
+                      GROUP BY t.game_id)
+                  SELECT t.name,
+                         {agg.upper()}(t.{column}) AS {column},
+                         COUNT(DISTINCT t.game_id) AS games
+                  FROM {table} t JOIN at
+                      ON t.game_id = at.game_id AND t.time = at.time
+                  WHERE 1 {type_filter}
+                  GROUP BY t.name"""
+        stat_df = self.query(sql, params)
+        return stat_df.sort_values("name").reset_index(drop=True)
+
+def find_replays(db_dir):
+    """Returns the paths of the per-replay databases within `db_dir`."""
+    return sorted(os.path.join(db_dir, fi)
+                  for fi in os.listdir(db_dir) if fi.endswith(".db"))
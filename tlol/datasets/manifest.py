@@ -0,0 +1,128 @@
+# MIT License
+# 
+# Copyright (c) 2023 MiscellaneousStuff
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""Sidecar manifests of built ML datasets.
+
+`builder.go` writes a small JSON manifest next to every game DataFrame it
+saves, holding the frame count, columns, dtype and size of the game, so
+dataset statistics don't need to unpickle every game. Manifests live in a
+`manifest` subdirectory of the dataset directory."""
+
+import os
+import json
+import concurrent.futures
+
+import numpy as np
+import pandas as pd
+
+MANIFEST_DIR = "manifest"
+
+PERCENTILES = [1, 5, 25, 50, 75, 95, 99]
+
+
+def list_games(dataset_dir):
+    """Returns the sorted file names of the games within `dataset_dir`."""
+    return sorted(f for f in os.listdir(dataset_dir) if f.endswith(".pkl"))
+
+def manifest_path(pkl_path):
+    dataset_dir, fname = os.path.split(pkl_path)
+    return os.path.join(
+        dataset_dir, MANIFEST_DIR, fname.replace(".pkl", ".json"))
+
+def describe_game(df, pkl_path):
+    """Returns the manifest of the game DataFrame `df` saved at `pkl_path`."""
+    dtypes = set(str(dtype) for dtype in df.dtypes)
+    return {
+        "file": os.path.basename(pkl_path),
+        "frames": int(df.shape[0]),
+        "columns": int(df.shape[1]),
+        "dtype": dtypes.pop() if len(dtypes) == 1 else "mixed",
+        "bytes": os.path.getsize(pkl_path)
+    }
+
+def write_manifest(df, pkl_path):
+    """Writes the manifest of the game DataFrame `df` saved at `pkl_path`."""
+    path = manifest_path(pkl_path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    manifest = describe_game(df, pkl_path)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, path)
+    return manifest
+
+def read_manifest(pkl_path):
+    """Returns the manifest of the game at `pkl_path`, or None if it's
+    missing or the game has been rewritten since."""
+    try:
+        with open(manifest_path(pkl_path)) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if manifest.get("bytes") != os.path.getsize(pkl_path):
+        return None
+    return manifest
+
+def scan_game(pkl_path):
+    """Unpickles a game and writes its manifest."""
+    return write_manifest(pd.read_pickle(pkl_path), pkl_path)
+
+def collect_manifests(dataset_dir, max_workers=None):
+    """Returns the manifests of every game within `dataset_dir`. Games
+    without a manifest are unpickled in a process pool and their manifests
+    are written, so they're only scanned once."""
+    manifests = []
+    missing = []
+    for fname in list_games(dataset_dir):
+        pkl_path = os.path.join(dataset_dir, fname)
+        manifest = read_manifest(pkl_path)
+        if manifest is None:
+            missing.append(pkl_path)
+        else:
+            manifests.append(manifest)
+
+    if missing:
+        print(f"Scanning {len(missing)} games without a manifest...")
+        with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers) as executor:
+            future_to_path = {executor.submit(scan_game, pkl_path): pkl_path
+                              for pkl_path in missing}
+            for future in concurrent.futures.as_completed(future_to_path):
+                try:
+                    manifests.append(future.result())
+                except Exception as exc:
+                    print("ERR:", future_to_path[future], str(exc))
+
+    return sorted(manifests, key=lambda manifest: manifest["file"])
+
+def frame_percentiles(frames, percentiles=PERCENTILES):
+    """Returns a dict of percentile to game length in frames."""
+    values = np.percentile(frames, percentiles)
+    return {p: float(v) for p, v in zip(percentiles, values)}
+
+def frame_histogram(frames, bins=10, width=50):
+    """Returns a text histogram of game lengths in frames."""
+    counts, edges = np.histogram(frames, bins=bins)
+    scale = width / max(counts.max(), 1)
+    lines = []
+    for count, lo, hi in zip(counts, edges[:-1], edges[1:]):
+        bar = "#" * int(round(count * scale))
+        lines.append(f"{int(lo):>8}-{int(hi):<8} {count:>7} {bar}")
+    return "\n".join(lines)
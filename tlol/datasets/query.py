@@ -0,0 +1,130 @@
+# MIT License
+# 
+# Copyright (c) 2023 MiscellaneousStuff
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""Queries slices of replay databases without loading whole games.
+
+Tables are filtered in SQL by time range, unit type, team and unit name,
+using the indexes `convertor.create_indexes` adds, and returned with the
+compact dtypes of `convertor.compact_frame`. For example, the first five
+minutes of the enemy champions of Jinx:
+
+    con = open_replay("EUW1-123.db")
+    champs_df = query_table(con, "champs", end=300.0,
+                            team=enemy_team(con, "jinx"))"""
+
+import sqlite3
+
+import pandas as pd
+
+from tlol.datasets.convertor import \
+    TABLE_COLUMNS, compact_frame, read_strings
+
+TEAMS = [100, 200]
+
+
+def open_replay(db_path):
+    """Opens a replay database read-only."""
+    return sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+
+def as_list(value):
+    if value is None:
+        return None
+    if isinstance(value, (list, tuple, set)):
+        return list(value)
+    return [value]
+
+def string_codes(strings, values):
+    """Returns the codes of `values` within a database's strings table, or the
+    values themselves for databases which store strings as TEXT. Strings the
+    database has never seen are left out."""
+    if strings is None:
+        return values
+    ids, stored = strings
+    codes = {value: int(code) for code, value in zip(ids, stored)}
+    return [codes[value] for value in values if value in codes]
+
+def in_clause(column, values):
+    if not values:
+        return "0", []
+    return f"{column} IN ({', '.join('?' * len(values))})", values
+
+def query_table(con, table, start=None, end=None,
+                obj_type=None, team=None, name=None, columns=None):
+    """Returns the rows of a replay database table within a slice, ordered
+    by time and then by insertion order, whichever index answers the query.
+
+    Args:
+        con: Connection to a replay database.
+        table: One of `champs`, `objects` or `missiles`.
+        start: (Optional) Earliest time in seconds, inclusive.
+        end: (Optional) Latest time in seconds, exclusive.
+        obj_type: (Optional) Unit type(s), e.g. `minions` or `turrets`.
+        team: (Optional) Team(s), 100 or 200.
+        name: (Optional) Unit name(s), e.g. `jinx`.
+        columns: (Optional) Columns to select, all of them by default.
+    """
+    if table not in TABLE_COLUMNS:
+        raise ValueError(f"Unknown table: {table}")
+    known = [column for column, _ in TABLE_COLUMNS[table]]
+    columns = columns or known
+    unknown = [column for column in columns if column not in known]
+    if unknown:
+        raise ValueError(f"Unknown {table} columns: {', '.join(unknown)}")
+
+    strings = read_strings(con)
+    where, params = [], []
+    if start is not None:
+        where.append("time >= ?")
+        params.append(start)
+    if end is not None:
+        where.append("time < ?")
+        params.append(end)
+    for column, values in [("obj_type", as_list(obj_type)),
+                           ("name", as_list(name))]:
+        if values is not None:
+            clause, clause_params = \
+                in_clause(column, string_codes(strings, values))
+            where.append(clause)
+            params.extend(clause_params)
+    teams = as_list(team)
+    if teams is not None:
+        clause, clause_params = in_clause("team", [int(t) for t in teams])
+        where.append(clause)
+        params.extend(clause_params)
+
+    sql = f"SELECT {', '.join(columns)} FROM {table}"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += " ORDER BY time, rowid"
+    table_df = pd.read_sql_query(sql, con, params=params)
+    return compact_frame(table_df, strings)
+
+def player_team(con, player):
+    """Returns the team of the champion `player`, or None if they're absent."""
+    team_df = query_table(con, "champs", name=player, columns=["team"])
+    return int(team_df["team"].iloc[0]) if len(team_df) > 0 else None
+
+def enemy_team(con, player):
+    """Returns the team opposing the champion `player`."""
+    team = player_team(con, player)
+    if team is None:
+        raise ValueError(f"{player} isn't in this replay")
+    return TEAMS[1 - TEAMS.index(team)]
@@ -28,6 +28,7 @@ import numpy as np
 import torch
 
 from tlol.datasets import lib
+from tlol.datasets.manifest import list_games
 
 UNIT_FEATURE_COUNTS = {
     "champs":   65,
@@ -116,7 +117,7 @@ class TLoLReplayDataset(torch.utils.data.Dataset):
                  obs_per_scene=0):
         self.dataset_type  = dataset_type
         self.root_dir = root_dir
-        self.files = os.listdir(root_dir)
+        self.files = list_games(root_dir)
         self.obs_per_scene = obs_per_scene
 
     def __len__(self):
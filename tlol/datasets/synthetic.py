@@ -0,0 +1,208 @@
+# MIT License
+# 
+# Copyright (c) 2023 MiscellaneousStuff
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""Synthetic replays in the scraper's JSON format.
+
+Generates games with a configurable duration, unit counts and missile
+density, so the conversion and build pipeline can be benchmarked and
+tested without real scraped replays. Champions move on smooth paths, cast
+spells on cooldown, flash and recall occasionally, and the player's auto
+attack missiles land on enemy units so auto attack targets are found."""
+
+import os
+import json
+import math
+import random
+
+DEFAULT_CHAMPS = ["jinx", "thresh", "ahri", "leesin", "garen",
+                  "caitlyn", "lux", "zed", "vi", "darius"]
+
+SPELLS = ["Q", "W", "E", "R", "D", "F"]
+
+AUTO_ATTACK_MISSILES = ["jinxbasicattack", "jinxbasicattack2",
+                        "jinxqattack", "jinxqattack2"]
+
+OTHER_MISSILES = ["jinxwmissile", "jinxehit", "ahriorbmissile",
+                  "caitlynpiltoverpeacemaker", "luxlightbindingmis"]
+
+
+def unit(rng, net_id, name, team, x, z, hp=1000.0):
+    return {
+        "net_id": net_id,
+        "obj_id": net_id % 1000,
+        "name": name,
+        "health": hp,
+        "max_health": hp,
+        "team": team,
+        "armour": 30.0,
+        "mr": 30.0,
+        "movement_speed": 330.0,
+        "is_alive": True,
+        "position": {"x": x, "y": 50.0, "z": z},
+        "is_moving": rng.random() < 0.5,
+        "targetable": True,
+        "invulnerable": False,
+        "recallState": 0
+    }
+
+def champ(rng, i, name, t, cds, flash_offset):
+    team = 100 if i < 5 else 200
+    x = 1000 + i * 500 + 300 * math.sin(t / 10 + i) + flash_offset
+    z = 1000 + i * 400 + 300 * math.cos(t / 10 + i)
+    c = unit(rng, 1000 + i, name, team, round(x, 1), round(z, 1))
+    for spell in SPELLS:
+        c[spell] = {
+            "name": "flash" if spell == "D" else f"{name}{spell.lower()}",
+            "level": 1,
+            "cd": cds[spell]}
+        if spell in ["D", "F"]:
+            c[spell]["summoner_spell_type"] = 4
+    c.update({
+        "crit": 0.0,
+        "crit_multi": 1.75,
+        "level": 1 + int(t / 60),
+        "mana": 300.0,
+        "max_mana": 300.0,
+        "ability_haste": 0.0,
+        "ap": 0.0,
+        "lethality": 0.0,
+        "experience": t,
+        "mana_regen": 1.0,
+        "health_regen": 1.0,
+        "attack_range": 525.0,
+        "current_gold": 500 + t,
+        "total_gold": 500 + 2 * t})
+    if rng.random() < 0.01:
+        c["recallState"] = 6
+    return c
+
+def missile(rng, net_id, name, src, dst_pos, dest_id):
+    m = unit(rng, net_id, name, src["team"],
+             src["position"]["x"], src["position"]["z"])
+    m.update({
+        "start_pos": dict(src["position"]),
+        "end_pos": dict(dst_pos),
+        "src_id": src["net_id"],
+        "dest_id": dest_id})
+    return m
+
+def generate_replay(duration=300.0,
+                    interval=0.25,
+                    champs=DEFAULT_CHAMPS,
+                    minions=30,
+                    turrets=22,
+                    jungle=12,
+                    others=2,
+                    missiles_per_sec=2.0,
+                    seed=0):
+    """Returns the observations of a synthetic game.
+
+    Args:
+        duration: Game length in seconds.
+        interval: Seconds between observations.
+        champs: Champion names. The first half is on team 100.
+        minions: Minions alive at any time, split between both teams.
+        turrets: Turrets, split between both teams.
+        jungle: Jungle camps.
+        others: Other objects (wards) of team 100.
+        missiles_per_sec: Average number of missiles spawned per second.
+            Half of them are the first champion's auto attacks.
+        seed: Random seed.
+    """
+    rng = random.Random(seed)
+    frames = int(duration / interval)
+    cds = [{spell: 0.0 for spell in SPELLS} for _ in champs]
+    flash_offsets = [0.0 for _ in champs]
+    missile_id = 100000
+    obs = []
+    for f in range(frames):
+        t = 1.0 + f * interval
+
+        champ_objs = []
+        for i, name in enumerate(champs):
+            for spell in SPELLS:
+                cds[i][spell] = max(0.0, cds[i][spell] - interval)
+                if cds[i][spell] == 0.0 and rng.random() < 0.03:
+                    cds[i][spell] = rng.choice([4.0, 8.0, 12.0])
+                    if spell == "D":
+                        flash_offsets[i] += 400.0
+            champ_objs.append(champ(rng, i, name, t, cds[i], flash_offsets[i]))
+
+        minion_objs = [unit(rng, 2000 + j,
+                            "sru_chaosminionmelee" if j % 2 else "sru_orderminionmelee",
+                            200 if j % 2 else 100,
+                            3000 + j * 37.0 + f, 3000 + j * 11.0, hp=450.0)
+                       for j in range(minions)]
+        turret_objs = [unit(rng, 3000 + j, "turret", 100 if j < turrets // 2 else 200,
+                            500.0 * j, 500.0 * j, hp=5000.0)
+                       for j in range(turrets)]
+        jungle_objs = [unit(rng, 4000 + j, "sru_krug", 300, 7000.0 + 50 * j, 7000.0)
+                       for j in range(jungle)]
+        other_objs = [unit(rng, 5000 + j, "yellowtrinket", 100,
+                           champ_objs[0]["position"]["x"] + 100 * (j + 1),
+                           champ_objs[0]["position"]["z"], hp=3.0)
+                      for j in range(others)]
+
+        missile_objs = []
+        for _ in range(poisson(rng, missiles_per_sec * interval)):
+            missile_id += 1
+            if rng.random() < 0.5:
+                targets = [m for m in minion_objs if m["team"] == 200] + \
+                          [c for c in champ_objs if c["team"] == 200]
+                target = rng.choice(targets)
+                missile_objs.append(missile(
+                    rng, missile_id, rng.choice(AUTO_ATTACK_MISSILES),
+                    champ_objs[0], target["position"], target["net_id"]))
+            else:
+                src = rng.choice(champ_objs)
+                dst = {"x": src["position"]["x"] + rng.uniform(-800, 800),
+                       "y": 50.0,
+                       "z": src["position"]["z"] + rng.uniform(-800, 800)}
+                missile_objs.append(missile(
+                    rng, missile_id, rng.choice(OTHER_MISSILES), src, dst, 0))
+
+        obs.append({
+            "time": t,
+            "champs": champ_objs,
+            "minions": minion_objs,
+            "turrets": turret_objs,
+            "jungle": jungle_objs,
+            "others": other_objs,
+            "missiles": missile_objs})
+    return obs
+
+def poisson(rng, lam):
+    """Samples a Poisson distributed count (Knuth's method)."""
+    threshold = math.exp(-lam)
+    k, p = 0, rng.random()
+    while p > threshold:
+        k += 1
+        p *= rng.random()
+    return k
+
+def write_replay(json_dir, game_id, region="EUW", **kwargs):
+    """Writes a synthetic game as `{region}1-{game_id}.json` in the
+    scraper's format. Returns its path and number of observations."""
+    obs = generate_replay(**kwargs)
+    path = os.path.join(json_dir, f"{region}1-{game_id}.json")
+    with open(path, "w", encoding="latin-1") as f:
+        json.dump(obs, f)
+    return path, len(obs)
@@ -0,0 +1,278 @@
+# MIT License
+# 
+# Copyright (c) 2023 MiscellaneousStuff
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""Batch execution of file processing tasks for the CLI tools.
+
+Runs a function over a list of files in worker processes which pull tasks
+from a shared queue, largest files first, so one slow file doesn't hold up
+a pre-assigned share of the work. Each worker's resident memory is watched
+and a worker which exceeds the limit is killed and replaced without taking
+down the rest of the batch. Workers are also recycled after a number of
+tasks to return leaked memory. Every task's outcome is appended to a JSON
+lines results log."""
+
+import os
+import json
+import time
+import traceback
+import multiprocessing
+import multiprocessing.connection
+
+import psutil
+
+OK      = "ok"
+ERROR   = "error"
+KILLED  = "killed"
+CRASHED = "crashed"
+
+MONITOR_INTERVAL = 0.5
+
+
+def rss(pid):
+    """Returns the resident memory of a process and its children in bytes."""
+    try:
+        proc = psutil.Process(pid)
+        procs = [proc] + proc.children(recursive=True)
+    except psutil.NoSuchProcess:
+        return 0
+    total = 0
+    for p in procs:
+        try:
+            total += p.memory_info().rss
+        except psutil.NoSuchProcess:
+            pass
+    return total
+
+def worker_main(fn, args, tasks, conn, current, max_tasks):
+    """Worker process loop: runs `fn(task, *args)` for the `(index, task)`
+    pairs taken from the shared `tasks` queue until it takes a `None`
+    sentinel or has done `max_tasks` tasks. Outcomes are sent through the
+    worker's own pipe, which doesn't buffer them in a background thread, and
+    the index and start time of the running task are kept in the shared
+    `current` values, so nothing is lost if the worker dies abruptly."""
+    current_idx, current_start = current
+    done = 0
+    while not max_tasks or done < max_tasks:
+        item = tasks.get()
+        if item is None:
+            conn.send(("exit", None, None))
+            return
+        idx, task = item
+        start_time = time.time()
+        current_start.value = start_time
+        current_idx.value = idx
+        try:
+            res = fn(task, *args)
+            outcome = {"status": OK, "result": res}
+        except Exception as exc:
+            outcome = {"status": ERROR,
+                       "error": f"{type(exc).__name__}: {exc}",
+                       "traceback": traceback.format_exc()}
+        outcome["seconds"] = time.time() - start_time
+        conn.send(("done", idx, outcome))
+        current_idx.value = -1
+        done += 1
+
+
+class BatchRunner(object):
+    """Runs `fn(task, *args)` for every task in worker processes.
+
+    Args:
+        fn: Picklable function run on each task (usually a file path).
+        args: Extra arguments passed to `fn` after the task.
+        max_workers: Number of worker processes.
+        max_rss_mb: (Optional) Resident memory limit of a worker in MB.
+            Workers over the limit are killed and their task is failed.
+        max_tasks_per_child: (Optional) Tasks run by a worker before it's
+            replaced by a fresh process.
+        log_path: (Optional) JSON lines file each task outcome is appended to.
+    """
+    def __init__(self,
+                 fn,
+                 args=(),
+                 max_workers=4,
+                 max_rss_mb=None,
+                 max_tasks_per_child=None,
+                 log_path=None):
+        self.fn = fn
+        self.args = tuple(args)
+        self.max_workers = max_workers
+        self.max_rss = max_rss_mb * 1024 * 1024 if max_rss_mb else None
+        self.max_tasks_per_child = max_tasks_per_child
+        self.log_path = log_path
+
+    @staticmethod
+    def largest_first(tasks):
+        """Orders file tasks by decreasing size, so the longest tasks start
+        first and don't end up as stragglers."""
+        def size(task):
+            try:
+                return os.path.getsize(task)
+            except (OSError, TypeError):
+                return 0
+        return sorted(tasks, key=size, reverse=True)
+
+    def start_worker(self, ctx, tasks):
+        """Starts a worker, returning the process, the parent's end of its
+        pipe and its shared current task values."""
+        conn, child_conn = ctx.Pipe(duplex=False)
+        current = (ctx.Value("l", -1, lock=False), ctx.Value("d", 0.0, lock=False))
+        proc = ctx.Process(
+            target=worker_main,
+            args=(self.fn, self.args, tasks, child_conn, current,
+                  self.max_tasks_per_child),
+            daemon=True)
+        proc.start()
+        child_conn.close()
+        return proc, conn, current
+
+    def log(self, f, task, outcome):
+        entry = dict(outcome, task=task, time=time.time())
+        if f:
+            f.write(json.dumps(entry, default=str) + "\n")
+            f.flush()
+        return entry
+
+    def run(self, tasks, on_result=None):
+        """Runs every task and returns the list of outcomes. `on_result` is
+        called with each outcome as it finishes."""
+        tasks = self.largest_first(tasks)
+        worker_count = min(self.max_workers, len(tasks))
+        ctx = multiprocessing.get_context("spawn")
+        task_queue = ctx.Queue()
+        for idx, task in enumerate(tasks):
+            task_queue.put((idx, task))
+        # Each worker alive once the tasks run out takes one sentinel
+        for _ in range(worker_count):
+            task_queue.put(None)
+
+        outcomes = []
+        finished = set()
+        workers = {}  # conn -> [process, current task values, peak rss, took sentinel]
+        f = open(self.log_path, "a") if self.log_path else None
+
+        def finish(idx, outcome):
+            if idx in finished:
+                return
+            finished.add(idx)
+            entry = self.log(f, tasks[idx], outcome)
+            outcomes.append(entry)
+            if on_result:
+                on_result(entry)
+
+        def receive(conn):
+            """Handles the messages of a worker, returning False once its
+            pipe is closed."""
+            worker = workers[conn]
+            try:
+                while conn.poll():
+                    kind, idx, outcome = conn.recv()
+                    if kind == "done":
+                        outcome["peak_rss_mb"] = worker[2] / 1e6
+                        worker[2] = 0
+                        finish(idx, outcome)
+                    else:
+                        worker[3] = True
+            except (EOFError, OSError):
+                return False
+            return True
+
+        def reap(conn, status, error):
+            """Fails the task a dead worker was running and replaces the
+            worker unless it had run out of tasks."""
+            proc, current, peak, took_sentinel = workers[conn]
+            proc.join()
+            receive(conn)
+            idx = current[0].value
+            if idx != -1 and idx not in finished:
+                finish(idx, {
+                    "status": status,
+                    "error": error or f"worker exited with code {proc.exitcode}",
+                    "seconds": time.time() - current[1].value,
+                    "peak_rss_mb": peak / 1e6})
+            conn.close()
+            del workers[conn]
+            if not took_sentinel:
+                spawn()
+
+        def spawn():
+            proc, conn, current = self.start_worker(ctx, task_queue)
+            workers[conn] = [proc, current, 0, False]
+
+        try:
+            for _ in range(worker_count):
+                spawn()
+
+            last_check = 0
+            while workers:
+                for conn in multiprocessing.connection.wait(
+                        list(workers), timeout=MONITOR_INTERVAL):
+                    if not receive(conn):
+                        reap(conn, CRASHED, None)
+
+                if time.time() - last_check < MONITOR_INTERVAL:
+                    continue
+                last_check = time.time()
+                for conn, worker in list(workers.items()):
+                    proc = worker[0]
+                    if not proc.is_alive():
+                        reap(conn, CRASHED, None)
+                        continue
+                    # Enforce the memory limit
+                    mem = rss(proc.pid)
+                    worker[2] = max(worker[2], mem)
+                    running = worker[1][0].value != -1
+                    if self.max_rss and mem > self.max_rss and running:
+                        proc.kill()
+                        reap(conn, KILLED,
+                             f"worker exceeded {self.max_rss / 1e6:.0f} MB "
+                             f"({mem / 1e6:.0f} MB)")
+        finally:
+            for proc, _, _, _ in workers.values():
+                if proc.is_alive():
+                    proc.kill()
+                proc.join()
+            if f:
+                f.close()
+
+        return outcomes
+
+def summarize(outcomes):
+    """Returns the number of outcomes of each status."""
+    counts = {}
+    for outcome in outcomes:
+        counts[outcome["status"]] = counts.get(outcome["status"], 0) + 1
+    return counts
+
+def progress_printer(total):
+    """Returns an `on_result` callback which prints each outcome."""
+    state = {"done": 0}
+    def on_result(outcome):
+        state["done"] += 1
+        name = os.path.basename(str(outcome["task"]))
+        line = f"{state['done']}/{total} {outcome['status']}: {name} " \
+               f"({outcome.get('seconds', 0):.1f}s, {outcome.get('peak_rss_mb', 0):.0f} MB)"
+        if outcome["status"] != OK:
+            line += f" - {outcome.get('error')}"
+        print(line)
+        if outcome["status"] == ERROR:
+            print(outcome.get("traceback"))
+    return on_result
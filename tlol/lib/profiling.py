@@ -0,0 +1,186 @@
+# MIT License
+# 
+# Copyright (c) 2023 MiscellaneousStuff
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""Per-stage wall time and peak memory profiling.
+
+A `StageTimer` splits a run into named stages with `lap(name)`, which
+closes the stage running since the previous lap. A background thread
+samples the resident memory of the process (and its children) so each
+stage records its peak memory as well as its duration. Code deep inside a
+pipeline calls the module level `lap`, which records to the active timer,
+if any, so stages can be marked without passing a timer around."""
+
+import os
+import json
+import time
+import threading
+import contextlib
+
+import numpy as np
+import psutil
+
+_active = None
+
+
+def rss():
+    """Returns the resident memory of this process and its children."""
+    proc = psutil.Process()
+    total = proc.memory_info().rss
+    for child in proc.children(recursive=True):
+        try:
+            total += child.memory_info().rss
+        except psutil.NoSuchProcess:
+            pass
+    return total
+
+
+class StageTimer(object):
+    """Records the wall time and peak resident memory of named stages.
+    Stages which are lapped several times accumulate their time.
+
+    Args:
+        sample_interval: Seconds between memory samples.
+    """
+    def __init__(self, sample_interval=0.05):
+        self.sample_interval = sample_interval
+        self.stages = {}
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.sampler = None
+        self.start_time = None
+        self.end_time = None
+        self.last_lap = None
+        self.peak = 0
+        self.total_peak = 0
+
+    def sample(self):
+        mem = rss()
+        with self.lock:
+            self.peak = max(self.peak, mem)
+            self.total_peak = max(self.total_peak, mem)
+
+    def run_sampler(self):
+        while not self.stopped.wait(self.sample_interval):
+            self.sample()
+
+    def start(self):
+        self.start_time = self.last_lap = time.perf_counter()
+        self.stopped.clear()
+        self.sample()
+        self.sampler = threading.Thread(target=self.run_sampler, daemon=True)
+        self.sampler.start()
+        return self
+
+    def lap(self, name):
+        """Ends the stage which started at the previous lap as `name`."""
+        self.sample()
+        now = time.perf_counter()
+        with self.lock:
+            stage = self.stages.setdefault(
+                name, {"seconds": 0.0, "peak_rss_mb": 0.0, "count": 0})
+            stage["seconds"] += now - self.last_lap
+            stage["peak_rss_mb"] = max(stage["peak_rss_mb"], self.peak / 1e6)
+            stage["count"] += 1
+            self.peak = 0
+        self.last_lap = time.perf_counter()
+
+    def stop(self):
+        self.end_time = time.perf_counter()
+        self.stopped.set()
+        if self.sampler:
+            self.sampler.join()
+            self.sampler = None
+        self.sample()
+
+    def as_dict(self):
+        with self.lock:
+            return {
+                "total_seconds": (self.end_time or time.perf_counter()) - self.start_time,
+                "peak_rss_mb": self.total_peak / 1e6,
+                "stages": {name: dict(stage) for name, stage in self.stages.items()}
+            }
+
+
+def lap(name):
+    """Laps the active `StageTimer`, if there is one."""
+    if _active is not None:
+        _active.lap(name)
+
+@contextlib.contextmanager
+def profile(path=None, **info):
+    """Activates a `StageTimer` for the duration of the block and writes its
+    profile, along with `info`, as JSON to `path` (if given). Exceptions
+    raised by the block are recorded in the profile and re-raised."""
+    global _active
+    timer = StageTimer().start()
+    previous, _active = _active, timer
+    error = None
+    try:
+        yield timer
+    except Exception as exc:
+        error = f"{type(exc).__name__}: {exc}"
+        raise
+    finally:
+        _active = previous
+        timer.stop()
+        if path:
+            result = dict(info, error=error, **timer.as_dict())
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            with open(path, "w") as f:
+                json.dump(result, f, indent=2)
+
+def aggregate_profiles(profiles):
+    """Aggregates the stages of many profiles. Returns a list of per-stage
+    summaries sorted by total time, largest first."""
+    stage_seconds = {}
+    stage_peaks = {}
+    for prof in profiles:
+        for name, stage in prof["stages"].items():
+            stage_seconds.setdefault(name, []).append(stage["seconds"])
+            stage_peaks.setdefault(name, []).append(stage["peak_rss_mb"])
+
+    total = sum(sum(seconds) for seconds in stage_seconds.values()) or 1.0
+    summaries = []
+    for name, seconds in stage_seconds.items():
+        seconds = np.array(seconds)
+        summaries.append({
+            "stage": name,
+            "replays": len(seconds),
+            "total_seconds": float(seconds.sum()),
+            "share": float(seconds.sum() / total),
+            "mean_seconds": float(seconds.mean()),
+            "p95_seconds": float(np.percentile(seconds, 95)),
+            "max_seconds": float(seconds.max()),
+            "max_peak_rss_mb": float(max(stage_peaks[name]))
+        })
+    return sorted(summaries, key=lambda s: s["total_seconds"], reverse=True)
+
+def format_aggregate(summaries):
+    """Returns aggregated stage summaries as a text table."""
+    lines = [f"{'stage':<24} {'replays':>7} {'total s':>9} {'share':>6} "
+             f"{'mean s':>8} {'p95 s':>8} {'max s':>8} {'peak MB':>8}"]
+    for s in summaries:
+        lines.append(
+            f"{s['stage']:<24} {s['replays']:>7} {s['total_seconds']:>9.2f} "
+            f"{s['share'] * 100:>5.1f}% {s['mean_seconds']:>8.3f} "
+            f"{s['p95_seconds']:>8.3f} {s['max_seconds']:>8.3f} "
+            f"{s['max_peak_rss_mb']:>8.0f}")
+    return "\n".join(lines)
@@ -0,0 +1,90 @@
+# MIT License
+# 
+# Copyright (c) 2023 MiscellaneousStuff
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""Compressed copies of scraped replays for transferring datasets between
+machines. Scraped JSON replays compress extremely well, so the scraping
+server keeps a compressed artifact next to each replay and serves it to
+clients which accept the encoding.
+
+zstd is used when the optional `zstandard` package is installed, otherwise
+artifacts are gzip compressed."""
+
+import os
+import gzip
+import shutil
+import tempfile
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Content encodings in order of preference
+ENCODINGS = (["zstd"] if zstandard else []) + ["gzip"]
+
+EXTENSIONS = {
+    "zstd": ".zst",
+    "gzip": ".gz"
+}
+
+
+def negotiate_encoding(accept_encodings):
+    """Returns the preferred encoding accepted by a client, or None.
+
+    Args:
+        accept_encodings: Werkzeug `request.accept_encodings`."""
+    for encoding in ENCODINGS:
+        if accept_encodings[encoding] > 0:
+            return encoding
+    return None
+
+def artifact_path(artifact_dir, filename, encoding):
+    return os.path.join(artifact_dir, filename + EXTENSIONS[encoding])
+
+def open_compressed(path, encoding):
+    if encoding == "zstd":
+        return zstandard.ZstdCompressor(level=10).stream_writer(open(path, "wb"))
+    return gzip.open(path, "wb", compresslevel=6)
+
+def ensure_artifact(src_path, artifact_dir, encoding):
+    """Returns the path of the compressed artifact of `src_path`, creating
+    it first if it doesn't exist or is older than the source file."""
+    path = artifact_path(artifact_dir, os.path.basename(src_path), encoding)
+    if os.path.exists(path) and \
+        os.path.getmtime(path) >= os.path.getmtime(src_path):
+        return path
+
+    os.makedirs(artifact_dir, exist_ok=True)
+    # Each writer gets its own temp file, as downloads and the scrape queue
+    # may compress the same replay concurrently from different threads
+    fd, tmp_path = tempfile.mkstemp(
+        dir=artifact_dir, prefix=os.path.basename(path) + ".", suffix=".tmp")
+    os.close(fd)
+    try:
+        with open(src_path, "rb") as src, \
+            open_compressed(tmp_path, encoding) as dst:
+            shutil.copyfileobj(src, dst, 1024 * 1024)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return path
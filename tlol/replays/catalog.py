@@ -0,0 +1,170 @@
+# MIT License
+# 
+# Copyright (c) 2023 MiscellaneousStuff
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""Catalog of the scraped replays within a dataset directory.
+
+Keeps the ID, size, frame count and completion time of every scraped
+replay in a small SQLite index, so listing scraped replays and checking
+whether a replay has already been scraped doesn't need to touch the
+dataset directory."""
+
+import os
+import json
+import sqlite3
+import threading
+
+CREATE_CATALOG_TABLE = """CREATE TABLE IF NOT EXISTS scraped (
+                          game_id TEXT PRIMARY KEY,
+                          size INTEGER,
+                          frames INTEGER,
+                          completed REAL
+                          )"""
+
+CREATE_CATALOG_INDEX = \
+    "CREATE INDEX IF NOT EXISTS scraped_completed ON scraped (completed)"
+
+# Maximum number of game IDs bound to a single `IN (...)` query
+MAX_SQL_VARIABLES = 500
+
+CATALOG_COLUMNS = ["game_id", "size", "frames", "completed"]
+
+
+def count_frames(json_path):
+    """Returns the number of observations within a scraped replay."""
+    with open(json_path, encoding="latin-1") as f:
+        return len(json.loads(f.read()))
+
+
+class ScrapedCatalog(object):
+    """Index of scraped *.json replays. Safe to share between threads.
+
+    Args:
+        db_path: Path of the SQLite catalog database. Created if it
+            doesn't exist.
+    """
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.lock = threading.Lock()
+        self.con = sqlite3.connect(db_path, check_same_thread=False)
+        self.con.execute(CREATE_CATALOG_TABLE)
+        self.con.execute(CREATE_CATALOG_INDEX)
+        self.con.commit()
+
+    def _row_to_entry(self, row):
+        return dict(zip(CATALOG_COLUMNS, row))
+
+    def sync(self, dataset_dir):
+        """Adds scraped replays which aren't in the catalog yet and removes
+        entries whose replay no longer exists. Frame counts of replays found
+        this way are left unknown. Returns the number of catalogued replays."""
+        with self.lock:
+            known = set(game_id for (game_id,) in
+                        self.con.execute("SELECT game_id FROM scraped"))
+
+        found = []
+        with os.scandir(dataset_dir) as entries:
+            for entry in entries:
+                if not entry.name.endswith(".json") or not entry.is_file():
+                    continue
+                game_id = entry.name.replace(".json", "")
+                if game_id in known:
+                    known.remove(game_id)
+                else:
+                    st = entry.stat()
+                    found.append((game_id, st.st_size, None, st.st_mtime))
+
+        with self.lock:
+            self.con.executemany(
+                "INSERT OR REPLACE INTO scraped VALUES (?, ?, ?, ?)", found)
+            self.con.executemany(
+                "DELETE FROM scraped WHERE game_id = ?",
+                [(game_id,) for game_id in known])
+            self.con.commit()
+            return self.con.execute("SELECT COUNT(*) FROM scraped").fetchone()[0]
+
+    def add(self, game_id, json_path, frames=None, completed=None):
+        """Adds a freshly scraped replay to the catalog."""
+        st = os.stat(json_path)
+        completed = st.st_mtime if completed is None else completed
+        with self.lock:
+            self.con.execute(
+                "INSERT OR REPLACE INTO scraped VALUES (?, ?, ?, ?)",
+                (game_id, st.st_size, frames, completed))
+            self.con.commit()
+
+    def remove(self, game_id):
+        with self.lock:
+            self.con.execute("DELETE FROM scraped WHERE game_id = ?", (game_id,))
+            self.con.commit()
+
+    def exists(self, game_id):
+        return self.lookup(game_id) is not None
+
+    def lookup(self, game_id):
+        with self.lock:
+            row = self.con.execute(
+                f"SELECT {','.join(CATALOG_COLUMNS)} FROM scraped WHERE game_id = ?",
+                (game_id,)).fetchone()
+        return self._row_to_entry(row) if row else None
+
+    def lookup_many(self, game_ids):
+        """Returns a dict of game IDs to catalog entries for the games
+        which have been scraped."""
+        entries = {}
+        with self.lock:
+            for i in range(0, len(game_ids), MAX_SQL_VARIABLES):
+                chunk = game_ids[i:i+MAX_SQL_VARIABLES]
+                rows = self.con.execute(
+                    f"SELECT {','.join(CATALOG_COLUMNS)} FROM scraped "
+                    f"WHERE game_id IN ({','.join(['?'] * len(chunk))})",
+                    chunk).fetchall()
+                for row in rows:
+                    entry = self._row_to_entry(row)
+                    entries[entry["game_id"]] = entry
+        return entries
+
+    def _filters(self, min_frames, since):
+        clauses, params = [], []
+        if min_frames is not None:
+            clauses.append("frames >= ?")
+            params.append(min_frames)
+        if since is not None:
+            clauses.append("completed >= ?")
+            params.append(since)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        return where, params
+
+    def count(self, min_frames=None, since=None):
+        where, params = self._filters(min_frames, since)
+        with self.lock:
+            return self.con.execute(
+                f"SELECT COUNT(*) FROM scraped {where}", params).fetchone()[0]
+
+    def entries(self, offset=0, limit=None, min_frames=None, since=None):
+        """Returns a page of catalogued replays ordered by completion time,
+        optionally filtered by minimum frame count and completion time."""
+        where, params = self._filters(min_frames, since)
+        with self.lock:
+            rows = self.con.execute(
+                f"SELECT {','.join(CATALOG_COLUMNS)} FROM scraped {where} "
+                "ORDER BY completed, game_id LIMIT ? OFFSET ?",
+                params + [-1 if limit is None else limit, offset]).fetchall()
+        return [self._row_to_entry(row) for row in rows]
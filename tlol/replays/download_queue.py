@@ -0,0 +1,239 @@
+# MIT License
+# 
+# Copyright (c) 2023 MiscellaneousStuff
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""Concurrent, resumable replay download queue.
+
+Requests replay downloads from the League client with bounded concurrency
+and confirms each download by watching the replay directory for its *.rofl
+file. Every state change of a game is appended to a JSON lines journal,
+which is compacted to one line per game when it's loaded, so an
+interrupted run resumes where it stopped and failed downloads are retried
+a limited number of times."""
+
+import os
+import json
+import time
+import threading
+import concurrent.futures
+
+QUEUED      = "queued"
+DOWNLOADING = "downloading"
+DONE        = "done"
+FAILED      = "failed"
+
+
+def is_game_id(game_id):
+    """Match ID lists start with a short header (see `MatchIdWriter`), so
+    only numeric lines are game IDs."""
+    return str(game_id).strip().isdigit()
+
+
+class DownloadQueue(object):
+    """Downloads replays through a `ReplayDownloader`.
+
+    Args:
+        downloader: `ReplayDownloader` of the logged in League client.
+        replay_dir: League of Legends *.rofl replay directory.
+        state_path: JSON lines journal which keeps the state of every game.
+        region: Platform ID prefix of the replay files, e.g. `EUW1` or `KR`.
+        max_concurrency: Maximum number of downloads in progress.
+        timeout: Seconds to wait for a requested replay to appear.
+        max_retries: Number of times a failed download is retried before
+            it is marked as failed.
+        poll_interval: Seconds between checks of the replay directory.
+        report_every: Print throughput after this many finished downloads.
+    """
+    def __init__(self,
+                 downloader,
+                 replay_dir,
+                 state_path,
+                 region="EUW1",
+                 max_concurrency=4,
+                 timeout=120.0,
+                 max_retries=2,
+                 poll_interval=1.0,
+                 report_every=10):
+        self.downloader = downloader
+        self.replay_dir = replay_dir
+        self.state_path = state_path
+        self.region = region
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.poll_interval = poll_interval
+        self.report_every = report_every
+        self.lock = threading.Lock()
+        self.journal = None
+        self.games = self.load_state()
+
+    def load_state(self):
+        """Replays the journal into a dict of game ID to state, then compacts
+        it. A line cut short by a crash is ignored. State files written as a
+        single JSON dict of every game are read too."""
+        games = {}
+        if os.path.exists(self.state_path):
+            with open(self.state_path) as f:
+                for ln in f:
+                    try:
+                        entry = json.loads(ln)
+                    except ValueError:
+                        continue
+                    if "game_id" in entry:
+                        games[entry.pop("game_id")] = entry
+                    else:
+                        games.update(entry)
+        self.compact_state(games)
+        return games
+
+    def compact_state(self, games):
+        """Atomically rewrites the journal with one line per game and opens
+        it for appending. Must hold `lock`, or be called before the queue
+        is shared."""
+        if self.journal:
+            self.journal.close()
+        tmp_path = self.state_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            for game_id, game in games.items():
+                f.write(json.dumps(dict(game, game_id=game_id)) + "\n")
+        os.replace(tmp_path, self.state_path)
+        self.journal = open(self.state_path, "a")
+
+    def append_state(self, game_id):
+        """Appends the state of a game to the journal. Must hold `lock`."""
+        game = self.games[game_id]
+        self.journal.write(json.dumps(dict(game, game_id=game_id)) + "\n")
+        self.journal.flush()
+
+    def close(self):
+        with self.lock:
+            if self.journal:
+                self.journal.close()
+                self.journal = None
+
+    def replay_path(self, game_id):
+        return os.path.join(
+            self.replay_dir, f"{self.region}-{game_id}.rofl")
+
+    def set_state(self, game_id, state, **fields):
+        with self.lock:
+            game = self.games.setdefault(
+                game_id, {"state": QUEUED, "attempts": 0, "error": None})
+            game["state"] = state
+            game["updated"] = time.time()
+            game.update(fields)
+            self.append_state(game_id)
+
+    def pending(self, game_ids, retry_failed=False):
+        """Adds `game_ids` to the state and returns those which still need
+        to be downloaded. Downloads which were in progress when a previous
+        run stopped are resumed. Games which permanently failed in a
+        previous run are only retried if `retry_failed` is set."""
+        pending = []
+        with self.lock:
+            for game_id in dict.fromkeys(str(g).strip() for g in game_ids):
+                if not is_game_id(game_id):
+                    continue
+                game = self.games.setdefault(
+                    game_id, {"state": QUEUED, "attempts": 0, "error": None})
+                if game["state"] == DONE:
+                    continue
+                if os.path.exists(self.replay_path(game_id)):
+                    game["state"] = DONE
+                    continue
+                if game["state"] == FAILED:
+                    if not retry_failed:
+                        continue
+                    game["attempts"] = 0
+                game["state"] = QUEUED
+                pending.append(game_id)
+            self.compact_state(self.games)
+        return pending
+
+    def wait_for_replay(self, game_id):
+        """Waits until the replay file appears and stops growing. Returns
+        its size, or None on timeout."""
+        path = self.replay_path(game_id)
+        deadline = time.time() + self.timeout
+        last_size = None
+        while time.time() < deadline:
+            if os.path.exists(path):
+                size = os.path.getsize(path)
+                if size > 0 and size == last_size:
+                    return size
+                last_size = size
+            time.sleep(self.poll_interval)
+        return None
+
+    def download(self, game_id):
+        """Downloads a single replay, retrying up to `max_retries` times.
+        Returns whether the replay was downloaded."""
+        while True:
+            with self.lock:
+                attempts = self.games[game_id]["attempts"] + 1
+            self.set_state(game_id, DOWNLOADING, attempts=attempts)
+            try:
+                req = self.downloader.download(game_id, delay=0)
+                if req.status_code >= 400:
+                    raise Exception(f"HTTP {req.status_code}: {req.content}")
+                size = self.wait_for_replay(game_id)
+                if size is None:
+                    raise Exception(f"replay didn't appear within {self.timeout}s")
+                self.set_state(game_id, DONE, error=None, size=size)
+                return True
+            except Exception as exc:
+                error = str(exc)
+            if attempts > self.max_retries:
+                self.set_state(game_id, FAILED, error=error)
+                print("ERR:", game_id, error)
+                return False
+            self.set_state(game_id, QUEUED, error=error)
+
+    def run(self, game_ids, retry_failed=False):
+        """Downloads every replay of `game_ids` which hasn't been downloaded
+        yet. Returns the number of downloaded and failed replays."""
+        pending = self.pending(game_ids, retry_failed)
+        print(f"Replays to download: {len(pending)}")
+
+        downloaded = 0
+        failed = 0
+        total_bytes = 0
+        start_time = time.time()
+        with concurrent.futures.ThreadPoolExecutor(
+                max_workers=self.max_concurrency) as executor:
+            future_to_game_id = {executor.submit(self.download, game_id): game_id
+                                 for game_id in pending}
+            for future in concurrent.futures.as_completed(future_to_game_id):
+                game_id = future_to_game_id[future]
+                if future.result():
+                    downloaded += 1
+                    total_bytes += self.games[game_id].get("size", 0)
+                else:
+                    failed += 1
+
+                finished = downloaded + failed
+                if finished % self.report_every == 0 or finished == len(pending):
+                    elapsed = max(time.time() - start_time, 1e-6)
+                    print(f"{finished}/{len(pending)} replays, "
+                          f"{downloaded} downloaded, {failed} failed, "
+                          f"{downloaded / elapsed * 60:.1f} replays/min, "
+                          f"{total_bytes / elapsed / 1e6:.2f} MB/s")
+
+        return downloaded, failed
@@ -22,65 +22,137 @@
 """Uses a logged in League of Legends client to download replay files using
 the LCU API."""
 
-import base64
-import requests
+import os
 import json
 import time
 import psutil
-import platform
+import requests
+
+LCU_PROCESS_NAMES = ["LeagueClientUx.exe", "LeagueClientUx"]
+
+DEFAULT_LOCKFILE_PATHS = [
+    os.path.join("C:\\", "Riot Games", "League of Legends", "lockfile"),
+    os.path.join("/Applications", "League of Legends.app", "Contents", "LoL", "lockfile")
+]
+
+
+def read_lockfile(path):
+    """Returns the `remoting_auth_token` and `app_port` from a League client
+    lockfile (`LeagueClient:pid:port:password:protocol`)."""
+    with open(path) as f:
+        _, _, port, token, _ = f.read().strip().split(":")
+    return token, port
+
+def scan_lcu_process():
+    """Returns the `remoting_auth_token`, `app_port` and install directory
+    from the command line of a running League client, with a single
+    process scan."""
+    for proc in psutil.process_iter(["name", "cmdline"]):
+        if proc.info["name"] not in LCU_PROCESS_NAMES:
+            continue
+        params = {}
+        for arg in proc.info["cmdline"] or []:
+            if arg.startswith("--") and "=" in arg:
+                key, value = arg[2:].split("=", 1)
+                params[key] = value
+        return (params.get("remoting-auth-token"),
+                params.get("app-port"),
+                params.get("install-directory"))
+    return None, None, None
+
 
 class ReplayDownloader(object):
-    def __init__(self, remoting_auth_token=None, app_port=None):
+    """Downloads replays through the LCU API of a logged in League client.
+
+    Credentials are discovered once, from the client's lockfile or a scan
+    of its command line, and requests share a single keep-alive session.
+    Credentials are only rediscovered when the client stops responding or
+    rejects them, e.g. after the client restarts.
+
+    Args:
+        remoting_auth_token: (Optional) LCU password. Discovered if not set.
+        app_port: (Optional) LCU port. Discovered if not set.
+        lockfile_path: (Optional) League client lockfile to read the
+            credentials from.
+        base_url: (Optional) LCU base URL, e.g. of a local stub server.
+            Defaults to `https://127.0.0.1:{app_port}`.
+        verify: Verification passed to `requests`. The LCU serves a
+            self-signed certificate, so it isn't verified by default.
+    """
+    def __init__(self,
+                 remoting_auth_token=None,
+                 app_port=None,
+                 lockfile_path=None,
+                 base_url=None,
+                 verify=False):
+        self.lockfile_path = lockfile_path
+        self.fixed_base_url = base_url
+        self.session = requests.Session()
+        self.session.verify = verify
+        self.session.headers["Content-Type"] = "application/json"
         self.remoting_auth_token = remoting_auth_token
         self.app_port = app_port
         if not remoting_auth_token or not app_port:
             self.remoting_auth_token, self.app_port = \
                 self.get_lcu_params()
-        
+        self.set_credentials(self.remoting_auth_token, self.app_port)
+
     def get_lcu_params(self):
         """Attempts to automatically acquire the `remoting_auth_token`
         and `app_port` from a running League of Legends client."""
-        for proc in psutil.process_iter():
-            try:
-                n = proc.name()
-                print(n)
-                if n == "LeagueClientUx.exe":
-                    cmdline = proc.cmdline()
-                    port = None
-                    tok = None
-                    for arg in cmdline:
-                        if "--app-port" in arg:
-                            port = arg.split("=")[1]
-                        elif "--remoting-auth-token" in arg:
-                            tok = arg.split("=")[1]
-                    return tok, port
-            except:
-                pass
-        return None, None
+        lockfile_paths = [self.lockfile_path] if self.lockfile_path \
+            else DEFAULT_LOCKFILE_PATHS
+        for path in lockfile_paths:
+            if os.path.exists(path):
+                return read_lockfile(path)
+
+        tok, port, install_dir = scan_lcu_process()
+        if install_dir and not self.lockfile_path:
+            lockfile_path = os.path.join(install_dir, "lockfile")
+            if os.path.exists(lockfile_path):
+                self.lockfile_path = lockfile_path
+        return tok, port
+
+    def set_credentials(self, remoting_auth_token, app_port):
+        """Caches the auth header and base URL of the session."""
+        self.remoting_auth_token = remoting_auth_token
+        self.app_port = app_port
+        self.session.auth = ("riot", remoting_auth_token or "")
+        self.base_url = self.fixed_base_url or \
+            f"https://127.0.0.1:{app_port}"
+
+    def refresh_credentials(self):
+        """Rediscovers the credentials, returning whether they changed."""
+        tok, port = self.get_lcu_params()
+        if not tok or not port or \
+                (tok, port) == (self.remoting_auth_token, self.app_port):
+            return False
+        self.set_credentials(tok, port)
+        return True
+
+    def post(self, path, body):
+        """Sends a POST request to the LCU, refreshing the credentials and
+        retrying once if the client restarted."""
+        url = self.base_url + path
+        try:
+            req = self.session.post(url=url, data=json.dumps(body))
+        except requests.ConnectionError:
+            if not self.refresh_credentials():
+                raise
+            return self.session.post(url=self.base_url + path, data=json.dumps(body))
+        if req.status_code == 401 and self.refresh_credentials():
+            return self.session.post(url=self.base_url + path, data=json.dumps(body))
+        return req
 
     def download(self, game_id, delay=0.25):
         """Sends the HTTP POST request to the locally logged in
         League of Legends client to download the desired match."""
-        auth_token = base64.b64encode(
-            f"riot:{self.remoting_auth_token}".encode("utf-8"))
-        auth_token = str(auth_token, encoding="utf-8")
-        app_port = self.app_port
-
-        # NOTE: TEMP HARDFIX
-        auth_token = "cmlvdDpFalVRTzIxZVNRdTZ2Yy1KWkVNMzFn"
-        app_port = 65185
-
-        url = \
-            f"https://127.0.0.1:{app_port}/lol-replays/v1/rofls/{game_id}/download/graceful"
-        req = requests.post(
-            url=url,
-            headers={
-                "Authorization": f"Basic {auth_token}",
-                "Content-Type": "application/json"
-            },
-            data=json.dumps({
-                "gameId": game_id
-            }),
-            verify=False)
-        time.sleep(delay)
-        return req
\ No newline at end of file
+        req = self.post(
+            f"/lol-replays/v1/rofls/{game_id}/download/graceful",
+            {"gameId": game_id})
+        if delay:
+            time.sleep(delay)
+        return req
+
+    def close(self):
+        self.session.close()
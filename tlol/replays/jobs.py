@@ -0,0 +1,246 @@
+# MIT License
+# 
+# Copyright (c) 2023 MiscellaneousStuff
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""Durable, SQLite backed job queue for replay scraping requests.
+
+Jobs survive server restarts and move through the `queued`, `running`,
+`done` and `failed` states. Failed jobs are retried a limited number of
+times before being marked as permanently failed. Each game has at most one
+job, and jobs are indexed by game ID and by state so lookups, removals and
+paginated listings don't scan the whole queue."""
+
+import time
+import sqlite3
+import threading
+
+QUEUED  = "queued"
+RUNNING = "running"
+DONE    = "done"
+FAILED  = "failed"
+
+POLL_INTERVAL = 5.0
+
+# Maximum number of game IDs bound to a single `IN (...)` query
+MAX_SQL_VARIABLES = 500
+
+CREATE_JOB_TABLE = """CREATE TABLE IF NOT EXISTS jobs (
+                      id INTEGER PRIMARY KEY AUTOINCREMENT,
+                      game_id TEXT,
+                      replay_speed INTEGER,
+                      end_time INTEGER,
+                      state TEXT,
+                      attempts INTEGER,
+                      error TEXT,
+                      created REAL,
+                      updated REAL
+                      )"""
+
+# Keeps the oldest job of each game before the unique index is created
+DEDUPE_JOBS = """DELETE FROM jobs WHERE id NOT IN (
+                 SELECT MIN(id) FROM jobs GROUP BY game_id)"""
+
+CREATE_JOB_INDEXES = [
+    "CREATE UNIQUE INDEX IF NOT EXISTS jobs_game_id ON jobs (game_id)",
+    "CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, id)"
+]
+
+JOB_COLUMNS = ["id", "game_id", "replay_speed", "end_time", "state",
+               "attempts", "error", "created", "updated"]
+
+
+class ScrapeJobQueue(object):
+    """Persistent queue of replay scraping jobs shared between the HTTP
+    handlers and the scraping worker threads.
+
+    Jobs which were running when the previous server process stopped are
+    put back into the queue when the queue is opened.
+
+    Args:
+        db_path: Path of the SQLite job database. Created if it doesn't exist.
+        max_retries: Number of times a failed job is re-queued before it
+            is marked as permanently failed.
+    """
+    def __init__(self, db_path, max_retries=2):
+        self.db_path = db_path
+        self.max_retries = max_retries
+        self.cond = threading.Condition()
+        self.con = sqlite3.connect(db_path, check_same_thread=False)
+        self.con.execute(CREATE_JOB_TABLE)
+        self.con.execute(DEDUPE_JOBS)
+        for create_index in CREATE_JOB_INDEXES:
+            self.con.execute(create_index)
+        self.con.commit()
+        self.recover()
+
+    def _row_to_job(self, row):
+        return dict(zip(JOB_COLUMNS, row))
+
+    def recover(self):
+        """Re-queues jobs left running by a previous server process."""
+        with self.cond:
+            self.con.execute(
+                "UPDATE jobs SET state = ?, updated = ? WHERE state = ?",
+                (QUEUED, time.time(), RUNNING))
+            self.con.commit()
+            self.cond.notify_all()
+
+    def put(self, game_id, replay_speed, end_time):
+        """Adds a scraping job to the back of the queue. Returns False
+        without adding anything if the game is already queued or running.
+        Finished and failed games are queued again."""
+        return len(self.put_many([game_id], replay_speed, end_time)) == 1
+
+    def put_many(self, game_ids, replay_speed, end_time):
+        """Adds scraping jobs for several games in a single transaction,
+        skipping games which are already queued or running. Returns the
+        list of game IDs which were added."""
+        now = time.time()
+        with self.cond:
+            states = self._states(game_ids)
+            added = []
+            for game_id in game_ids:
+                if states.get(game_id) not in [QUEUED, RUNNING]:
+                    added.append(game_id)
+                    states[game_id] = QUEUED
+            self.con.executemany(
+                "DELETE FROM jobs WHERE game_id = ?",
+                [(game_id,) for game_id in added])
+            self.con.executemany(
+                "INSERT INTO jobs (game_id, replay_speed, end_time, state, "
+                "attempts, error, created, updated) "
+                "VALUES (?, ?, ?, ?, 0, NULL, ?, ?)",
+                [(game_id, replay_speed, end_time, QUEUED, now, now)
+                 for game_id in added])
+            self.con.commit()
+            self.cond.notify_all()
+        return added
+
+    def _states(self, game_ids):
+        states = {}
+        for i in range(0, len(game_ids), MAX_SQL_VARIABLES):
+            chunk = game_ids[i:i+MAX_SQL_VARIABLES]
+            states.update(self.con.execute(
+                "SELECT game_id, state FROM jobs "
+                f"WHERE game_id IN ({','.join(['?'] * len(chunk))})",
+                chunk).fetchall())
+        return states
+
+    def get(self, timeout=None):
+        """Blocks until a job is queued, marks it as running and returns it.
+        Returns None if `timeout` seconds pass without a job."""
+        deadline = None if timeout is None else time.time() + timeout
+        with self.cond:
+            while True:
+                row = self.con.execute(
+                    f"SELECT {','.join(JOB_COLUMNS)} FROM jobs "
+                    "WHERE state = ? ORDER BY id LIMIT 1",
+                    (QUEUED,)).fetchone()
+                if row:
+                    job = self._row_to_job(row)
+                    job["state"] = RUNNING
+                    job["attempts"] += 1
+                    job["updated"] = time.time()
+                    # Only claim the job if no other process claimed it first
+                    cur = self.con.execute(
+                        "UPDATE jobs SET state = ?, attempts = ?, updated = ? "
+                        "WHERE id = ? AND state = ?",
+                        (RUNNING, job["attempts"], job["updated"], job["id"], QUEUED))
+                    self.con.commit()
+                    if cur.rowcount == 1:
+                        return job
+                    continue
+                # Periodically re-check for jobs added by other processes
+                wait = POLL_INTERVAL
+                if deadline is not None:
+                    wait = min(wait, deadline - time.time())
+                    if wait <= 0:
+                        return None
+                self.cond.wait(wait)
+
+    def complete(self, job):
+        with self.cond:
+            self.con.execute(
+                "UPDATE jobs SET state = ?, error = NULL, updated = ? WHERE id = ?",
+                (DONE, time.time(), job["id"]))
+            self.con.commit()
+
+    def fail(self, job, error):
+        """Re-queues a failed job, or marks it as failed once it has used
+        up all of its retries."""
+        state = QUEUED if job["attempts"] <= self.max_retries else FAILED
+        with self.cond:
+            self.con.execute(
+                "UPDATE jobs SET state = ?, error = ?, updated = ? WHERE id = ?",
+                (state, str(error), time.time(), job["id"]))
+            self.con.commit()
+            if state == QUEUED:
+                self.cond.notify()
+        return state
+
+    def remove(self, game_id):
+        """Removes a game from the queue. Running jobs are left alone.
+        Returns the number of removed jobs."""
+        with self.cond:
+            cur = self.con.execute(
+                "DELETE FROM jobs WHERE game_id = ? AND state = ?",
+                (game_id, QUEUED))
+            self.con.commit()
+            return cur.rowcount
+
+    def lookup(self, game_id):
+        """Returns the job of a game, or None if it has never been queued."""
+        with self.cond:
+            row = self.con.execute(
+                f"SELECT {','.join(JOB_COLUMNS)} FROM jobs WHERE game_id = ?",
+                (game_id,)).fetchone()
+        return self._row_to_job(row) if row else None
+
+    def lookup_many(self, game_ids):
+        """Returns a dict of game IDs to jobs for the games which have
+        ever been queued."""
+        jobs = {}
+        with self.cond:
+            for i in range(0, len(game_ids), MAX_SQL_VARIABLES):
+                chunk = game_ids[i:i+MAX_SQL_VARIABLES]
+                rows = self.con.execute(
+                    f"SELECT {','.join(JOB_COLUMNS)} FROM jobs "
+                    f"WHERE game_id IN ({','.join(['?'] * len(chunk))})",
+                    chunk).fetchall()
+                for row in rows:
+                    job = self._row_to_job(row)
+                    jobs[job["game_id"]] = job
+        return jobs
+
+    def count(self, state):
+        with self.cond:
+            return self.con.execute(
+                "SELECT COUNT(*) FROM jobs WHERE state = ?",
+                (state,)).fetchone()[0]
+
+    def jobs(self, state, offset=0, limit=None):
+        """Returns the jobs in `state` in queue order, optionally only
+        returning a page of `limit` jobs starting at `offset`."""
+        with self.cond:
+            rows = self.con.execute(
+                f"SELECT {','.join(JOB_COLUMNS)} FROM jobs "
+                "WHERE state = ? ORDER BY id LIMIT ? OFFSET ?",
+                (state, -1 if limit is None else limit, offset)).fetchall()
+        return [self._row_to_job(row) for row in rows]
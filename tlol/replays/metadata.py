@@ -22,18 +22,23 @@
 """Creates an SQLite database filled with the metadata of all of the replay
 files within a directory."""
 
-import json
 import os
+import time
+import queue
 import sqlite3
+import threading
+import concurrent.futures
 
-CREATE_GAME_TABLE = """CREATE TABLE games
+from tlol.replays.rofl import read_header
+
+CREATE_GAME_TABLE = """CREATE TABLE IF NOT EXISTS games
                       (game_id INTEGER PRIMARY KEY,
                        game_length REAL,
                        game_mins REAL,
                        surrender INTEGER,
                        early_surrender INTEGER
                        )"""
-CREATE_PLAYER_TABLE = """CREATE TABLE playerGame
+CREATE_PLAYER_TABLE = """CREATE TABLE IF NOT EXISTS playerGame
                       (player_id TEXT,
                        game_id TEXT,
                        champ TEXT,
@@ -59,103 +64,160 @@ CREATE_PLAYER_TABLE = """CREATE TABLE playerGame
 POSITIONS = ["TOP", "JUNGLE", "MID", "ADC", "SUPPORT"]
 
 def get_metadata(filename):
-    with open(filename, "rb") as f:
-        # Magic
-        magic = str(f.read(4), encoding="utf-8")
-
-        # Length fields
-        lengths_buffer = []
-        f.seek(262)
-        length_field_buffer = f.read(26)
-        metadata_offset = length_field_buffer[6:10]
-        metadata_length = length_field_buffer[10:14]
-
-        metadata_offset = int.from_bytes(metadata_offset, byteorder='little')
-        metadata_length = int.from_bytes(metadata_length, byteorder='little')
-
-        # Metadata
-        f.seek(metadata_offset)
-        replay_metadata = f.read(metadata_length)
-        replay_metadata = json.loads(str(replay_metadata, encoding="utf-8"))
-        stats_json = json.loads(replay_metadata["statsJson"])
+    return read_header(filename)
 
-        #champs = [s["SKIN"] for s in stats_json]
+INSERT_GAME   = "INSERT OR IGNORE INTO games VALUES (?, ?, ?, ?, ?)"
+INSERT_PLAYER = f"INSERT INTO playerGame VALUES ({','.join(['?'] * 20)})"
 
-        return replay_metadata, stats_json
-
-def insert_game(cur, org, metadata, game_id):
+def game_rows(org, metadata, game_id):
+    """Returns the `games` row and the `playerGame` rows of a replay."""
     surrender = any([m["GAME_ENDED_IN_SURRENDER"] for m in metadata])
     surrender = 1 if surrender else 0
     early_surrender = any([m["GAME_ENDED_IN_EARLY_SURRENDER"] for m in metadata])
     early_surrender = 1 if early_surrender else 0
 
-    cur.execute(f"""INSERT INTO games VALUES(
-        {game_id},
-        {org["gameLength"]},
-        {org["gameLength"] / (1000 * 60)},
-        {surrender},
-        {early_surrender})""")
+    game_row = (
+        int(game_id),
+        org["gameLength"],
+        org["gameLength"] / (1000 * 60),
+        surrender,
+        early_surrender)
 
+    player_rows = []
     for i, player in enumerate(metadata):
-        player_id = player["ID"]
-        champ = player["SKIN"]
-        win = player["WIN"]
-        team = player["TEAM"]
-        team_position = POSITIONS[i % 5]
-        name = player["NAME"]
-        assists = player["ASSISTS"]
-        kills = player["CHAMPIONS_KILLED"]
-        exp = player["EXP"]
-        early_surrender = player["GAME_ENDED_IN_EARLY_SURRENDER"]
-        surrender = player["GAME_ENDED_IN_SURRENDER"]
-        gold_earned = player["GOLD_EARNED"]
-        gold_spent = player["GOLD_SPENT"]
-        level = player["LEVEL"]
-        longest_time_spent_living = player["LONGEST_TIME_SPENT_LIVING"]
-        cs = player["MINIONS_KILLED"] + player["NEUTRAL_MINIONS_KILLED"]
-        deaths = player["NUM_DEATHS"]
-        dmg_dealt = player["TOTAL_DAMAGE_DEALT_TO_CHAMPIONS"]
-        vision_score = player["VISION_SCORE"]
-        
-        cur.execute(f"""INSERT INTO playerGame VALUES(
-            {player_id},
-            '{game_id}',
-            '{champ}',
-            {1 if win == "Win" else 0},
-            '{team}',
-            '{team_position}',
-            '{name}',
-            {assists},
-            {kills},
-            {exp},
-            {1 if early_surrender == "1" else 0},
-            {1 if surrender == "1" else 0},
-            {gold_earned},
-            {gold_spent},
-            {level},
-            {longest_time_spent_living},
-            {cs},
-            {deaths},
-            {dmg_dealt},
-            {vision_score})""")
-
-def gen_metadata(root_dir, outpath):
-    i = 0
+        player_rows.append((
+            player["ID"],
+            str(game_id),
+            player["SKIN"],
+            1 if player["WIN"] == "Win" else 0,
+            player["TEAM"],
+            POSITIONS[i % 5],
+            player["NAME"],
+            player["ASSISTS"],
+            player["CHAMPIONS_KILLED"],
+            player["EXP"],
+            1 if player["GAME_ENDED_IN_EARLY_SURRENDER"] == "1" else 0,
+            1 if player["GAME_ENDED_IN_SURRENDER"] == "1" else 0,
+            player["GOLD_EARNED"],
+            player["GOLD_SPENT"],
+            player["LEVEL"],
+            player["LONGEST_TIME_SPENT_LIVING"],
+            player["MINIONS_KILLED"] + player["NEUTRAL_MINIONS_KILLED"],
+            player["NUM_DEATHS"],
+            player["TOTAL_DAMAGE_DEALT_TO_CHAMPIONS"],
+            player["VISION_SCORE"]))
+
+    return game_row, player_rows
 
+def insert_game(cur, org, metadata, game_id):
+    game_row, player_rows = game_rows(org, metadata, game_id)
+    cur.execute(INSERT_GAME, game_row)
+    cur.executemany(INSERT_PLAYER, player_rows)
+
+def get_game_id(fname):
+    return os.path.basename(fname).split(".")[0].split("-")[1]
+
+def parse_replay(fname):
+    """Worker process entry point. Returns the game ID, the rows to insert
+    for the replay and the error message if the replay couldn't be parsed."""
+    game_id = get_game_id(fname)
+    try:
+        org, metadata = get_metadata(fname)
+        return game_id, game_rows(org, metadata, game_id), None
+    except Exception as e:
+        return game_id, None, str(e)
+
+def write_rows(outpath, rows_queue, batch_size, failure):
+    """Writer thread. Inserts parsed replays in batches, committing each
+    batch as a single transaction so an interrupted run can be resumed.
+    If inserting fails, the exception is appended to the `failure` list
+    and the rest of the queue is discarded."""
     con = sqlite3.connect(outpath)
     cur = con.cursor()
 
+    def flush(batch):
+        if not batch:
+            return
+        cur.execute("BEGIN;")
+        cur.executemany(INSERT_GAME, [game_row for game_row, _ in batch])
+        cur.executemany(INSERT_PLAYER, [player_row
+                                        for _, player_rows in batch
+                                        for player_row in player_rows])
+        cur.execute("COMMIT;")
+
+    batch = []
+    rows = True
+    try:
+        while True:
+            rows = rows_queue.get()
+            if rows is None:
+                break
+            batch.append(rows)
+            if len(batch) >= batch_size:
+                flush(batch)
+                batch = []
+        flush(batch)
+    except Exception as exc:
+        failure.append(exc)
+        # Keep draining so the producer never blocks on a full queue
+        while rows is not None:
+            rows = rows_queue.get()
+    finally:
+        con.close()
+
+def gen_metadata(root_dir,
+                 outpath,
+                 max_workers=None,
+                 batch_size=1000,
+                 chunksize=64,
+                 report_every=1000):
+    """Parses the headers of every replay within `root_dir` using a process
+    pool and inserts them into the `outpath` database from a single writer
+    thread. Replays which are already in the database are skipped, so an
+    interrupted run can simply be restarted. Raises the writer's exception
+    if inserting into the database fails."""
+    con = sqlite3.connect(outpath)
+    cur = con.cursor()
     cur.execute(CREATE_GAME_TABLE)
     cur.execute(CREATE_PLAYER_TABLE)
-
-    files = [os.path.join(root_dir, f) for f in os.listdir(root_dir)]
-    cur.execute("BEGIN;")
-
-    for fname in files:
-        game_id = os.path.basename(fname).split(".")[0].split("-")[1]
-        org, metadata = get_metadata(fname)
-        insert_game(cur, org, metadata, game_id)
-        print(f"{i}/{len(files)}")
-        i+= 1
-    cur.execute("COMMIT;")
-    con.close()
\ No newline at end of file
+    con.commit()
+    done = set(str(game_id) for (game_id,) in
+               cur.execute("SELECT game_id FROM games").fetchall())
+    con.close()
+
+    files = [os.path.join(root_dir, f) for f in os.listdir(root_dir)
+             if f.endswith(".rofl")]
+    files = [f for f in files if get_game_id(f) not in done]
+    print(f"Skipping {len(done)} existing replays, {len(files)} to insert")
+
+    rows_queue = queue.Queue(maxsize=batch_size * 4)
+    failure = []
+    writer = threading.Thread(
+        target=write_rows,
+        args=(outpath, rows_queue, batch_size, failure))
+    writer.start()
+
+    start = time.time()
+    errors = 0
+    i = 0
+    try:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers) as executor:
+            for game_id, rows, err in executor.map(parse_replay, files, chunksize=chunksize):
+                if failure:
+                    # The writer failed, so parsing the rest would be wasted
+                    executor.shutdown(wait=True, cancel_futures=True)
+                    break
+                i += 1
+                if err:
+                    errors += 1
+                    print(f"ERR PROCESSING REPLAY FILE: {game_id}: {err}")
+                else:
+                    rows_queue.put(rows)
+                if i % report_every == 0 or i == len(files):
+                    rate = i / max(time.time() - start, 1e-6)
+                    print(f"{i}/{len(files)} ({rate:.1f} replays/s, {errors} errors)")
+    finally:
+        rows_queue.put(None)
+        writer.join()
+    if failure:
+        raise failure[0]
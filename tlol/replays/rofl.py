@@ -0,0 +1,185 @@
+# MIT License
+# 
+# Copyright (c) 2023 MiscellaneousStuff
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""Reads the metadata embedded within *.rofl replay file headers.
+
+Only the header bytes of a replay are ever read, so this is cheap compared
+to reading the whole replay. `ReplayIndex` additionally caches the parsed
+metadata of every replay in an on-disk SQLite index keyed by
+(path, size, mtime), so re-scanning a large replay directory only needs to
+parse replays which are new or have changed since the previous scan."""
+
+import os
+import json
+import sqlite3
+import threading
+
+# Offset and size of the length fields within the ROFL header
+LENGTH_FIELDS_OFFSET = 262
+LENGTH_FIELDS_SIZE   = 26
+
+CREATE_INDEX_TABLE = """CREATE TABLE IF NOT EXISTS replays (
+                        path TEXT PRIMARY KEY,
+                        size INTEGER,
+                        mtime INTEGER,
+                        game_length INTEGER,
+                        metadata TEXT,
+                        stats_json TEXT
+                        )"""
+
+
+def read_header(path):
+    """Returns the embedded replay metadata and the per-player stats of
+    a *.rofl file, only reading the header bytes of the replay."""
+    with open(path, "rb") as f:
+        header = f.read(LENGTH_FIELDS_OFFSET + LENGTH_FIELDS_SIZE)
+        length_field_buffer = header[LENGTH_FIELDS_OFFSET:]
+        metadata_offset = int.from_bytes(length_field_buffer[6:10], byteorder='little')
+        metadata_length = int.from_bytes(length_field_buffer[10:14], byteorder='little')
+
+        f.seek(metadata_offset)
+        replay_metadata = f.read(metadata_length)
+
+    replay_metadata = json.loads(str(replay_metadata, encoding="utf-8"))
+    stats_json = json.loads(replay_metadata["statsJson"])
+    return replay_metadata, stats_json
+
+
+class ReplayIndex(object):
+    """Persistent index of *.rofl replay metadata.
+
+    Entries are keyed by the absolute path of the replay and are only
+    considered valid while the size and modification time of the replay
+    are unchanged. Safe to share between threads.
+
+    Args:
+        index_path: Path of the SQLite index database. Created if it
+            doesn't exist.
+    """
+    def __init__(self, index_path):
+        self.index_path = index_path
+        self.lock = threading.Lock()
+        self.con = sqlite3.connect(index_path, check_same_thread=False)
+        self.con.execute(CREATE_INDEX_TABLE)
+        self.con.commit()
+
+    def close(self):
+        with self.lock:
+            self.con.close()
+
+    def _parse(self, path, st):
+        """Parses the replay header and returns the index row for it."""
+        replay_metadata, stats_json = read_header(path)
+        stats_raw = replay_metadata["statsJson"]
+        base_metadata = {k: v for k, v in replay_metadata.items()
+                         if k != "statsJson"}
+        row = (
+            path,
+            st.st_size,
+            st.st_mtime_ns,
+            replay_metadata.get("gameLength"),
+            json.dumps(base_metadata),
+            stats_raw)
+        return row, replay_metadata, stats_json
+
+    def lookup(self, path):
+        """Returns the embedded replay metadata and the per-player stats of
+        a *.rofl file, only parsing the replay if it isn't indexed yet."""
+        path = os.path.abspath(path)
+        st = os.stat(path)
+
+        with self.lock:
+            cached = self.con.execute(
+                "SELECT size, mtime, metadata, stats_json FROM replays WHERE path = ?",
+                (path,)).fetchone()
+        if cached and cached[0] == st.st_size and cached[1] == st.st_mtime_ns:
+            replay_metadata = json.loads(cached[2])
+            replay_metadata["statsJson"] = cached[3]
+            return replay_metadata, json.loads(cached[3])
+
+        row, replay_metadata, stats_json = self._parse(path, st)
+        with self.lock:
+            self.con.execute(
+                "INSERT OR REPLACE INTO replays VALUES (?, ?, ?, ?, ?, ?)", row)
+            self.con.commit()
+        return replay_metadata, stats_json
+
+    def game_length(self, path):
+        """Returns the length of a replay in milliseconds."""
+        replay_metadata, _ = self.lookup(path)
+        return replay_metadata["gameLength"]
+
+    def scan(self, replay_dir, commit_every=1000):
+        """Brings the index up to date with every *.rofl file within
+        `replay_dir`, pruning entries for replays which no longer exist.
+
+        Returns a dict of replay paths to game lengths in milliseconds.
+        Replays whose headers can't be parsed are left out."""
+        replay_dir = os.path.abspath(replay_dir)
+        with self.lock:
+            rows = self.con.execute(
+                "SELECT path, size, mtime, game_length FROM replays "
+                "WHERE path LIKE ?",
+                (os.path.join(replay_dir, "%"),)).fetchall()
+        cached = {path: (size, mtime, game_length)
+                  for path, size, mtime, game_length in rows
+                  if os.path.dirname(path) == replay_dir}
+
+        game_lengths = {}
+        pending = []
+        with os.scandir(replay_dir) as entries:
+            for entry in entries:
+                if not entry.name.endswith(".rofl") or not entry.is_file():
+                    continue
+                path = os.path.join(replay_dir, entry.name)
+                st = entry.stat()
+                hit = cached.pop(path, None)
+                if hit and hit[0] == st.st_size and hit[1] == st.st_mtime_ns:
+                    game_lengths[path] = hit[2]
+                    continue
+                try:
+                    row, replay_metadata, _ = self._parse(path, st)
+                except Exception as e:
+                    print("ERR PROCESSING REPLAY FILE:", path, str(e))
+                    continue
+                game_lengths[path] = replay_metadata.get("gameLength")
+                pending.append(row)
+                if len(pending) >= commit_every:
+                    self._insert_rows(pending)
+                    pending = []
+        self._insert_rows(pending)
+
+        # Whatever is left in `cached` has been deleted from `replay_dir`
+        with self.lock:
+            self.con.executemany(
+                "DELETE FROM replays WHERE path = ?",
+                [(path,) for path in cached])
+            self.con.commit()
+
+        return game_lengths
+
+    def _insert_rows(self, rows):
+        if not rows:
+            return
+        with self.lock:
+            self.con.executemany(
+                "INSERT OR REPLACE INTO replays VALUES (?, ?, ?, ?, ?, ?)", rows)
+            self.con.commit()
@@ -24,9 +24,10 @@ the League game client and storing the observations in a json file."""
 
 import os
 import time
-import json
 import subprocess
 
+from tlol.replays.rofl import read_header, ReplayIndex
+
 
 class ReplayScraper(object):
     """League of Legends replay scraper class.
@@ -40,6 +41,8 @@ class ReplayScraper(object):
         dataset_dir: JSON replay files output directory.
         replay_speed: League of Legends client replay speed multiplier.
         scraper_path: Directory of the scraper program.
+        index_path: (Optional) Replay metadata index used to avoid
+            re-parsing replay headers between runs.
     """
     def __init__(self,
             game_dir,
@@ -47,13 +50,15 @@ class ReplayScraper(object):
             dataset_dir,
             scraper_dir,
             replay_speed=8,
-            region="EUW"):
+            region="EUW",
+            index_path=None):
         self.game_dir = game_dir
         self.replay_dir = replay_dir
         self.dataset_dir = dataset_dir
         self.scraper_dir = scraper_dir
         self.replay_speed = replay_speed
         self.region = region
+        self.index = ReplayIndex(index_path) if index_path else None
 
     def run_client(self, replay_path):
         args = [
@@ -72,7 +77,7 @@ class ReplayScraper(object):
             "-UseNewX3DFramebuffers"
         ]
         print('run lol client:', args)
-        subprocess.Popen(
+        return subprocess.Popen(
             args,
             stdout=subprocess.PIPE,
             stderr=subprocess.PIPE,
@@ -93,11 +98,13 @@ class ReplayScraper(object):
             f'replay_mult={str(self.replay_speed)}',
             f'replay_cmd={str(replay_script_cmd)}']
         print('scraper args:', args)
-        subprocess.call(
+        proc = subprocess.Popen(
             args,
             cwd=self.scraper_dir)
+        proc.wait()
+        return proc
 
-    def scrape(self, replay_path, end_time, delay=2, scraper=True):
+    def scrape(self, replay_path, end_time, delay=2, scraper=True, exclusive=True):
         """Scrapes a *.rofl file.
         
         Scrapes an individual replay file using the League of Legends
@@ -107,6 +114,9 @@ class ReplayScraper(object):
             replay_path: Full replay filename.
             end_time: Number of seconds to scrape within replay.
             delay: Number of seconds to wait before ending.
+            exclusive: Whether this is the only scrape running on the
+                machine. Non-exclusive scrapes only stop the processes
+                they started instead of every client and scraper.
         """
         replay_fname = replay_path
         replay_path = os.path.join(self.replay_dir, replay_fname)
@@ -114,15 +124,22 @@ class ReplayScraper(object):
         output_fname = os.path.basename(replay_path).replace(".rofl", ".json")
         output_path = os.path.join(self.dataset_dir, output_fname)
         
-        self.run_client(replay_path)
+        client_proc = self.run_client(replay_path)
+        scraper_proc = None
         if scraper:
-            self.run_scraper(output_path, end_time)
+            scraper_proc = self.run_scraper(output_path, end_time)
 
-        if scraper:
-            os.system("taskkill /f /im \"T_T Pandoras Box.exe\"")
-        else:
+        if not scraper:
             time.sleep(60 * 10) # Go to sleep for 10 mins during testing
-        os.system("taskkill /f /im \"League of Legends.exe\"")
+        if exclusive:
+            if scraper:
+                os.system("taskkill /f /im \"T_T Pandoras Box.exe\"")
+            os.system("taskkill /f /im \"League of Legends.exe\"")
+        else:
+            for proc in [scraper_proc, client_proc]:
+                if proc and proc.poll() is None:
+                    proc.kill()
+                    proc.wait()
         time.sleep(delay)
 
     def get_replay_paths(self):
@@ -144,22 +161,10 @@ class ReplayScraper(object):
                 replay_path  = os.path.join(self.replay_dir, replay_fname)
                 print(os.path.join(self.replay_dir, replay_fname))
 
-            with open(replay_path, "rb") as f:
-                f.seek(262)
-                length_field_buffer = f.read(26)
-                metadata_offset = length_field_buffer[6:10]
-                metadata_length = length_field_buffer[10:14]
-
-                metadata_offset = int.from_bytes(metadata_offset, byteorder='little')
-                metadata_length = int.from_bytes(metadata_length, byteorder='little')
-
-                f.seek(metadata_offset)
-                replay_metadata = f.read(metadata_length)
-                replay_metadata = json.loads(str(replay_metadata, encoding="utf-8"))
-                stats_json = json.loads(replay_metadata["statsJson"])
+            if self.index:
+                return self.index.lookup(replay_path)
+            return read_header(replay_path)
 
-                return replay_metadata, stats_json
-            
         except Exception as e:
             print("ERR PROCESSING REPLAY FILE:", str(e))
             return None, None
\ No newline at end of file
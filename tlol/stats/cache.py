@@ -0,0 +1,175 @@
+# MIT License
+# 
+# Copyright (c) 2023 MiscellaneousStuff
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""On-disk cache of u.gg GraphQL responses.
+
+Leaderboard pages and match summaries change slowly, so responses are kept
+in a small SQLite database keyed by the GraphQL operation and its variables.
+Entries expire after a per-operation TTL and the least recently used entries
+are evicted once the cache grows past its size limit. In offline mode only
+cached responses are served."""
+
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+
+CREATE_RESPONSES_TABLE = """CREATE TABLE IF NOT EXISTS responses (
+                            key TEXT PRIMARY KEY,
+                            operation TEXT,
+                            response TEXT,
+                            size INTEGER,
+                            created REAL,
+                            accessed REAL
+                            )"""
+
+CREATE_RESPONSES_INDEX = \
+    "CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)"
+
+# Seconds before a cached response of each operation is refetched
+DEFAULT_TTLS = {
+    "getRankedLeaderboard": 6 * 60 * 60,
+    "FetchMatchSummaries": 24 * 60 * 60
+}
+DEFAULT_TTL = 60 * 60
+
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+
+class CacheMiss(Exception):
+    """Raised when an offline cache doesn't hold a requested response."""
+
+
+def cache_key(body):
+    """Returns the cache key of a GraphQL request body. The query text is
+    left out so rewording a query doesn't invalidate the cache."""
+    key = json.dumps(
+        [body.get("operationName"), body.get("variables")], sort_keys=True)
+    return hashlib.sha1(key.encode()).hexdigest()
+
+
+class ResponseCache(object):
+    """SQLite cache of decoded GraphQL responses. Safe to share between
+    threads.
+
+    Args:
+        db_path: Path of the SQLite cache database. Created if it doesn't
+            exist.
+        ttls: Dict of operation name to TTL in seconds, overriding
+            `DEFAULT_TTLS`.
+        max_bytes: Total response size kept before the least recently used
+            responses are evicted.
+        offline: Serve expired responses and raise `CacheMiss` instead of
+            letting the caller go to the network.
+    """
+    def __init__(self, db_path, ttls=None, max_bytes=DEFAULT_MAX_BYTES, offline=False):
+        self.db_path = db_path
+        self.ttls = dict(DEFAULT_TTLS, **(ttls or {}))
+        self.max_bytes = max_bytes
+        self.offline = offline
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.con = sqlite3.connect(db_path, check_same_thread=False)
+        self.con.execute(CREATE_RESPONSES_TABLE)
+        self.con.execute(CREATE_RESPONSES_INDEX)
+        self.con.commit()
+        self.total_bytes = self.con.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    def ttl(self, operation):
+        return self.ttls.get(operation, DEFAULT_TTL)
+
+    def get(self, body):
+        """Returns the cached response of `body`, or None if it isn't cached
+        or has expired. Raises `CacheMiss` instead of returning None when
+        offline."""
+        key = cache_key(body)
+        now = time.time()
+        with self.lock:
+            row = self.con.execute(
+                "SELECT response, created FROM responses WHERE key = ?",
+                (key,)).fetchone()
+            fresh = row is not None and \
+                (self.offline or now - row[1] < self.ttl(body.get("operationName")))
+            if fresh:
+                self.hits += 1
+                self.con.execute(
+                    "UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+                self.con.commit()
+            else:
+                self.misses += 1
+        if fresh:
+            return json.loads(row[0])
+        if self.offline:
+            raise CacheMiss(f"{body.get('operationName')} {body.get('variables')}")
+        return None
+
+    def put(self, body, response):
+        """Caches the decoded `response` of `body`. Responses containing
+        GraphQL errors aren't cached."""
+        if not isinstance(response, dict) or response.get("errors"):
+            return
+        data = json.dumps(response)
+        key = cache_key(body)
+        now = time.time()
+        with self.lock:
+            replaced = self.con.execute(
+                "SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            self.con.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)",
+                (key, body.get("operationName"), data, len(data), now, now))
+            self.total_bytes += len(data) - (replaced[0] if replaced else 0)
+            self._evict()
+            self.con.commit()
+
+    def _evict(self):
+        if self.total_bytes <= self.max_bytes:
+            return
+        evict = []
+        for key, size in self.con.execute(
+                "SELECT key, size FROM responses ORDER BY accessed"):
+            if self.total_bytes <= self.max_bytes:
+                break
+            evict.append((key,))
+            self.total_bytes -= size
+        self.con.executemany("DELETE FROM responses WHERE key = ?", evict)
+
+    def clear(self, operation=None):
+        """Removes every cached response, or only those of `operation`."""
+        with self.lock:
+            if operation is None:
+                self.con.execute("DELETE FROM responses")
+                self.total_bytes = 0
+            else:
+                self.total_bytes -= self.con.execute(
+                    "SELECT COALESCE(SUM(size), 0) FROM responses "
+                    "WHERE operation = ?", (operation,)).fetchone()[0]
+                self.con.execute(
+                    "DELETE FROM responses WHERE operation = ?", (operation,))
+            self.con.commit()
+
+    def __str__(self):
+        return f"hits: {self.hits}, misses: {self.misses}"
+
+    def close(self):
+        self.con.close()
@@ -0,0 +1,266 @@
+# MIT License
+# 
+# Copyright (c) 2023 MiscellaneousStuff
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""Request scheduling for the u.gg API wrappers.
+
+Retries throttled (429) and failed (5xx or connection error) requests with
+exponential backoff and jitter, honours `Retry-After` headers and adapts the
+number of concurrent requests using additive-increase/multiplicative-decrease
+(AIMD) so large sweeps settle at the highest sustainable request rate."""
+
+import time
+import random
+import asyncio
+import threading
+import email.utils
+
+RETRY_STATUSES = [429, 500, 502, 503, 504]
+THROTTLE_STATUSES = [429, 503]
+
+
+class RequestFailed(Exception):
+    """Raised when a request still fails after all of its retries."""
+
+
+def parse_retry_after(value):
+    """Returns the number of seconds requested by a `Retry-After` header,
+    which is either a number of seconds or an HTTP date."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value).timestamp()
+        return max(0.0, retry_at - time.time())
+    except (TypeError, ValueError):
+        return None
+
+def backoff_delay(attempt, base_delay=0.5, max_delay=30.0, retry_after=None):
+    """Returns how long to wait before retry number `attempt` (from 1),
+    using exponential backoff with full jitter unless the server asked for
+    a specific delay."""
+    if retry_after is not None:
+        return retry_after + random.uniform(0, base_delay)
+    return random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+
+
+class RequestStats(object):
+    """Thread-safe request counters."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests  = 0
+        self.retried   = 0
+        self.throttled = 0
+        self.failed    = 0
+
+    def add(self, **counts):
+        with self.lock:
+            for name, count in counts.items():
+                setattr(self, name, getattr(self, name) + count)
+
+    def as_dict(self):
+        with self.lock:
+            return {
+                "requests":  self.requests,
+                "retried":   self.retried,
+                "throttled": self.throttled,
+                "failed":    self.failed
+            }
+
+    def __str__(self):
+        stats = self.as_dict()
+        return ", ".join(f"{name}: {count}" for name, count in stats.items())
+
+
+class AIMDLimiter(object):
+    """Limits concurrent requests, growing the limit by one for every
+    window of successful requests and halving it when throttled.
+
+    Args:
+        max_concurrency: Upper bound (and initial value) of the limit.
+        min_concurrency: Lower bound of the limit.
+    """
+    def __init__(self, max_concurrency, min_concurrency=1):
+        self.max_concurrency = max(max_concurrency, min_concurrency)
+        self.min_concurrency = min_concurrency
+        self.limit = float(self.max_concurrency)
+        self.active = 0
+        self.cond = threading.Condition()
+
+    def acquire(self):
+        with self.cond:
+            while self.active >= int(self.limit):
+                self.cond.wait()
+            self.active += 1
+
+    def release(self):
+        with self.cond:
+            self.active -= 1
+            self.cond.notify_all()
+
+    def _grow(self):
+        self.limit = min(self.max_concurrency, self.limit + 1 / self.limit)
+
+    def _shrink(self):
+        self.limit = max(self.min_concurrency, self.limit / 2)
+
+    def on_success(self):
+        with self.cond:
+            self._grow()
+            self.cond.notify_all()
+
+    def on_throttle(self):
+        with self.cond:
+            self._shrink()
+
+
+class AsyncAIMDLimiter(AIMDLimiter):
+    """`AIMDLimiter` for coroutines of a single event loop."""
+    def __init__(self, max_concurrency, min_concurrency=1):
+        super().__init__(max_concurrency, min_concurrency)
+        self.cond = None
+
+    def _condition(self):
+        # Created lazily so it belongs to the running event loop
+        if self.cond is None:
+            self.cond = asyncio.Condition()
+        return self.cond
+
+    async def acquire(self):
+        cond = self._condition()
+        async with cond:
+            while self.active >= int(self.limit):
+                await cond.wait()
+            self.active += 1
+
+    async def release(self):
+        cond = self._condition()
+        async with cond:
+            self.active -= 1
+            cond.notify_all()
+
+    async def on_success(self):
+        cond = self._condition()
+        async with cond:
+            self._grow()
+            cond.notify_all()
+
+    async def on_throttle(self):
+        self._shrink()
+
+
+class RequestScheduler(object):
+    """Sends requests through an `AIMDLimiter`, retrying transient failures.
+
+    Args:
+        max_concurrency: Maximum number of requests in flight.
+        max_retries: Number of retries before a request is given up on.
+        base_delay: Base delay of the exponential backoff in seconds.
+        max_delay: Maximum backoff delay in seconds.
+    """
+    limiter_class = AIMDLimiter
+
+    def __init__(self, max_concurrency=1, max_retries=5, base_delay=0.5, max_delay=30.0):
+        self.limiter = self.limiter_class(max_concurrency)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.stats = RequestStats()
+
+    def _retry_delay(self, status, retry_after, error, attempt):
+        """Records a failed attempt, whose response had HTTP `status` (None
+        when no response was received). Returns the delay before the next
+        attempt, or raises `RequestFailed` if the request can't be retried."""
+        if status is not None:
+            if status not in RETRY_STATUSES:
+                self.stats.add(failed=1)
+                raise RequestFailed(f"HTTP {status}")
+            if status in THROTTLE_STATUSES:
+                self.stats.add(throttled=1)
+            error = f"HTTP {status}"
+        if attempt == self.max_retries:
+            self.stats.add(failed=1)
+            raise RequestFailed(str(error))
+        self.stats.add(retried=1)
+        return backoff_delay(attempt + 1, self.base_delay, self.max_delay,
+                             parse_retry_after(retry_after))
+
+    def request(self, send):
+        """Calls `send()`, which must return a `requests.Response`, until it
+        succeeds. Raises `RequestFailed` once the retries are used up or the
+        response is a non-retryable error."""
+        for attempt in range(self.max_retries + 1):
+            self.limiter.acquire()
+            try:
+                resp = send()
+                error = None
+            except Exception as exc:
+                resp = None
+                error = exc
+            finally:
+                self.limiter.release()
+            self.stats.add(requests=1)
+
+            if resp is not None and resp.status_code < 400:
+                self.limiter.on_success()
+                return resp
+
+            status, retry_after = None, None
+            if resp is not None:
+                status = resp.status_code
+                retry_after = resp.headers.get("Retry-After")
+                if status in THROTTLE_STATUSES:
+                    self.limiter.on_throttle()
+            time.sleep(self._retry_delay(status, retry_after, error, attempt))
+
+
+class AsyncRequestScheduler(RequestScheduler):
+    """`RequestScheduler` for asyncio clients, with the same retry, backoff
+    and AIMD policy."""
+    limiter_class = AsyncAIMDLimiter
+
+    async def request(self, send):
+        """Awaits `send()`, which must return a `(status, retry_after,
+        result)` tuple, until it succeeds and returns its `result`. Raises
+        `RequestFailed` once the retries are used up or the response is a
+        non-retryable error."""
+        for attempt in range(self.max_retries + 1):
+            await self.limiter.acquire()
+            try:
+                status, retry_after, result = await send()
+                error = None
+            except Exception as exc:
+                status, retry_after = None, None
+                error = exc
+            finally:
+                await self.limiter.release()
+            self.stats.add(requests=1)
+
+            if status is not None and status < 400:
+                await self.limiter.on_success()
+                return result
+
+            if status in THROTTLE_STATUSES:
+                await self.limiter.on_throttle()
+            await asyncio.sleep(
+                self._retry_delay(status, retry_after, error, attempt))
@@ -32,10 +32,133 @@ u.gg season IDs:
 
 import os
 import json
+import math
 import requests
-import time
 import concurrent.futures
 
+from tlol.stats.scheduler import RequestScheduler
+
+BASE_URL = "https://u.gg/api"
+
+# Match summaries returned per page of a summoner's match history
+MATCHES_PAGE_SIZE = 20
+
+CHAMP_IDS_PATH = os.path.join(
+    os.path.dirname(os.path.realpath(__file__)), "champ_ids.txt")
+
+HEADERS = {
+    "Content-Type": "application/json",
+    "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/16.6 Safari/605.1.15"
+}
+
+LEADERBOARD_QUERY = "query getRankedLeaderboard($page: Int, $queueType: Int, $regionId: String!) {\n  leaderboardPage(page: $page, queueType: $queueType, regionId: $regionId) {\n    totalPlayerCount\n    topPlayerMostPlayedChamp\n    players {\n      iconId\n      losses\n      lp\n      overallRanking\n      rank\n      summonerLevel\n      summonerName\n      tier\n      wins\n      __typename\n    }\n    __typename\n  }\n}\n"
+
+MATCH_SUMMARIES_QUERY = "query FetchMatchSummaries($championId: [Int], $page: Int, $queueType: [Int], $regionId: String!, $role: [Int], $seasonIds: [Int]!, $summonerName: String!) {   fetchPlayerMatchSummaries(     championId: $championId     page: $page     queueType: $queueType     regionId: $regionId     role: $role     seasonIds: $seasonIds     summonerName: $summonerName   ) {     finishedMatchSummaries     totalNumMatches     matchSummaries {       assists       championId       cs       damage       deaths       gold       items       jungleCs       killParticipation       kills       level       matchCreationTime       matchDuration       matchId       maximumKillStreak       primaryStyle       queueType       regionId       role       runes       subStyle       summonerName       summonerSpells       psHardCarry       psTeamPlay       lpInfo {         lp         placement         promoProgress         promoTarget         promotedTo {           tier           rank           __typename         }         __typename       }       teamA {         championId         summonerName         teamId         role         hardCarry         teamplay         __typename       }       teamB {         championId         summonerName         teamId         role         hardCarry         teamplay         __typename       }       version       visionScore       win       __typename     }     __typename   } }"
+
+
+def leaderboard_req_body(page, regionId):
+    return {
+        "operationName": "getRankedLeaderboard",
+        "query": LEADERBOARD_QUERY,
+        "variables": {
+            "page": page,
+            "queueType": 420, # Ranked Solo/Duo
+            "regionId": regionId
+        }
+    }
+
+def match_summaries_req_body(summoner_name, champ_ids, seasonIds, regionId, page=1):
+    return {
+        "operationName": "FetchMatchSummaries",
+        "query": MATCH_SUMMARIES_QUERY,
+        "variables": {
+            "championId": champ_ids,
+            "page": page,
+            "queueType": [420], # 420 = solo/duo
+            "regionId": regionId,
+            "role": [],
+            "seasonIds": seasonIds,
+            "summonerName": summoner_name
+        }
+    }
+
+def filter_match_ids(matches, target_patch, win_only):
+    """Returns the IDs of the match summaries played on `target_patch`."""
+    match_ids = []
+    for match in matches:
+        if type(match) == dict:
+            if "version" in match:
+                if match["version"] == target_patch:
+                    if (win_only and match["win"]) or (not win_only):
+                        match_ids.append(match["matchId"])
+    return match_ids
+
+def patch_version(patch):
+    """Returns a u.gg formatted patch (e.g. "11_23") as a comparable tuple."""
+    try:
+        return tuple(int(part) for part in str(patch).split("_"))
+    except ValueError:
+        return ()
+
+def past_patch(matches, target_patch):
+    """Returns whether a page of match summaries, which are sorted from
+    newest to oldest, already reaches games older than `target_patch`."""
+    target = patch_version(target_patch)
+    for match in reversed(matches):
+        if type(match) == dict and "version" in match:
+            version = patch_version(match["version"])
+            if version:
+                return version < target
+    return False
+
+def write_matches_header(outpath, target_patch, champs, summoner_count):
+    """Beware: Deletes the outpath if it already exists!"""
+    if os.path.exists(outpath):
+        os.remove(outpath)
+    with open(outpath, "a+") as f:
+        f.write(target_patch + "\n")
+        f.write(",".join(champs) + "\n")
+        f.write(f"top {summoner_count} ranked summoners\n")
+
+
+class MatchIdWriter(object):
+    """Collects unique match IDs, streaming new IDs to `outpath` (if given)
+    through a single buffered file handle.
+
+    Beware: Deletes the outpath if it already exists!
+
+    Args:
+        outpath: Match ID list to write, or "" to only collect IDs.
+        target_patch: Patch written to the header of the list.
+        champs: Champions written to the header of the list.
+        summoner_count: Summoner count written to the header of the list.
+    """
+    def __init__(self, outpath, target_patch, champs, summoner_count):
+        self.match_ids = set()
+        self.f = None
+        if outpath:
+            write_matches_header(outpath, target_patch, champs, summoner_count)
+            self.f = open(outpath, "a", buffering=64 * 1024)
+
+    def add(self, match_ids):
+        """Adds `match_ids`, returning how many of them were new."""
+        new_ids = [m for m in match_ids if m not in self.match_ids]
+        self.match_ids.update(new_ids)
+        if self.f and new_ids:
+            self.f.write("".join(f"{match_id}\n" for match_id in new_ids))
+        return len(new_ids)
+
+    def close(self):
+        if self.f:
+            self.f.close()
+            self.f = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
 
 class U_GG_API(object):
     """
@@ -43,14 +166,28 @@ class U_GG_API(object):
     
     Provides methods to get players on the leaderboard, games which a player
     has played, champion statistics and more.
+
+    Requests are retried with exponential backoff when they're throttled
+    or fail, and the number of concurrent requests adapts to the rate the
+    server sustains. After each query, `stats` holds the request counters
+    and `failed` holds the pages or summoners which permanently failed.
+
+    Args:
+        base_url: u.gg GraphQL API endpoint.
+        max_retries: Number of retries before a request is given up on.
+        cache: (Optional) `ResponseCache` queries are served from first.
     """
-    def __init__(self):
-        cur_path = os.path.dirname(os.path.realpath(__file__))
-        self.champ_ids = self.get_champ_ids(
-            os.path.join(cur_path, "champ_ids.txt"))
-        self.base_url = "https://u.gg/api"
+    def __init__(self, base_url=BASE_URL, max_retries=5, cache=None):
+        self.champ_ids = self.get_champ_ids(CHAMP_IDS_PATH)
+        self.base_url = base_url
+        self.max_retries = max_retries
+        self.cache = cache
+        self.session = requests.Session()
+        self.stats = None
+        self.failed = []
 
-    def get_champ_ids(self, path):
+    @staticmethod
+    def get_champ_ids(path):
         """Returns champion name to ID mappings used within the Riot API."""
         champ_ids = {}
         with open(path) as f:
@@ -61,37 +198,36 @@ class U_GG_API(object):
 
     def get_leaderboard(self, page_start=1, page_end=1, regionId="euw1", max_workers=1, delay=0.5):
         """Returns a list of summoner names from the Ranked Solo/Duo
-        leaderboard for a specified region. Supports multiple workers."""
+        leaderboard for a specified region. Supports multiple workers.
+        `delay` is the base delay of the retry backoff."""
         players = []
-        req_body = lambda p: {
-            "operationName": "getRankedLeaderboard",
-            "query": "query getRankedLeaderboard($page: Int, $queueType: Int, $regionId: String!) {\n  leaderboardPage(page: $page, queueType: $queueType, regionId: $regionId) {\n    totalPlayerCount\n    topPlayerMostPlayedChamp\n    players {\n      iconId\n      losses\n      lp\n      overallRanking\n      rank\n      summonerLevel\n      summonerName\n      tier\n      wins\n      __typename\n    }\n    __typename\n  }\n}\n",
-            "variables": {
-                "page": p,
-                "queueType": 420, # Ranked Solo/Duo
-                "regionId": regionId
-            }
-        }
+        failed_pages = []
+        scheduler = RequestScheduler(
+            max_concurrency=max_workers,
+            max_retries=self.max_retries,
+            base_delay=delay)
 
         with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
-            future_to_summoner_name = (executor.submit(
-                self.handle_req,
-                self.base_url,
-                req_body(page),
-                delay
-            ) for page in range(page_start, page_end+1))
-            for future in concurrent.futures.as_completed(future_to_summoner_name):
+            future_to_page = {executor.submit(
+                self.query,
+                leaderboard_req_body(page, regionId),
+                scheduler
+            ): page for page in range(page_start, page_end+1)}
+            for future in concurrent.futures.as_completed(future_to_page):
                 try:
                     data = future.result()
-                    # print("DATA:", data, data.text)
-                    data = json.loads(data.content)
-                    # print("DATA:", data)
-                    data = data["data"]["leaderboardPage"]["players"]
+                    players += data["data"]["leaderboardPage"]["players"]
                 except Exception as exc:
-                    data = str(type(exc))
-                    # print("ERR:", data)
-                finally:
-                    players += data
+                    failed_pages.append(future_to_page[future])
+                    print("ERR:", future_to_page[future], str(exc))
+
+        self.stats = scheduler.stats
+        self.failed = sorted(failed_pages)
+        print(f"Leaderboard pages: {len(future_to_page)} ({self.stats})")
+        if self.cache:
+            print(f"Response cache: {self.cache}")
+        if failed_pages:
+            print("Failed leaderboard pages:", self.failed)
 
         return players
     
@@ -104,74 +240,105 @@ class U_GG_API(object):
             max_workers=1,
             seasonIds=[16],
             delay=0.5,
-            regionId="euw1"):
+            regionId="euw1",
+            max_pages=None,
+            lookahead=2):
         """
-        Returns a list of unique Game IDs matching the given criteria.
-        Only checks the first page of search results to simply the requests.
+        Returns a set of unique Game IDs matching the given criteria.
+        Follows the pages of each summoner's match history until every
+        match has been seen, a page reaches games older than `target_patch`
+        or `max_pages` pages have been fetched. Up to `lookahead` pages of a
+        summoner are requested ahead of the page being processed, and pages
+        of different summoners are fetched concurrently.
+        `delay` is the base delay of the retry backoff.
         Beware: Deletes the outpath if it already exists!
         """
-        match_ids = set()
-        matches_req_body = lambda summoner_name: {
-            "operationName": "FetchMatchSummaries",
-            "query": "query FetchMatchSummaries($championId: [Int], $page: Int, $queueType: [Int], $regionId: String!, $role: [Int], $seasonIds: [Int]!, $summonerName: String!) {   fetchPlayerMatchSummaries(     championId: $championId     page: $page     queueType: $queueType     regionId: $regionId     role: $role     seasonIds: $seasonIds     summonerName: $summonerName   ) {     finishedMatchSummaries     totalNumMatches     matchSummaries {       assists       championId       cs       damage       deaths       gold       items       jungleCs       killParticipation       kills       level       matchCreationTime       matchDuration       matchId       maximumKillStreak       primaryStyle       queueType       regionId       role       runes       subStyle       summonerName       summonerSpells       psHardCarry       psTeamPlay       lpInfo {         lp         placement         promoProgress         promoTarget         promotedTo {           tier           rank           __typename         }         __typename       }       teamA {         championId         summonerName         teamId         role         hardCarry         teamplay         __typename       }       teamB {         championId         summonerName         teamId         role         hardCarry         teamplay         __typename       }       version       visionScore       win       __typename     }     __typename   } }",
-            "variables": {
-                "championId": [self.champ_ids[c] for c in champs],
-                "page": 1, # Finds max of 20 games of a single champ per patch (people rarely play more than this so to keep the code much simpler, I'm only checking a maximum of 20 games of the same champion per summoner per patch.)
-                "queueType": [420], # 420 = solo/duo
-                "regionId": regionId,
-                "role": [],
-                "seasonIds": seasonIds,
-                "summonerName": summoner_name
-            }
-        }
-        if outpath:
-            if os.path.exists(outpath):
-                os.remove(outpath)
-            with open(outpath, "a+") as f:
-                f.write(target_patch + "\n")
-                f.write(",".join(champs) + "\n")
-                f.write(f"top {len(summoner_names)} ranked summoners\n")
-        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
-            future_to_match_id = (executor.submit(
-                self.handle_req,
-                self.base_url,
-                matches_req_body(name),
-                delay
-            ) for name in summoner_names)
-            for future in concurrent.futures.as_completed(future_to_match_id):
-                try:
-                    a_data = future.result()
-                    b_data = json.loads(a_data.content)
-                    data = b_data["data"]["fetchPlayerMatchSummaries"]["matchSummaries"]
-                except Exception as exc:
-                    data = None
-                finally:
-                    # print("data:", data)
-                    if data == None:
-                        pass
-                    else:
-                        for match in data:
-                            if type(match) == dict:
-                                if "version" in match:
-                                    if match["version"] == target_patch:
-                                        if (win_only and match["win"]) or (not win_only):
-                                            match_ids.add(match["matchId"])
-                                            if outpath:
-                                                with open(outpath, "a+") as f:
-                                                    f.write(str(match["matchId"]) + "\n")
+        failed_summoners = set()
+        champ_ids = [self.champ_ids[c] for c in champs]
+        scheduler = RequestScheduler(
+            max_concurrency=max_workers,
+            max_retries=self.max_retries,
+            base_delay=delay)
+        matches_req_body = lambda summoner_name, page: match_summaries_req_body(
+            summoner_name, champ_ids, seasonIds, regionId, page=page)
+
+        # Next page to request and last page of each summoner's history
+        next_page = {}
+        last_page = {}
+        pages = 0
+
+        with MatchIdWriter(outpath, target_patch, champs, len(summoner_names)) as writer, \
+             concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            pending = {}
+
+            def submit(name, count):
+                while count > 0 and next_page[name] <= last_page[name]:
+                    page = next_page[name]
+                    future = executor.submit(
+                        self.query, matches_req_body(name, page), scheduler)
+                    pending[future] = (name, page)
+                    next_page[name] += 1
+                    count -= 1
+
+            for name in dict.fromkeys(summoner_names):
+                next_page[name] = 1
+                last_page[name] = 1
+                submit(name, 1)
+
+            while pending:
+                done, _ = concurrent.futures.wait(
+                    pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    name, page = pending.pop(future)
+                    pages += 1
+                    try:
+                        b_data = future.result()
+                        summaries = b_data["data"]["fetchPlayerMatchSummaries"]
+                        data = summaries["matchSummaries"] or []
+                    except Exception as exc:
+                        failed_summoners.add(name)
+                        print("ERR:", name, page, str(exc))
+                        continue
+                    writer.add(filter_match_ids(data, target_patch, win_only))
+
+                    if page == 1:
+                        total = summaries.get("totalNumMatches") or 0
+                        last_page[name] = max(1, math.ceil(total / MATCHES_PAGE_SIZE))
+                        if max_pages:
+                            last_page[name] = min(last_page[name], max_pages)
+                    if not data or past_patch(data, target_patch):
+                        last_page[name] = min(last_page[name], page)
+                    submit(name, lookahead if page == 1 else 1)
+
+            match_ids = writer.match_ids
+
+        self.stats = scheduler.stats
+        self.failed = sorted(failed_summoners)
+        print(f"Summoners: {len(summoner_names)}, pages: {pages}, "
+              f"matches: {len(match_ids)} ({self.stats})")
+        if self.cache:
+            print(f"Response cache: {self.cache}")
+        if failed_summoners:
+            print("Failed summoners:", self.failed)
+
         return match_ids
 
-    def handle_req(self, url, body, delay=0.5):
-        # print(url, body)
-        req = requests.request(
-            'POST',
+    def query(self, body, scheduler):
+        """Sends a GraphQL query through `scheduler` and returns the
+        decoded JSON response, unless the response is already cached."""
+        if self.cache:
+            data = self.cache.get(body)
+            if data is not None:
+                return data
+        req = scheduler.request(
+            lambda: self.handle_req(self.base_url, body))
+        data = json.loads(req.content)
+        if self.cache:
+            self.cache.put(body, data)
+        return data
+
+    def handle_req(self, url, body):
+        return self.session.post(
             url,
             data=json.dumps(body),
-            headers={
-                "Content-Type": "application/json",
-                "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/16.6 Safari/605.1.15"
-            }
-        )
-        time.sleep(delay)
-        # print(url) # , req.body)
-        return req
\ No newline at end of file
+            headers=HEADERS)
@@ -0,0 +1,227 @@
+# MIT License
+# 
+# Copyright (c) 2023 MiscellaneousStuff
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""Asyncio u.gg API wrapper.
+
+Provides the same leaderboard and match queries as `U_GG_API`, but shares
+one keep-alive connection pool between every request and paces requests
+with a token bucket rate limiter instead of sleeping after each request.
+Throttled and failed requests are retried with the same backoff and AIMD
+concurrency policy as the threaded client.
+
+Requires the `aiohttp` package."""
+
+import math
+import time
+import asyncio
+
+import aiohttp
+
+from tlol.stats.scheduler import AsyncRequestScheduler
+from tlol.stats.u_gg import \
+    BASE_URL, CHAMP_IDS_PATH, HEADERS, MATCHES_PAGE_SIZE, \
+    U_GG_API, MatchIdWriter, \
+    leaderboard_req_body, match_summaries_req_body, \
+    filter_match_ids, past_patch
+
+
+class TokenBucket(object):
+    """Token bucket rate limiter.
+
+    Args:
+        rate: Tokens added per second, i.e. the sustained request rate.
+        capacity: Maximum number of tokens, i.e. the largest burst.
+    """
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(
+            self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self):
+        async with self.lock:
+            self._refill()
+            while self.tokens < 1:
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+                self._refill()
+            self.tokens -= 1
+
+
+class AsyncU_GG_API(object):
+    """
+    Asyncio u.gg API wrapper. Must be used as an async context manager so
+    the connection pool is closed afterwards:
+
+        async with AsyncU_GG_API(rate=4) as u_gg:
+            players = await u_gg.get_leaderboard(page_end=10)
+
+    Args:
+        base_url: u.gg GraphQL API endpoint.
+        rate: Maximum sustained requests per second.
+        burst: Maximum number of requests sent in a single burst.
+        max_connections: Size of the shared connection pool.
+        cache: (Optional) `ResponseCache` queries are served from first.
+        max_retries: Number of retries before a request is given up on.
+        base_delay: Base delay of the retry backoff in seconds.
+
+    After each query, `stats` holds the request counters and `failed` holds
+    the pages or summoners which permanently failed.
+    """
+    def __init__(self, base_url=BASE_URL, rate=2.0, burst=1, max_connections=10, cache=None,
+                 max_retries=5, base_delay=0.5):
+        self.champ_ids = U_GG_API.get_champ_ids(CHAMP_IDS_PATH)
+        self.base_url = base_url
+        self.rate = rate
+        self.burst = burst
+        self.max_connections = max_connections
+        self.cache = cache
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.session = None
+        self.bucket = None
+        self.stats = None
+        self.failed = []
+
+    def _scheduler(self):
+        return AsyncRequestScheduler(
+            max_concurrency=self.max_connections,
+            max_retries=self.max_retries,
+            base_delay=self.base_delay)
+
+    async def __aenter__(self):
+        self.bucket = TokenBucket(self.rate, self.burst)
+        self.session = aiohttp.ClientSession(
+            headers=HEADERS,
+            connector=aiohttp.TCPConnector(limit=self.max_connections))
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.session.close()
+        self.session = None
+
+    async def handle_req(self, body, scheduler):
+        """Sends a GraphQL query through `scheduler` and returns the decoded
+        JSON response, unless the response is already cached."""
+        if self.cache:
+            data = self.cache.get(body)
+            if data is not None:
+                return data
+
+        async def send():
+            await self.bucket.acquire()
+            async with self.session.post(self.base_url, json=body) as resp:
+                if resp.status >= 400:
+                    return resp.status, resp.headers.get("Retry-After"), None
+                return resp.status, None, await resp.json(content_type=None)
+
+        data = await scheduler.request(send)
+        if self.cache:
+            self.cache.put(body, data)
+        return data
+
+    async def get_leaderboard(self, page_start=1, page_end=1, regionId="euw1"):
+        """Returns a list of summoner names from the Ranked Solo/Duo
+        leaderboard for a specified region."""
+        scheduler = self._scheduler()
+        failed_pages = []
+
+        async def get_page(page):
+            try:
+                data = await self.handle_req(
+                    leaderboard_req_body(page, regionId), scheduler)
+                return data["data"]["leaderboardPage"]["players"]
+            except Exception as exc:
+                failed_pages.append(page)
+                print("ERR:", page, str(exc))
+                return []
+
+        pages = await asyncio.gather(*[
+            get_page(page) for page in range(page_start, page_end+1)])
+
+        self.stats = scheduler.stats
+        self.failed = sorted(failed_pages)
+        print(f"Leaderboard pages: {len(pages)} ({self.stats})")
+        if failed_pages:
+            print("Failed leaderboard pages:", self.failed)
+        return [player for players in pages for player in players]
+
+    async def get_matches(self,
+            summoner_names,
+            champs,
+            target_patch,
+            outpath="",
+            win_only=False,
+            seasonIds=[16],
+            regionId="euw1",
+            max_pages=None):
+        """
+        Returns a set of unique Game IDs matching the given criteria.
+        Follows the pages of each summoner's match history until every
+        match has been seen, a page reaches games older than `target_patch`
+        or `max_pages` pages have been fetched.
+        Beware: Deletes the outpath if it already exists!
+        """
+        champ_ids = [self.champ_ids[c] for c in champs]
+        scheduler = self._scheduler()
+        failed_summoners = set()
+
+        async def get_summoner(summoner_name, writer):
+            page, last_page = 1, 1
+            while page <= last_page:
+                try:
+                    data = await self.handle_req(match_summaries_req_body(
+                        summoner_name, champ_ids, seasonIds, regionId, page=page),
+                        scheduler)
+                    summaries = data["data"]["fetchPlayerMatchSummaries"]
+                    data = summaries["matchSummaries"] or []
+                except Exception as exc:
+                    failed_summoners.add(summoner_name)
+                    print("ERR:", summoner_name, page, str(exc))
+                    return
+                writer.add(filter_match_ids(data, target_patch, win_only))
+                if page == 1:
+                    total = summaries.get("totalNumMatches") or 0
+                    last_page = max(1, math.ceil(total / MATCHES_PAGE_SIZE))
+                    if max_pages:
+                        last_page = min(last_page, max_pages)
+                if not data or past_patch(data, target_patch):
+                    return
+                page += 1
+
+        with MatchIdWriter(outpath, target_patch, champs, len(summoner_names)) as writer:
+            await asyncio.gather(*[
+                get_summoner(name, writer) for name in dict.fromkeys(summoner_names)])
+            match_ids = writer.match_ids
+
+        self.stats = scheduler.stats
+        self.failed = sorted(failed_summoners)
+        print(f"Summoners: {len(summoner_names)}, "
+              f"matches: {len(match_ids)} ({self.stats})")
+        if failed_summoners:
+            print("Failed summoners:", self.failed)
+        return match_ids